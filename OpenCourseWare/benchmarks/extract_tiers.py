@@ -0,0 +1,98 @@
+"""
+Compare the full pymupdf4llm extractor with the tiered extractor on a folder of pdfs.
+
+Run from the OpenCourseWare directory:
+
+    uv run python -m benchmarks.extract_tiers corpus/static_resources --json tiers.json
+
+Fidelity is the F1 overlap of the words both extractors produce, with markdown
+markup stripped, so 1.0 means the fast path lost no text.
+"""
+import argparse
+import json
+import re
+import time
+from collections import Counter
+from pathlib import Path
+
+from extract_pdf import extract_pdf, extract_pdf_tiered, pdf_page_count
+
+MARKUP = re.compile(r"[#*_`|>\-]+")
+
+
+def words(text: str) -> Counter:
+    return Counter(MARKUP.sub(" ", text).lower().split())
+
+
+def fidelity(reference: str, candidate: str) -> float:
+    expected, actual = words(reference), words(candidate)
+    if not expected and not actual:
+        return 1.0
+    overlap = sum((expected & actual).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(actual.values())
+    recall = overlap / sum(expected.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(pdf_dir: Path, limit: int = None) -> dict:
+    paths = sorted(pdf_dir.rglob("*.pdf"))[:limit]
+    files = []
+    for path in paths:
+        layout_text, layout_seconds = timed(extract_pdf, str(path))
+        (tiered_text, tier), tiered_seconds = timed(extract_pdf_tiered, str(path))
+        files.append(
+            dict(
+                file=path.name,
+                pages=pdf_page_count(str(path)),
+                tier=tier,
+                layout_seconds=round(layout_seconds, 4),
+                tiered_seconds=round(tiered_seconds, 4),
+                speedup=round(layout_seconds / tiered_seconds, 2) if tiered_seconds else None,
+                fidelity=round(fidelity(layout_text, tiered_text), 4),
+            )
+        )
+        print(
+            f"{path.name[:40]:40} {files[-1]['pages']:>5}p {tier:>6} "
+            f"{layout_seconds:8.3f}s {tiered_seconds:8.3f}s "
+            f"x{files[-1]['speedup'] or 0:<6} fidelity {files[-1]['fidelity']:.3f}"
+        )
+
+    layout_total = sum(f["layout_seconds"] for f in files)
+    tiered_total = sum(f["tiered_seconds"] for f in files)
+    pages = sum(f["pages"] for f in files)
+    summary = dict(
+        files=len(files),
+        pages=pages,
+        tiers=dict(Counter(f["tier"] for f in files)),
+        layout_seconds=round(layout_total, 3),
+        tiered_seconds=round(tiered_total, 3),
+        layout_pages_per_second=round(pages / layout_total, 2) if layout_total else None,
+        tiered_pages_per_second=round(pages / tiered_total, 2) if tiered_total else None,
+        mean_fidelity=round(sum(f["fidelity"] for f in files) / len(files), 4) if files else None,
+    )
+    print(json.dumps(summary, indent=2))
+    return dict(summary=summary, files=files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("pdf_dir", type=Path, help="folder searched recursively for pdfs")
+    parser.add_argument("--limit", type=int, help="only the first n pdfs")
+    parser.add_argument("--json", type=Path, help="write per file results here")
+    args = parser.parse_args()
+
+    results = run(args.pdf_dir, args.limit)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
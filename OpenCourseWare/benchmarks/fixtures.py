@@ -0,0 +1,149 @@
+"""
+Synthetic OCW style course zips for benchmarks.
+
+The layout matches what CourseContext reads out of a real course download: a root
+data.json, one resources/<slug>/data.json per resource pointing at its file, and
+the files themselves in static_resources/.
+"""
+import json
+import random
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+import fitz
+
+COMPLEXITIES = ("plain", "mixed", "layout")
+
+WORDS = (
+    "beam stress strain force moment inertia velocity acceleration torque energy "
+    "momentum fluid pressure viscosity flow heat transfer entropy boundary layer "
+    "deflection shear modulus elastic plastic fatigue vibration damping frequency"
+).split()
+
+
+def make_pdf(pages: int, complexity: str = "plain", rng: Optional[random.Random] = None) -> bytes:
+    """
+    Pdf of running text, with headings, table grids and images mixed in by complexity
+
+    Args:
+        pages (int): Page count
+        complexity (str): plain (text only), mixed (every other page has a heading,
+            a table and an image) or layout (every page does)
+        rng (Random): Source of the filler text
+    """
+    rng = rng or random.Random(0)
+    image = _image()
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        structured = complexity == "layout" or (complexity == "mixed" and page_number % 2)
+        top = 72
+        if structured:
+            page.insert_text((72, top), f"Section {page_number + 1}", fontsize=18)
+            top += 24
+
+        text = " ".join(rng.choice(WORDS) for _ in range(180 if structured else 420))
+        page.insert_textbox(fitz.Rect(72, top, 540, 420 if structured else 760), text, fontsize=10)
+
+        if structured:
+            for row in range(6):
+                for col in range(4):
+                    cell = fitz.Rect(72 + col * 110, 440 + row * 20, 182 + col * 110, 460 + row * 20)
+                    page.draw_rect(cell)
+                    page.insert_text((cell.x0 + 4, cell.y1 - 6), f"{rng.random():.3f}", fontsize=8)
+            page.insert_image(fitz.Rect(72, 580, 232, 740), stream=image)
+
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def _image() -> bytes:
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 160, 160), False)
+    pixmap.set_rect(pixmap.irect, (40, 90, 160))
+    return pixmap.tobytes("png")
+
+
+def make_course_zip(
+    path: Path,
+    lectures: int = 10,
+    problem_sets: int = 5,
+    readings: int = 5,
+    pages: int = 10,
+    complexity: str = "plain",
+    media_bytes: int = 0,
+    course_number: str = "2.999",
+    seed: int = 0,
+) -> dict:
+    """
+    Write a synthetic course zip
+
+    Args:
+        path (Path): Zip to write
+        lectures (int): Lecture note pdfs
+        problem_sets (int): Problem sets, each a hwNN.pdf and hwNN_sol.pdf
+        readings (int): Reading pdfs
+        pages (int): Pages per pdf
+        complexity (str): One of COMPLEXITIES, see make_pdf
+        media_bytes (int): Size of an incompressible video resource that is never read
+        course_number (str): primary_course_number of the course
+        seed (int): Seed of the filler text
+
+    Returns:
+        dict: Description of the fixture, pdf count, pages and sizes
+    """
+    if complexity not in COMPLEXITIES:
+        raise Exception(f"unknown complexity {complexity}, expected one of {COMPLEXITIES}")
+
+    rng = random.Random(seed)
+    resources = []
+    resources += [("Lecture Notes", f"lec{i + 1:02}.pdf") for i in range(lectures)]
+    for i in range(problem_sets):
+        resources += [("Assignments", f"hw{i + 1:02}.pdf"), ("Assignments", f"hw{i + 1:02}_sol.pdf")]
+    resources += [("Readings", f"reading{i + 1:02}.pdf") for i in range(readings)]
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pdf_bytes = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("data.json", json.dumps({
+            "course_title": f"Synthetic Course {course_number}",
+            "course_description": "Generated for benchmarks",
+            "year": "2024",
+            "term": "Fall",
+            "level": ["Undergraduate"],
+            "topics": [["Engineering", "Mechanical Engineering"]],
+            "primary_course_number": course_number,
+            "instructors": [],
+            "learning_resource_types": sorted({kind for kind, _ in resources}),
+        }))
+
+        for index, (kind, file_name) in enumerate(resources):
+            data = make_pdf(pages, complexity, rng)
+            pdf_bytes += len(data)
+            zip_file.writestr(f"static_resources/{file_name}", data)
+            zip_file.writestr(
+                f"resources/resource-{index}/data.json",
+                json.dumps({"learning_resource_types": [kind], "file": f"/courses/synthetic/{file_name}"}),
+            )
+
+        if media_bytes:
+            zip_file.writestr(
+                "static_resources/lecture-video.mp4", rng.randbytes(media_bytes),
+                compress_type=zipfile.ZIP_STORED,
+            )
+            zip_file.writestr(
+                "resources/lecture-video/data.json",
+                json.dumps({"learning_resource_types": ["Lecture Videos"], "file": "/courses/synthetic/lecture-video.mp4"}),
+            )
+
+    return dict(
+        path=str(path),
+        pdfs=len(resources),
+        pages=len(resources) * pages,
+        pdf_bytes=pdf_bytes,
+        zip_bytes=path.stat().st_size,
+        complexity=complexity,
+        media_bytes=media_bytes,
+    )
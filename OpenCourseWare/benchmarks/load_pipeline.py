@@ -0,0 +1,143 @@
+"""
+Run OpenCourseWarePipeline end to end against the local OCW stand-in server.
+
+Run from the OpenCourseWare directory:
+
+    uv run python -m benchmarks.load_pipeline --courses 10,100,1000 --latency 0.05 --rate-limit 100 --json load.json
+
+For every course count the stand-in serves that many synthetic courses and the
+pipeline crawls all of them into a throwaway SQLite database (or --database-url).
+Wall time, courses/s, per stage busy time and throughput, and the stand-in's
+request, fault and byte counts are reported per run, with the per stage metrics
+of the pipeline in the --json output.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.standin_server import add_server_arguments, server_from_args
+
+
+def run_once(args, courses: int, work_dir: Path) -> dict:
+    from metrics import Metrics
+    from pipeline import OpenCourseWarePipeline
+    from scraper import Scraper
+
+    standin = server_from_args(args, courses=courses).start()
+    corpus_dir = work_dir / f"corpus-{courses}"
+    out_dir = work_dir / f"out-{courses}"
+    metrics = Metrics()
+    try:
+        pipeline = OpenCourseWarePipeline(
+            size=courses,
+            max_concurrent_courses=args.max_concurrent_courses,
+            max_workers=args.max_workers,
+            selective_extract=args.selective_extract,
+            tiered_extract=args.tiered,
+            export_pdf=args.export_pdf,
+            stage_workers={"persist": args.persist_workers},
+            scraper=Scraper(host=standin.base_url, api_url=standin.api_url, metrics=metrics),
+            requests_per_second=args.requests_per_second,
+            max_per_host=args.max_per_host,
+            corpus_dir=corpus_dir,
+            out_dir=out_dir,
+            metrics=metrics,
+            metrics_path=args.metrics_dir / f"load-{courses}.prom" if args.metrics_dir else None,
+        )
+        start = time.perf_counter()
+        try:
+            stats = pipeline.run()
+        except Exception as e:
+            stats = dict(pipeline.pipeline_stats, error=str(e))
+        wall = time.perf_counter() - start
+    finally:
+        standin.stop()
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    stages = {}
+    for name, stage in stats.get("stages", {}).items():
+        stages[name] = dict(
+            processed=stage["processed"],
+            failed=stage["failed"],
+            busy_seconds=round(stage["seconds"], 3),
+            courses_per_busy_second=(
+                round(stage["processed"] / stage["seconds"], 2) if stage["seconds"] else None
+            ),
+        )
+
+    result = dict(
+        courses=courses,
+        wall_seconds=round(wall, 3),
+        courses_per_second=round(stats.get("successful", 0) / wall, 3) if wall else None,
+        successful=stats.get("successful", 0),
+        failed=stats.get("failed", 0),
+        error=stats.get("error"),
+        stages=stages,
+        server=dict(standin.stats),
+        metrics=metrics.summary(),
+    )
+    print(
+        f"{courses:>6} courses: {result['wall_seconds']:.1f}s wall, "
+        f"{result['courses_per_second']} courses/s, "
+        f"{result['successful']} ok / {result['failed']} failed, "
+        f"{standin.stats.get('status_429', 0)} 429s"
+    )
+    for name, stage in stages.items():
+        print(
+            f"         {name:10} {stage['processed']:>6} done {stage['failed']:>4} failed "
+            f"{stage['busy_seconds']:>9.2f}s busy {stage['courses_per_busy_second']} courses/busy s"
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--courses", default="10,100,1000", help="comma separated course counts")
+    add_server_arguments(parser)
+    parser.add_argument("--max-concurrent-courses", type=int, default=4, help="default workers per stage")
+    parser.add_argument("--persist-workers", type=int, default=1, help="SQLite allows one writer")
+    parser.add_argument("--max-workers", type=int, help="extraction process pool size")
+    parser.add_argument("--requests-per-second", type=float, default=100.0,
+                        help="scraper download link lookups per second")
+    parser.add_argument("--max-per-host", type=int, default=8)
+    parser.add_argument("--selective-extract", action="store_true")
+    parser.add_argument("--tiered", action="store_true")
+    parser.add_argument("--export-pdf", action="store_true")
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", type=Path, help="write results here")
+    parser.add_argument("--metrics-dir", type=Path, help="write Prometheus metrics of each run here")
+    args = parser.parse_args()
+    counts = [int(count) for count in str(args.courses).split(",")]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="ocw-load-"))
+    # database.session builds its engine from the environment on import
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{work_dir / 'load.db'}"
+    from database.models import Base
+    from database.session import engine
+
+    Base.metadata.create_all(engine)
+    logging.getLogger().setLevel(args.log_level)
+    # pipeline configures logging on import
+    import pipeline  # noqa: F401
+    logging.getLogger().setLevel(args.log_level)
+
+    try:
+        results = [run_once(args, count, work_dir) for count in counts]
+    finally:
+        engine.dispose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(dict(options=vars(args), runs=results), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
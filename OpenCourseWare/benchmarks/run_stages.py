@@ -0,0 +1,207 @@
+"""
+Time every CourseContext stage on a synthetic course zip.
+
+Run from the OpenCourseWare directory:
+
+    uv run python -m benchmarks.run_stages --pages 20 --complexity mixed --json results/head.json
+    uv run python -m benchmarks.run_stages --compare results/base.json results/head.json
+
+Stages are unzip, contextualize, batch_problem_sets, extract, persist (course and
+resource rows into --database-url, a throwaway SQLite file by default), export_pdf
+and extract_with_pdfs (extract and export_pdf together on one pool). Each runs
+--repeat times on a fresh corpus and the median is reported with pages/s and MB/s.
+Results are written as JSON so runs of different versions can be compared with
+--compare.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.fixtures import COMPLEXITIES, make_course_zip
+
+STAGES = (
+    "unzip", "contextualize", "batch_problem_sets", "extract", "persist", "export_pdf", "extract_with_pdfs",
+)
+
+
+def run(args) -> dict:
+    work_dir = Path(tempfile.mkdtemp(prefix="ocw-bench-"))
+    database_url = args.database_url or f"sqlite:///{work_dir / 'bench.db'}"
+    # database.session builds its engine from the environment on import
+    os.environ["DATABASE_URL"] = database_url
+
+    import fitz
+    import pymupdf4llm
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from course_context import CourseContext
+    from database.models import Base
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    fixture = make_course_zip(
+        work_dir / "course.zip",
+        lectures=args.lectures,
+        problem_sets=args.problem_sets,
+        readings=args.readings,
+        pages=args.pages,
+        complexity=args.complexity,
+        media_bytes=int(args.media_mb * 1024 * 1024),
+    )
+    print(f"fixture: {fixture['pdfs']} pdfs, {fixture['pages']} pages, {fixture['zip_bytes']} zip bytes")
+
+    runs = {stage: [] for stage in STAGES}
+    try:
+        for repeat in range(args.repeat):
+            course = CourseContext(
+                download_url=fixture["path"],
+                url=f"https://ocw.mit.edu/courses/synthetic-{repeat}",
+                db_session=Session(),
+                max_workers=args.max_workers,
+                corpus_path=work_dir / f"corpus-{repeat}",
+                out_dir=work_dir / f"out-{repeat}",
+                selective_extract=args.selective_extract,
+                tiered_extract=args.tiered,
+                optimize_pdf=args.optimize_pdf,
+            )
+            shutil.copyfile(fixture["path"], course._zip_path)
+
+            timings = {}
+            timings["unzip"] = _timed(course._extract_zip_file)
+            timings["contextualize"] = _timed(
+                course._get_course_info, course._build_manifest, course._get_assignments,
+                course._get_lectures, course._get_readings,
+            )
+            timings["batch_problem_sets"] = _timed(course._batch_problem_sets)
+            timings["extract"] = _timed(course.extract_texts)
+            timings["persist"] = _timed(course.save_course, course.extract_resources)
+            timings["export_pdf"] = _timed(course.extract_all_as_pdf)
+            # extraction and merge of every pdf together, as extract_all and the pipeline
+            # with export_pdf run them, from a clean slate
+            course._clear_course_out_dir()
+            course.extracted_texts = {}
+            course.extraction_tiers = {}
+            timings["extract_with_pdfs"] = _timed(course.extract_texts_and_pdfs)
+            course.session.close()
+
+            for stage, seconds in timings.items():
+                runs[stage].append(seconds)
+            print(f"run {repeat + 1}: " + ", ".join(f"{s} {t:.3f}s" for s, t in timings.items()))
+    finally:
+        engine.dispose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # bytes each stage works through: the zip for unzip, the pdfs for everything after
+    stage_bytes = {stage: fixture["pdf_bytes"] for stage in STAGES}
+    stage_bytes["unzip"] = fixture["zip_bytes"]
+    stages = {}
+    for stage, seconds in runs.items():
+        median = statistics.median(seconds)
+        stages[stage] = dict(
+            seconds=round(median, 4),
+            runs=[round(s, 4) for s in seconds],
+            pages_per_second=round(fixture["pages"] / median, 2) if median else None,
+            mb_per_second=round(stage_bytes[stage] / 1024**2 / median, 2) if median else None,
+        )
+
+    fixture.pop("path")
+    return dict(
+        meta=dict(
+            timestamp=datetime.now().isoformat(),
+            git_commit=_git_commit(),
+            python=platform.python_version(),
+            pymupdf=fitz.VersionBind,
+            pymupdf4llm=pymupdf4llm.__version__,
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            database=engine.dialect.name,
+        ),
+        options=dict(
+            repeat=args.repeat,
+            max_workers=args.max_workers,
+            selective_extract=args.selective_extract,
+            tiered=args.tiered,
+            optimize_pdf=args.optimize_pdf,
+        ),
+        fixture=fixture,
+        stages=stages,
+    )
+
+
+def _timed(*steps) -> float:
+    start = time.perf_counter()
+    for step in steps:
+        step()
+    return time.perf_counter() - start
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_path: Path, head_path: Path):
+    """Print per stage median seconds of two result files and the speedup of head"""
+    base = json.loads(Path(base_path).read_text())
+    head = json.loads(Path(head_path).read_text())
+    print(f"{'stage':20} {'base s':>10} {'head s':>10} {'speedup':>8}")
+    for stage in STAGES:
+        if stage not in base["stages"] or stage not in head["stages"]:
+            continue
+        before = base["stages"][stage]["seconds"]
+        after = head["stages"][stage]["seconds"]
+        speedup = before / after if after else float("inf")
+        print(f"{stage:20} {before:10.4f} {after:10.4f} {speedup:7.2f}x")
+    shape = ("pdfs", "pages", "complexity", "media_bytes")
+    if any(base["fixture"][key] != head["fixture"][key] for key in shape):
+        print("warning: the runs used different fixtures", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lectures", type=int, default=10)
+    parser.add_argument("--problem-sets", type=int, default=5)
+    parser.add_argument("--readings", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=10, help="pages per pdf")
+    parser.add_argument("--complexity", choices=COMPLEXITIES, default="mixed")
+    parser.add_argument("--media-mb", type=float, default=0, help="size of a video that is never read")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, help="extraction process pool size")
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--selective-extract", action="store_true")
+    parser.add_argument("--tiered", action="store_true")
+    parser.add_argument("--optimize-pdf", action="store_true")
+    parser.add_argument("--json", type=Path, help="write results here")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BASE", "HEAD"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    print(json.dumps(results["stages"], indent=2))
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
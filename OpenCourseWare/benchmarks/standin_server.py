@@ -0,0 +1,352 @@
+"""
+Local stand-in for ocw.mit.edu and the open.mit.edu course search.
+
+Serves the three things the pipeline fetches:
+
+- POST /api/v0/search/            search hits for `from` / `size` of the request
+- GET  /courses/<slug>/download   download page linking the course zip
+- HEAD/GET /courses/<slug>/*.zip  the course zip, with Range support
+
+Every course zip is the template zip (a recorded course download or a synthetic
+one from benchmarks.fixtures) with its own root data.json, so courses get distinct
+course numbers. Latency, per response bandwidth, error rates and 429s are
+configurable. Run on its own with
+
+    uv run python -m benchmarks.standin_server --courses 100 --latency 0.05 --rate-limit 50
+"""
+import argparse
+import io
+import json
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+from benchmarks.fixtures import make_course_zip
+from rate_limiter import TokenBucket
+
+SEARCH_PATH = "/api/v0/search/"
+
+
+class StandInOCW:
+    def __init__(
+        self,
+        courses: int = 100,
+        template_zip: Optional[Path] = None,
+        fixture: Optional[dict] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: Optional[int] = None,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        rate_limit: Optional[float] = None,
+        derived_ratio: float = 0.5,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            courses (int): Courses the search api knows about
+            template_zip (Path): Recorded course zip to serve, a synthetic one is generated otherwise
+            fixture (dict): make_course_zip arguments of the synthetic template
+            latency (float): Seconds added before every response
+            jitter (float): Up to this many extra seconds, uniformly random
+            bandwidth (int): Bytes per second of each response body, None for unlimited
+            error_rate (float): Fraction of requests answered with error_status
+            error_status (int): Status of injected errors, 503 is retried by the scraper and downloader
+            rate_limit (float): Requests per second across all clients before answering 429
+            derived_ratio (float): Fraction of search hits carrying term / year, so their zip url can
+                be derived from the hit instead of scraping the download page
+            host (str): Interface to bind
+            port (int): Port to bind, 0 picks a free one
+            seed (int): Seed of the injected faults
+        """
+        self.courses = courses
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.derived_ratio = derived_ratio
+        self.rate_limiter = TokenBucket(rate_limit, max(1.0, rate_limit)) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._zips = OrderedDict()   # slug -> zip bytes, least recently used first
+        self._max_cached_zips = 64
+        self.stats = Counter()
+
+        if template_zip is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="ocw-standin-")
+            template_zip = Path(self._tmp_dir.name) / "template.zip"
+            make_course_zip(template_zip, **(fixture or {}))
+        with zipfile.ZipFile(template_zip) as zip_file:
+            self._members = [
+                (info, zip_file.read(info)) for info in zip_file.infolist() if info.filename != "data.json"
+            ]
+            self._course_data = json.loads(zip_file.read("data.json"))
+
+        handler = type("Handler", (_Handler,), {"standin": self})
+        self.server = _Server((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def api_url(self) -> str:
+        return self.base_url.rstrip("/") + SEARCH_PATH
+
+    def start(self) -> "StandInOCW":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = Counter()
+
+    def count(self, **counts):
+        with self._lock:
+            self.stats.update(counts)
+
+    def course_number(self, index: int) -> str:
+        return f"2.{index:04}"
+
+    def slug(self, index: int) -> str:
+        if self._derivable(index):
+            return f"courses/2-{index:04}-synthetic-course-fall-2024"
+        return f"courses/synthetic-course-{index:04}"
+
+    def _derivable(self, index: int) -> bool:
+        return (index * 7919 % 1000) < self.derived_ratio * 1000
+
+    def search(self, body: dict) -> dict:
+        start = body.get("from", 0)
+        size = body.get("size", 10)
+        hits = []
+        for index in range(start, min(self.courses, start + size)):
+            run = {"slug": self.slug(index)}
+            if self._derivable(index):
+                run.update(semester="Fall", year=2024)
+            hits.append({"_source": {"coursenum": self.course_number(index), "runs": [run]}})
+        return {"hits": {"total": {"value": self.courses}, "hits": hits}}
+
+    def course_index(self, slug: str) -> Optional[int]:
+        match = re.search(r"(\d{4,})", slug)
+        if not match:
+            return None
+        index = int(match.group(1))
+        return index if index < self.courses and self.slug(index) == slug else None
+
+    def course_zip(self, index: int) -> bytes:
+        """Template zip with this course's root data.json, built once and kept in a small lru"""
+        slug = self.slug(index)
+        with self._lock:
+            if slug in self._zips:
+                self._zips.move_to_end(slug)
+                return self._zips[slug]
+
+        data = dict(
+            self._course_data,
+            primary_course_number=self.course_number(index),
+            course_title=f"Synthetic Course {self.course_number(index)}",
+        )
+        buffer = io.BytesIO()
+        # stored, pdfs are compressed internally and rebuilding should stay cheap
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zip_file:
+            zip_file.writestr("data.json", json.dumps(data))
+            for info, content in self._members:
+                zip_file.writestr(info.filename, content)
+        content = buffer.getvalue()
+
+        with self._lock:
+            self._zips[slug] = content
+            while len(self._zips) > self._max_cached_zips:
+                self._zips.popitem(last=False)
+        return content
+
+    def fault(self) -> Optional[int]:
+        """Status to answer instead of the real response, if any"""
+        if self.rate_limiter and not self.rate_limiter.try_acquire():
+            return 429
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+        return self.error_status if failed else None
+
+    def delay(self):
+        wait = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if wait:
+            time.sleep(wait)
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients hanging up on keep-alive connections is expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin: StandInOCW = None
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self._begin("search"):
+            return
+        if self.path.rstrip("/") != SEARCH_PATH.rstrip("/"):
+            return self._respond(404, b"not found")
+        self._respond(200, json.dumps(self.standin.search(json.loads(body or b"{}"))).encode(),
+                      "application/json")
+
+    def do_HEAD(self):
+        self._get(head=True)
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            return self._respond(200, json.dumps(self.standin.stats).encode(), "application/json")
+        self._get(head=False)
+
+    def _get(self, head: bool):
+        match = re.match(r"^/(courses/[^/]+)/(download|[^/]+\.zip)$", self.path)
+        route = "download_page" if match and match.group(2) == "download" else "zip"
+        if not self._begin(route, head):
+            return
+
+        index = self.standin.course_index(match.group(1)) if match else None
+        if index is None:
+            return self._respond(404, b"not found", head=head)
+
+        slug = match.group(1)
+        if route == "download_page":
+            href = f"/{slug}/{self.standin.course_number(index)}-fall-2024.zip"
+            page = f'<html><body><a href="{href}">Download course</a></body></html>'
+            return self._respond(200, page.encode(), "text/html", head=head)
+
+        content = self.standin.course_zip(index)
+        headers = {"Accept-Ranges": "bytes", "ETag": f'"{slug.split("/")[-1]}-{len(content)}"'}
+        range_match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if range_match:
+            start = int(range_match.group(1))
+            end = int(range_match.group(2)) if range_match.group(2) else len(content) - 1
+            end = min(end, len(content) - 1)
+            if start > end:
+                return self._respond(416, b"", head=head, headers={"Content-Range": f"bytes */{len(content)}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+            return self._respond(206, content[start:end + 1], "application/zip", head=head, headers=headers)
+        self._respond(200, content, "application/zip", head=head, headers=headers)
+
+    def _begin(self, route: str, head: bool = False) -> bool:
+        """Count the request and apply latency and faults, False when a fault was answered"""
+        self.standin.count(requests=1, **{f"requests_{route}": 1})
+        self.standin.delay()
+        status = self.standin.fault()
+        if status:
+            self._respond(
+                status,
+                b"injected failure",
+                head=head,
+                headers={"Retry-After": "1"} if status == 429 else None,
+            )
+            return False
+        return True
+
+    def _respond(self, status, body, content_type="text/plain", head=False, headers=None):
+        self.standin.count(**{f"status_{status}": 1})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if head:
+            return
+
+        bandwidth = self.standin.bandwidth
+        chunk_size = 64 * 1024
+        try:
+            for offset in range(0, len(body), chunk_size):
+                chunk = body[offset:offset + chunk_size]
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.standin.count(bytes_sent=len(body))
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--courses", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8800)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    standin = server_from_args(args, args.courses, port=args.port)
+    print(f"serving {args.courses} courses at {standin.base_url} (search api {standin.api_url})")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--template-zip", type=Path, help="recorded course zip to serve")
+    parser.add_argument("--lectures", type=int, default=2, help="synthetic template lectures")
+    parser.add_argument("--problem-sets", type=int, default=1, help="synthetic template problem sets")
+    parser.add_argument("--readings", type=int, default=1, help="synthetic template readings")
+    parser.add_argument("--pages", type=int, default=2, help="synthetic template pages per pdf")
+    parser.add_argument("--complexity", default="plain", help="synthetic template complexity")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, seconds")
+    parser.add_argument("--bandwidth-kbps", type=float, help="per response body bandwidth, KiB/s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of injected errors")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--rate-limit", type=float, help="requests/s before answering 429")
+    parser.add_argument("--derived-ratio", type=float, default=0.5,
+                        help="fraction of courses whose zip url is derivable from the search hit")
+
+
+def server_from_args(args, courses: int, port: int = 0) -> StandInOCW:
+    return StandInOCW(
+        courses=courses,
+        template_zip=args.template_zip,
+        fixture=dict(
+            lectures=args.lectures,
+            problem_sets=args.problem_sets,
+            readings=args.readings,
+            pages=args.pages,
+            complexity=args.complexity,
+        ),
+        latency=args.latency,
+        jitter=args.jitter,
+        bandwidth=int(args.bandwidth_kbps * 1024) if args.bandwidth_kbps else None,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        rate_limit=args.rate_limit,
+        derived_ratio=args.derived_ratio,
+        port=port,
+    )
+
+
+if __name__ == "__main__":
+    main()
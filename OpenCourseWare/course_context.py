@@ -1,26 +1,66 @@
+import hashlib
 import json
 import re
-from typing import List, Optional, Tuple
-import requests
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 import zipfile
 from pathlib import Path
 import glob
-from extract_pdf import extract_pdf
+from extract_pdf import extract_pdf, extract_pdfs, iter_pdf_pages
 import os
 import shutil
-from database.models import Course, ProblemSet, Lecture, Reading
+from database.models import Course, CourseStats, ProblemSet, Lecture, Reading, ResourcePage
 import logging
 from database.session import Session
+from download_cache import DownloadCache
+from downloader import download_file, part_paths
+from pdf_export import export_pdfs
+from remote_zip import HTTPRangeFile, member_span
+from helpers import download_headers, file_sha256
+from extract_cache import ExtractionCache
+from metrics import STAGE_FAILURES, Metrics, registry
+from profiling import DEFAULT_INTERVAL, CourseProfile, profiled
 import fitz
+from sqlalchemy import func
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 
 class CourseContext:
-    def __init__(self, download_url: str, url: str, db_session: Optional[any] = None):
+    # learning resource types that are read out of the corpus
+    RESOURCE_TYPES = ("Assignments", "Lecture Notes", "Readings")
+
+    def __init__(
+        self,
+        download_url: str,
+        url: str,
+        db_session: Optional[any] = None,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        corpus_path: Optional[Path] = None,
+        out_dir: Optional[Path] = None,
+        download_cache: Optional[DownloadCache] = None,
+        selective_extract: bool = False,
+        extraction_cache: Optional[ExtractionCache] = None,
+        download_segments: int = 4,
+        remote_zip: bool = False,
+        page_chunks: bool = False,
+        pages_per_task: int = 8,
+        tiered_extract: bool = False,
+        optimize_pdf: bool = False,
+        linearize_pdf: bool = False,
+        mmap_pdfs: bool = False,
+        metrics: Optional[Metrics] = None,
+        profile: bool = False,
+        profile_interval: float = DEFAULT_INTERVAL,
+        profile_allocations: bool = False,
+    ):
         self.id = None
         self.url = url
         self.slug = url.split('/')[-1]
         self.download_url = download_url
-        self.corpus_path = Path.cwd().joinpath("corpus")
+        self.corpus_path = Path(corpus_path) if corpus_path else Path.cwd().joinpath("corpus")
         self.corpus_static_resources = self.corpus_path.joinpath("static_resources")
         self.title = None
         self.course_number = None
@@ -35,20 +75,49 @@ class CourseContext:
         self.lecture_filenames = []  
         self.problem_set_filenames = []  
         self.problem_set_batches = []   # (problem_filename, sol_filename)
+        self.extracted_texts = {}   # filename -> markdown
+        self.manifest = None   # resource type -> [{file_name, size, page_count, sha256}]
+        self.unchanged_resources = set()   # (kind, filename or batch) already saved with the same source hash
+        self._manifest_file_name = "manifest.json"
+        self.max_workers = max_workers
+        self.executor = executor
+        self.download_cache = download_cache
+        self.selective_extract = selective_extract
+        self.extraction_cache = extraction_cache
+        self.download_segments = download_segments
+        self.remote_zip = remote_zip
+        self.page_chunks = page_chunks
+        self.pages_per_task = pages_per_task
+        self.tiered_extract = tiered_extract
+        self.extraction_tiers = {}   # filename -> extraction tier
+        self.optimize_pdf = optimize_pdf
+        self.linearize_pdf = linearize_pdf
+        self.mmap_pdfs = mmap_pdfs
+        self.export_stats = {}   # input_bytes, output_bytes, bytes_saved of combined pdfs written
+        self.metrics = metrics or registry
         self._zip_file_name = "download.zip"
         self._zip_path = self.corpus_path / self._zip_file_name
         self.session = db_session or Session()
         self.logger = logging.getLogger("course_context")
-        self.out_dir = Path.cwd().joinpath("out")
+        self.out_dir = Path(out_dir) if out_dir else Path.cwd().joinpath("out")
         self.out_course_dir = self.out_dir.joinpath(self.slug)
+        # cpu.collapsed and memory.txt, rewritten after every stage
+        self.profile = (
+            CourseProfile(self.out_course_dir / "profile", profile_interval, profile_allocations)
+            if profile
+            else None
+        )
         
         # init dirs
-        self.corpus_path.mkdir(exist_ok=True)
-        self.out_dir.mkdir(exist_ok=True) 
+        self.corpus_path.mkdir(parents=True, exist_ok=True)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
         self.out_course_dir.mkdir(exist_ok=True)
 
-    def _clear_corpus(self):
+    def _clear_corpus(self, keep: Tuple[Path, ...] = ()):
+        keep_names = {path.name for path in keep}
         for filename in os.listdir(self.corpus_path):
+            if filename in keep_names:
+                continue
             file_path = os.path.join(self.corpus_path, filename)
             if os.path.isfile(file_path) or os.path.islink(file_path):
                 os.unlink(file_path)
@@ -71,165 +140,581 @@ class CourseContext:
 
     def load(self):
         """Downloads and contextualizes the OpenCourseWare course."""
-        self._clear_corpus()
+        self.download()
+        self.unpack()
+
+    @profiled("download")
+    def download(self):
+        """Download stage: fetch the course zip into a clean corpus"""
+        # an interrupted zip download is kept so it can resume
+        self._clear_corpus(keep=part_paths(self._zip_path))
+        self.extracted_texts = {}
+        self.extraction_tiers = {}
+        self.manifest = None
+        self.unchanged_resources = set()
+        if self.remote_zip:
+            # members are read straight from the remote archive while unpacking
+            return
         self._download()
+
+    @profiled("unpack")
+    def unpack(self):
+        """Unpack stage: unzip the course and find its resources"""
+        self._extract_zip_file()
         self.contextualize()
 
+    @profiled("extract")
+    def extract(self):
+        """Extract stage: save the course row and convert every changed pdf to markdown"""
+        self.save_course()
+        self.skip_unchanged_resources()
+        self.extract_texts()
+
     def contextualize(self):
         """Populate course data from corpus"""
-        self._get_course_info()
-        self._get_assignments()
-        self._batch_problem_sets()
-        self._get_lectures()
-        self._get_readings()
+        with self.metrics.stage("contextualize", course=self.slug):
+            self._get_course_info()
+            self._build_manifest()
+            self._get_assignments()
+            self._batch_problem_sets()
+            self._get_lectures()
+            self._get_readings()
 
     def extract_all(self):
         """Extract and save course and all data associated to the database"""
         self.load()
+        self.extract_with_pdfs()
+        self.extract_resources()
+
+    @profiled("extract")
+    def extract_with_pdfs(self):
+        """Extract stage that also writes the combined pdfs, merging alongside the extraction"""
         self.save_course()
-        self.extract_problem_sets()
-        self.extract_lectures()
-        self.extract_readings()
-        self.extract_all_as_pdf()
+        self.skip_unchanged_resources()
+        self.extract_texts_and_pdfs()
 
-    def extracl_all_to_db(self):
+    def extract_all_to_db(self):
         """Extract all data to the db"""
         self.load()
-        self.save_course()
-        self.extract_problem_sets()
-        self.extract_lectures()
-        self.extract_readings()
+        self.extract()
+        self.extract_resources()
 
+    # misspelled name of extract_all_to_db, kept for existing callers
+    extracl_all_to_db = extract_all_to_db
+
+    @profiled("export_pdf")
     def extract_all_as_pdf(self):
-        """Runs all pdf extractions"""
-        self.extract_lectures_pdf()
-        self.extract_problem_sets_pdf()
-        self.extract_readings_pdf()
+        """Runs all pdf extractions, merging every combined pdf in parallel"""
+        jobs = self._all_pdf_jobs()
+        if not jobs:
+            self.logger.warning("no course pdfs to combine for %s", self.slug)
+            return []
+        return self._export_pdfs(jobs, prune=True)
 
-    def extract_problem_sets(self):
-        """Extract problem sets and saves them to the db"""
+    def skip_unchanged_resources(self):
+        """Mark resources already saved with the same source pdf hash so they are not extracted again"""
+        self.unchanged_resources = set()
+        if not self.id:
+            return
+
+        saved = ProblemSet.source_hashes(self.session, self.id)
         for batch in self.problem_set_batches:
-            self._process_problem_set_batch(batch)
+            if self._is_unchanged(saved, batch[0], self._batch_source_hash(batch)):
+                self.unchanged_resources.add(("problem_sets", batch))
+
+        for kind, model, filenames in (
+            ("lectures", Lecture, self.lecture_filenames),
+            ("readings", Reading, self.readings_filenames),
+        ):
+            saved = model.source_hashes(self.session, self.id)
+            for filename in filenames:
+                if self._is_unchanged(saved, filename, self._source_hash(filename)):
+                    self.unchanged_resources.add((kind, filename))
+
+        if self.unchanged_resources:
+            self.logger.info(
+                "skipping %s unchanged resources for %s",
+                len(self.unchanged_resources),
+                self.slug,
+            )
 
-    def _process_problem_set_batch(self, batch: tuple):
-        "Construct and save problem set batch"
-        hw_file, sol_file = batch
-        raw_problem_text = self.read_corpus_static_resource_file(hw_file)
-        raw_solution_text = self.read_corpus_static_resource_file(
-            sol_file
+    def _is_unchanged(self, saved: dict, filename: str, source_hash: Optional[str]) -> bool:
+        if not source_hash:
+            return False
+        return saved.get(self.get_remote_path(filename)) == source_hash
+
+    def _pending(self, kind: str, items: list) -> list:
+        return [item for item in items if (kind, item) not in self.unchanged_resources]
+
+    def _source_hash(self, filename: str) -> Optional[str]:
+        """sha256 of a resource pdf, from the manifest"""
+        return self._manifest_value(filename, "sha256")
+
+    def _manifest_value(self, filename: str, key: str):
+        if self.manifest is None:
+            self._build_manifest()
+        for entries in self.manifest.values():
+            for entry in entries:
+                if entry["file_name"] == filename:
+                    return entry[key]
+        return None
+
+    def _batch_source_hash(self, batch: tuple) -> Optional[str]:
+        hw_hash, sol_hash = (self._source_hash(filename) for filename in batch)
+        if not hw_hash or not sol_hash:
+            return None
+        return hashlib.sha256(f"{hw_hash}:{sol_hash}".encode("utf-8")).hexdigest()
+
+    def extract_texts(self):
+        """Extract markdown for every pending course pdf up front across the process pool"""
+        if self.page_chunks:
+            # pages are extracted and streamed into the db by extract_resource_pages
+            return
+
+        self._extract_texts(self._pending_text_filenames(), self.extraction_cache)
+
+    def extract_texts_and_pdfs(self):
+        """
+        Extract markdown and write the combined pdfs on one process pool, opening each pdf once.
+
+        Every pending pdf is extracted as its own pool task, as in extract_texts, that
+        reads the file once and hands its bytes back, and the combined pdfs it goes
+        into are merged from those bytes. Combined pdfs none of whose inputs are
+        extracted merge alongside the extraction, the others once it is done.
+        """
+        pending = [] if self.page_chunks else self._pending_text_filenames()
+        jobs = self._all_pdf_jobs()
+        if not jobs:
+            self.logger.warning("no course pdfs to combine for %s", self.slug)
+
+        documents = {} if jobs else None   # pdf path -> bytes read by its extraction
+        extracting = {str(path) for path in self._static_paths(pending)}
+        ready = {
+            name: inputs for name, inputs in jobs.items()
+            if not any(str(path) in extracting for path in inputs)
+        }
+        with self._shared_executor() as executor:
+            if executor is None:
+                # fitz is not thread safe, in-process merges and extraction take turns
+                self._extract_texts(pending, self.extraction_cache, documents=documents)
+            else:
+                # a thread only submits the merges and waits on them, the pool does the work
+                with ThreadPoolExecutor(max_workers=1) as merging:
+                    export = merging.submit(self._export_pdfs, ready, False, executor) if ready else None
+                    self._extract_texts(pending, self.extraction_cache, executor, documents)
+                    if export is not None:
+                        export.result()
+            if jobs:
+                # outputs merged alongside the extraction are up to date in the export manifest
+                self._export_pdfs(jobs, True, executor, documents)
+
+    @contextmanager
+    def _shared_executor(self) -> Iterator[Optional[Executor]]:
+        """The course's process pool, a pool for the block when it has none, None to work in-process"""
+        if self.executor is not None:
+            yield self.executor
+            return
+        workers = self.max_workers or os.cpu_count() or 1
+        if workers <= 1:
+            yield None
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield pool
+
+    def _pending_text_filenames(self) -> List[str]:
+        """Pdfs of resources that still need their markdown"""
+        filenames = []
+        for hw_file, sol_file in self._pending("problem_sets", self.problem_set_batches):
+            filenames.extend([hw_file, sol_file])
+        filenames.extend(self._pending("lectures", self.lecture_filenames))
+        filenames.extend(self._pending("readings", self.readings_filenames))
+
+        pending = []
+        for filename in dict.fromkeys(filenames):
+            if filename in self.extracted_texts:
+                continue
+            if not filename.lower().endswith(".pdf"):
+                continue
+            if not self.corpus_static_resources.joinpath(filename).exists():
+                continue
+            pending.append(filename)
+        return pending
+
+    def _extract_texts(
+        self,
+        pending: List[str],
+        cache: Optional[ExtractionCache] = None,
+        executor: Optional[Executor] = None,
+        documents: Optional[dict] = None,
+    ):
+        if not pending:
+            return
+
+        paths = [str(self.corpus_static_resources / filename) for filename in pending]
+        tiers = []
+        timings = []
+        texts = extract_pdfs(
+            paths,
+            max_workers=self.max_workers,
+            executor=executor or self.executor,
+            cache=cache,
+            hashes=[self._source_hash(filename) for filename in pending],
+            tiered=self.tiered_extract,
+            tiers=tiers,
+            timings=timings,
+            profile=self.profile,
+            documents=documents,
         )
-        remote_problem_path = self.get_remote_path(hw_file)
-        remote_solution_path = self.get_remote_path(sol_file)
-
-        self._save_problem_set(
-            raw_problem_text=raw_problem_text,
-            raw_solution_text=raw_solution_text,
-            remote_problem_path=remote_problem_path,
-            remote_solution_path=remote_solution_path,
+        self.extracted_texts.update(zip(pending, texts))
+        self.extraction_tiers.update(zip(pending, tiers))
+        for filename, tier, timing in zip(pending, tiers, timings):
+            if timing is not None:
+                self.metrics.record(
+                    "pdf_extract", timing[1], timing[0], course=self.slug, resource=filename, tier=tier
+                )
+        self._count_extracted(pending)
+        self.logger.info(
+            "extracted %s pdfs for %s, tiers: %s",
+            len(pending),
+            self.slug,
+            dict(Counter(tiers)),
         )
-    
-    def extract_lectures(self):
-        """Extract lecture text and save to db"""
-        for lecture in self.lecture_filenames:
-            llm_text = self.read_corpus_static_resource_file(lecture)
-            try:
-                lecture = Lecture.create(
-                    db=self.session,
+
+    def _count_extracted(self, filenames: List[str]):
+        """Count extracted pdfs by tier with their pages and characters, and the failures"""
+        for filename in filenames:
+            if self.extracted_texts.get(filename) is None:
+                self.metrics.inc(STAGE_FAILURES, stage="pdf_extract")
+                continue
+            self.metrics.inc("ocw_pdfs_extracted_total", tier=self.extraction_tiers.get(filename))
+            self.metrics.inc("ocw_pdf_pages_total", self._manifest_value(filename, "page_count") or 0)
+            self.metrics.inc("ocw_extracted_chars_total", len(self.extracted_texts.get(filename) or ""))
+
+    @profiled("persist")
+    def extract_resources(self):
+        """Extract problem sets, lectures and readings and save them in one transaction"""
+        if self.page_chunks:
+            self.extract_resource_pages()
+            return
+
+        self._check_course_saved()
+        problem_set_rows = self._problem_set_rows()
+        lecture_rows = self._resource_rows("lectures", self.lecture_filenames)
+        reading_rows = self._resource_rows("readings", self.readings_filenames)
+
+        try:
+            with self.metrics.stage("db_insert", course=self.slug):
+                ProblemSet.bulk_upsert(self.session, problem_set_rows, commit=False)
+                Lecture.bulk_upsert(self.session, lecture_rows, commit=False)
+                Reading.bulk_upsert(self.session, reading_rows, commit=False)
+                CourseStats.refresh(self.session, [self.id], commit=False)
+                self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            self.logger.error("error saving resources for %s", self.slug, exc_info=e)
+            raise
+
+        for model, rows in (
+            (ProblemSet, problem_set_rows), (Lecture, lecture_rows), (Reading, reading_rows)
+        ):
+            self.metrics.inc("ocw_db_rows_total", len(rows), table=model.__tablename__)
+            self.metrics.inc("ocw_db_chars_total", sum(row["character_count"] for row in rows))
+        self.logger.info(
+            "saved %s problem sets, %s lectures, %s readings",
+            len(problem_set_rows),
+            len(lecture_rows),
+            len(reading_rows),
+        )
+
+    def extract_resource_pages(self):
+        """
+        Extract problem sets, lectures and readings page by page into resource_page.
+
+        The parent rows keep empty text and only get their character count and
+        source hash once every page is saved, so an interrupted document is
+        extracted again on the next run.
+        """
+        self._check_course_saved()
+        documents = []   # (model, placeholder row, [(resource type, filename)], source hash)
+        for batch in self._pending("problem_sets", self.problem_set_batches):
+            hw_file, sol_file = batch
+            documents.append((
+                ProblemSet,
+                dict(
                     course_id=self.id,
-                    llm_text=llm_text,
-                    remote_url=self.get_remote_path(lecture),
-                    character_count=len(llm_text)
-                )
-                if lecture.id:
-                    self.logger.info("saved lecture, %s", lecture)
-            except Exception as e:
-                self.logger.error("error saving lecture, %s", lecture, exc_info=e)
-    
-    def extract_readings(self):
-        """Extract readings text and save to db"""
-        for reading in self.readings_filenames:
-            llm_text = self.read_corpus_static_resource_file(reading)
+                    problem_text="",
+                    solution_text="",
+                    remote_problem_url=self.get_remote_path(hw_file),
+                    remote_solution_url=self.get_remote_path(sol_file),
+                ),
+                [(ResourcePage.PROBLEM, hw_file), (ResourcePage.SOLUTION, sol_file)],
+                self._batch_source_hash(batch),
+            ))
+        for kind, model, resource_type, filenames in (
+            ("lectures", Lecture, ResourcePage.LECTURE, self.lecture_filenames),
+            ("readings", Reading, ResourcePage.READING, self.readings_filenames),
+        ):
+            for filename in self._pending(kind, filenames):
+                documents.append((
+                    model,
+                    dict(course_id=self.id, llm_text="", remote_url=self.get_remote_path(filename)),
+                    [(resource_type, filename)],
+                    self._source_hash(filename),
+                ))
+
+        pages = 0
+        failed = []
+        for model, row, files, source_hash in documents:
             try:
-                reading = Reading.create(
-                    db=self.session,
-                    course_id=self.id,
-                    llm_text=llm_text,
-                    remote_url=self.get_remote_path(reading),
-                    character_count=len(llm_text)
-                )
-                if reading.id:
-                    self.logger.info("saved readings, %s", reading)
+                resource_id = self._save_placeholder(model, row)
+                for resource_type, filename in files:
+                    pages += self._save_pages(resource_type, resource_id, filename)
+                self._update_page_totals(model, resource_id, source_hash)
+                CourseStats.refresh(self.session, [self.id], commit=False)
+                self.session.commit()
             except Exception as e:
-                self.logger.error("error saving readings, %s", reading, exc_info=e)
+                # nothing of the document is kept, so the next run extracts it again
+                self.session.rollback()
+                self.logger.error("error saving pages of %s for %s", files[0][1], self.slug, exc_info=e)
+                failed.append(files[0][1])
+
+        self.logger.info("saved %s pages of %s documents", pages, len(documents) - len(failed))
+        if failed:
+            raise Exception(f"{len(failed)} documents of {self.slug} failed to save: {', '.join(failed)}")
+
+    @profiled("reextract")
+    def reextract_pages(self, filename: str, pages: List[int]):
+        """
+        Extract a page range of an already saved course pdf again
+
+        Args:
+            filename (str): Static resource file name of the pdf
+            pages (list): 1-based page numbers
+        """
+        self._check_course_saved()
+        model, resource_type, row = self._page_target(filename)
+        resource_id = self._resource_id(model, row)
+        if resource_id is None:
+            raise Exception(f"{filename} has not been saved for {self.slug}")
+
+        try:
+            self._save_pages(resource_type, resource_id, filename, pages)
+            self._update_page_totals(model, resource_id)
+            CourseStats.refresh(self.session, [self.id], commit=False)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def _page_target(self, filename: str) -> Tuple[type, str, dict]:
+        """Parent model, page resource type and parent key columns of a course pdf"""
+        for hw_file, sol_file in self.problem_set_batches:
+            if filename in (hw_file, sol_file):
+                resource_type = ResourcePage.PROBLEM if filename == hw_file else ResourcePage.SOLUTION
+                return ProblemSet, resource_type, dict(remote_problem_url=self.get_remote_path(hw_file))
+        if filename in self.lecture_filenames:
+            return Lecture, ResourcePage.LECTURE, dict(remote_url=self.get_remote_path(filename))
+        if filename in self.readings_filenames:
+            return Reading, ResourcePage.READING, dict(remote_url=self.get_remote_path(filename))
+        raise Exception(f"{filename} is not a resource of {self.slug}")
+
+    def _resource_id(self, model, row: dict) -> Optional[int]:
+        url_key = model.upsert_keys[1]
+        return (
+            self.session.query(model.id)
+            .filter(model.course_id == self.id, getattr(model, url_key) == row[url_key])
+            .scalar()
+        )
+
+    def _save_placeholder(self, model, row: dict) -> int:
+        """Upsert a parent row without text, returns its id"""
+        model.bulk_upsert(
+            self.session, [dict(row, character_count=0, source_hash=None)], commit=False
+        )
+        return self._resource_id(model, row)
+
+    def _save_pages(
+        self,
+        resource_type: str,
+        resource_id: int,
+        filename: str,
+        pages: Optional[List[int]] = None,
+        batch_size: int = 32,
+    ) -> int:
+        """Stream the pages of a pdf into resource_page, returns the number of pages saved"""
+        path = self.corpus_static_resources.joinpath(filename)
+        if not filename.lower().endswith(".pdf") or not path.exists():
+            raise Exception(f"{filename} not found in corpus")
+
+        rows = []
+        saved = 0
+        last_page = 0
+        characters = 0
+        insert_seconds = 0.0
+        started = time.time()
+        start = time.perf_counter()
+        for page_number, text in iter_pdf_pages(
+            str(path),
+            pages=pages,
+            pages_per_task=self.pages_per_task,
+            max_workers=self.max_workers,
+            executor=self.executor,
+            profile=self.profile,
+        ):
+            rows.append(dict(
+                resource_type=resource_type,
+                resource_id=resource_id,
+                page_number=page_number,
+                text=text,
+                character_count=len(text),
+            ))
+            last_page = page_number
+            characters += len(text)
+            if len(rows) >= batch_size:
+                insert_start = time.perf_counter()
+                saved += ResourcePage.bulk_upsert(self.session, rows, commit=False)
+                insert_seconds += time.perf_counter() - insert_start
+                rows = []
+        insert_start = time.perf_counter()
+        saved += ResourcePage.bulk_upsert(self.session, rows, commit=False)
+        insert_seconds += time.perf_counter() - insert_start
+
+        if pages is None:
+            ResourcePage.delete_after(self.session, resource_type, resource_id, last_page)
+
+        # pages stream from the pool while earlier batches are inserted, split the time between the two
+        seconds = time.perf_counter() - start
+        self.metrics.record(
+            "pdf_extract", seconds - insert_seconds, started, course=self.slug, resource=filename, pages=saved
+        )
+        self.metrics.record("db_insert", insert_seconds, course=self.slug, resource=filename)
+        self.metrics.inc("ocw_pdfs_extracted_total", tier="pages")
+        self.metrics.inc("ocw_pdf_pages_total", saved)
+        self.metrics.inc("ocw_extracted_chars_total", characters)
+        self.metrics.inc("ocw_db_rows_total", saved, table=ResourcePage.__tablename__)
+        self.metrics.inc("ocw_db_chars_total", characters)
+        return saved
+
+    def _update_page_totals(self, model, resource_id: int, source_hash: Optional[str] = None):
+        """Set a parent row's character count from its pages, and its source hash once complete"""
+        resource_types = (
+            [ResourcePage.PROBLEM, ResourcePage.SOLUTION]
+            if model is ProblemSet
+            else [ResourcePage.LECTURE if model is Lecture else ResourcePage.READING]
+        )
+        character_count = (
+            self.session.query(func.coalesce(func.sum(ResourcePage.character_count), 0))
+            .filter(
+                ResourcePage.resource_type.in_(resource_types),
+                ResourcePage.resource_id == resource_id,
+            )
+            .scalar()
+        )
+        values = {"character_count": character_count}
+        if source_hash:
+            values["source_hash"] = source_hash
+        self.session.query(model).filter(model.id == resource_id).update(values)
+
+    def extract_problem_sets(self):
+        """Extract problem sets and saves them to the db"""
+        self._check_course_saved()
+        rows = self._problem_set_rows()
+        self._bulk_save(ProblemSet, rows, "problem sets")
+
+    def extract_lectures(self):
+        """Extract lecture text and save to db"""
+        rows = self._resource_rows("lectures", self.lecture_filenames)
+        self._bulk_save(Lecture, rows, "lectures")
 
     def extract_readings(self):
         """Extract readings text and save to db"""
-        for reading in self.readings_filenames:
-            llm_text = self.read_corpus_static_resource_file(reading)
-            try:
-                reading = Reading.create(
-                    db=self.session,
-                    course_id=self.id,
-                    llm_text=llm_text,
-                    remote_url=self.get_remote_path(reading),
-                    character_count=len(llm_text)
-                )
-                if reading.id:
-                    self.logger.info("saved reading, %s", reading)
-            except Exception as e:
-                self.logger.error("error saving reading, %s", reading, exc_info=e)
+        rows = self._resource_rows("readings", self.readings_filenames)
+        self._bulk_save(Reading, rows, "readings")
 
-    def _save_problem_set(
-        self,
-        raw_problem_text: str,
-        raw_solution_text: str,
-        remote_problem_path: str,
-        remote_solution_path: str,
-    ):
+    def _bulk_save(self, model, rows: List[dict], label: str):
+        try:
+            model.bulk_upsert(self.session, rows, commit=False)
+            CourseStats.refresh(self.session, [self.id], commit=False)
+            self.session.commit()
+            self.logger.info("saved %s %s", len(rows), label)
+        except Exception as e:
+            self.session.rollback()
+            self.logger.error("error saving %s", label, exc_info=e)
+
+    def _check_course_saved(self):
         if not self.id:
             self.logger.error(
                 "Course has not been persisted to database. Please save course before creating problem sets."
             )
 
-        ps = None
-        try:
-            ps = ProblemSet.create(
-                self.session,
-                course_id=self.id,
-                problem_text=raw_problem_text,
-                solution_text=raw_solution_text,
-                remote_problem_url=remote_problem_path,
-                remote_solution_url=remote_solution_path,
-                character_count=len(raw_problem_text + raw_solution_text)
-            )
-        except Exception as e:
-            self.logger.error(e)
+    def _problem_set_rows(self) -> List[dict]:
+        rows = [
+            self._process_problem_set_batch(batch)
+            for batch in self._pending("problem_sets", self.problem_set_batches)
+        ]
+        return [row for row in rows if row is not None]
 
-        if ps:
-            self.logger.info(
-                "Successfully saved problem set, %s", ps.id
+    def _process_problem_set_batch(self, batch: tuple) -> Optional[dict]:
+        "Construct problem set row from a batch, None when a pdf of it failed to extract"
+        hw_file, sol_file = batch
+        raw_problem_text = self.read_corpus_static_resource_file(hw_file)
+        raw_solution_text = self.read_corpus_static_resource_file(
+            sol_file
+        )
+        if raw_problem_text is None or raw_solution_text is None:
+            # not saved, so the next run extracts it again instead of skipping it as unchanged
+            self.logger.warning("not saving problem set %s, extraction failed", hw_file)
+            return None
+
+        return dict(
+            course_id=self.id,
+            problem_text=raw_problem_text,
+            solution_text=raw_solution_text,
+            remote_problem_url=self.get_remote_path(hw_file),
+            remote_solution_url=self.get_remote_path(sol_file),
+            character_count=len(raw_problem_text) + len(raw_solution_text),
+            source_hash=self._batch_source_hash(batch),
+        )
+
+    def _resource_rows(self, kind: str, filenames: List[str]) -> List[dict]:
+        """Construct lecture / reading rows from pending pdf file names"""
+        rows = []
+        for filename in self._pending(kind, filenames):
+            llm_text = self.read_corpus_static_resource_file(filename)
+            if llm_text is None:
+                self.logger.warning("not saving %s, extraction failed", filename)
+                continue
+            rows.append(
+                dict(
+                    course_id=self.id,
+                    llm_text=llm_text,
+                    remote_url=self.get_remote_path(filename),
+                    character_count=len(llm_text),
+                    source_hash=self._source_hash(filename),
+                )
             )
-            self.saved_ps = ps
+        return rows
 
     def save_course(self):
         """Persist course to database."""
         if not self.id:
-            course = Course.create(
-                db=self.session,
-                course_number=self.course_number,
-                title=self.title,
-                description=self.description,
-                topics=self.topics,
-                level=self.level,
-                year=self.year,
-                term=self.term,
-                url=self.url,
-                download_url=self.download_url,
-                learning_resource_types=self.learning_resource_types,
-            )
+            with self.metrics.stage("db_insert", course=self.slug, resource="course"):
+                course_id = Course.upsert(
+                    db=self.session,
+                    course_number=self.course_number,
+                    title=self.title,
+                    description=self.description,
+                    topics=self.topics,
+                    level=self.level,
+                    year=self.year,
+                    term=self.term,
+                    url=self.url,
+                    download_url=self.download_url,
+                    learning_resource_types=self.learning_resource_types,
+                )
 
-            if course.id:
-                self.id = course.id
+            if course_id:
+                self.id = course_id
                 self.logger.info("saved course, id: %s", self.id)
 
     def _get_course_info(self):
@@ -259,26 +744,44 @@ class CourseContext:
             raise ValueError("No download URL provided")
 
         try:
-            self._download_zip_file()
-            self._extract_zip_file()
+            with self.metrics.stage("download", course=self.slug):
+                self._download_zip_file()
 
         except Exception as e:
             raise Exception(f"Failed to download course: {e}")
 
     def _download_zip_file(self) -> Path:
-        """Download the zip file from the URL"""
-        response = requests.get(self.download_url, stream=True, timeout=30)
-        response.raise_for_status()
+        """Download the zip file from the URL, through the download cache when configured"""
+        if self.download_cache:
+            return self.download_cache.fetch(
+                self.download_url, self._zip_path, self._fetch_to, headers=download_headers
+            )
 
-        with open(self._zip_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        self._fetch_to(self.download_url, self._zip_path)
+        return self._zip_path
+
+    def _fetch_to(self, url: str, path: Path, probed: Optional[tuple] = None):
+        """Download a remote file to path in parallel ranges, resuming a partial download"""
+        download_file(
+            url, path, segments=self.download_segments, timeout=30,
+            headers=download_headers, probed=probed,
+        )
+        self.metrics.inc("ocw_download_bytes_total", Path(path).stat().st_size)
 
     def _extract_zip_file(self) -> Path:
-        """Extract the downloaded zip file"""
+        """Extract the downloaded zip file, or the needed members of the remote zip"""
+        with self.metrics.stage("unzip", course=self.slug, remote=self.remote_zip):
+            if self.remote_zip:
+                return self._extract_remote_zip_file()
+            return self._extract_local_zip_file()
+
+    def _extract_local_zip_file(self) -> Path:
         try:
             with zipfile.ZipFile(self._zip_path, "r") as zip_ref:
-                zip_ref.extractall(self.corpus_path)
+                if self.selective_extract:
+                    self._extract_selected_members(zip_ref)
+                else:
+                    zip_ref.extractall(self.corpus_path)
                 self.logger.info(
                     "extracted course data for %s to local corpus",
                     self.download_url,
@@ -289,171 +792,196 @@ class CourseContext:
         except Exception as e:
             raise Exception(f"Failed to extract zip file: {e}")
 
-    def _get_assignments(self):
-        """Get assignment file paths by filtering through data.json files"""
-        assignments = []
-        if not self.corpus_path or not self.corpus_path.exists():
-            return []
-
-        pattern = f"{self.corpus_path}/resources/**/data.json"
-        json_files = glob.glob(pattern, recursive=True)
-        if not json_files:
-            raise Exception("No files found when looking up assignment data.json")
+    def _extract_remote_zip_file(self):
+        """Read the remote zip's central directory and fetch only the members we need"""
+        if not self.download_url:
+            raise ValueError("No download URL provided")
 
         try:
-            for json_file in json_files:
-                data = None
-                with open(json_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-
-                if "Assignments" in data.get("learning_resource_types", []):
-                    if "file" in data and data["file"] and ".pdf" in data["file"]:
-                        path = data["file"]
-                        file_name = path.split("/")[-1]
-                        assignments.append(file_name)
+            remote = HTTPRangeFile(self.download_url, headers=download_headers)
+        except Exception as e:
+            raise Exception(f"Failed to open remote zip: {e}")
 
-            self.problem_set_filenames = assignments
+        try:
+            with zipfile.ZipFile(remote, "r") as zip_ref:
+                self._extract_selected_members(zip_ref, remote=remote)
+            self.metrics.inc("ocw_download_bytes_total", remote.bytes_fetched)
             self.logger.info(
-                "found %s assignments", len(self.problem_set_filenames)
+                "fetched %s of %s bytes from remote zip %s in %s requests",
+                remote.bytes_fetched,
+                remote.size,
+                self.download_url,
+                remote.requests_made,
             )
+        except zipfile.BadZipFile:
+            raise Exception("Remote file is not a valid zip file")
         except Exception as e:
-            self.logger.error("_get_assignements failed", exc_info=e)
-    
-    def _get_lectures(self):
-        """Get lecture file paths by filtering through data.json files"""
-        lectures = []
+            raise Exception(f"Failed to extract remote zip file: {e}")
+        finally:
+            remote.close()
+
+    def _extract_selected_members(
+        self, zip_ref: zipfile.ZipFile, remote: Optional[HTTPRangeFile] = None
+    ):
+        """Extract only the data.json files and the pdfs they classify as course resources"""
+        json_members = 0
+        wanted_pdfs = set()
+        for member in zip_ref.infolist():
+            name = member.filename
+            if name != "data.json" and not (name.startswith("resources/") and name.endswith("/data.json")):
+                continue
+            # written from the bytes already read, a remote zip is not asked for them twice
+            data = zip_ref.read(member)
+            self._write_member(member, data)
+            json_members += 1
+            if name == "data.json":
+                continue
+            try:
+                resource = json.loads(data)
+            except ValueError:
+                continue
+            file_name = self._resource_pdf_filename(resource)
+            if file_name:
+                wanted_pdfs.add(file_name)
+
+        pdf_members = [
+            member
+            for member in zip_ref.infolist()
+            if member.filename.startswith("static_resources/")
+            and member.filename.split("/")[-1] in wanted_pdfs
+        ]
+
+        for member in pdf_members:
+            if remote:
+                # local header and compressed data in one request
+                remote.prefetch(*member_span(member))
+            zip_ref.extract(member, self.corpus_path)
+
+        self.logger.info(
+            "selectively extracted %s of %s zip members",
+            json_members + len(pdf_members),
+            len(zip_ref.infolist()),
+        )
+
+    def _write_member(self, member: zipfile.ZipInfo, data: bytes):
+        """Write a zip member read into memory to the corpus, at the path zip_ref.extract would use"""
+        parts = [part for part in member.filename.split("/") if part not in ("", ".", "..")]
+        target = self.corpus_path.joinpath(*parts)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+
+    def _resource_pdf_filename(self, data: dict) -> Optional[str]:
+        """Pdf file name of a resource data.json, if it is a type we read"""
+        types = data.get("learning_resource_types") or []
+        if not any(t in types for t in self.RESOURCE_TYPES):
+            return None
+
+        if "file" in data and data["file"] and ".pdf" in data["file"]:
+            return data["file"].split("/")[-1]
+        return None
+
+    def _build_manifest(self):
+        """Index every resource data.json in one pass, persisted as manifest.json in the corpus"""
         if not self.corpus_path or not self.corpus_path.exists():
-            return []
+            self.manifest = {resource_type: [] for resource_type in self.RESOURCE_TYPES}
+            return self.manifest
+
+        manifest_path = self.corpus_path / self._manifest_file_name
+        if manifest_path.exists():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            self.logger.info("loaded resource manifest from %s", manifest_path)
+            return self.manifest
 
         pattern = f"{self.corpus_path}/resources/**/data.json"
         json_files = glob.glob(pattern, recursive=True)
         if not json_files:
-            raise Exception("No files found when looking up assignment data.json")
+            raise Exception("No files found when looking up resource data.json")
 
-        try:
-            for json_file in json_files:
-                data = None
+        manifest = {resource_type: [] for resource_type in self.RESOURCE_TYPES}
+        entries = {}
+        for json_file in json_files:
+            try:
                 with open(json_file, "r", encoding="utf-8") as f:
                     data = json.load(f)
+            except Exception as e:
+                self.logger.error("failed to read %s", json_file, exc_info=e)
+                continue
 
-                if "Lecture Notes" in data.get("learning_resource_types", []):
-                    if "file" in data and data["file"] and ".pdf" in data["file"]:
-                        path = data["file"]
-                        file_name = path.split("/")[-1]
-                        lectures.append(file_name)
+            file_name = self._resource_pdf_filename(data)
+            if not file_name:
+                continue
 
-            self.lecture_filenames = lectures 
-            self.logger.info(
-                "found %s lecture notes", len(self.lecture_filenames)
-            )
-        except Exception as e:
-            self.logger.error("_get_lectures failed", exc_info=e)
-    
-    def _get_readings(self):
-        """Get readings file paths by filtering through data.json files"""
-        readings = []
-        if not self.corpus_path or not self.corpus_path.exists():
-            return []
+            if file_name not in entries:
+                entries[file_name] = self._manifest_entry(file_name)
 
-        pattern = f"{self.corpus_path}/resources/**/data.json"
-        json_files = glob.glob(pattern, recursive=True)
-        if not json_files:
-            raise Exception("No files found when looking up reading data.json")
+            types = data.get("learning_resource_types", [])
+            for resource_type in self.RESOURCE_TYPES:
+                if resource_type in types:
+                    manifest[resource_type].append(entries[file_name])
 
-        try:
-            for json_file in json_files:
-                data = None
-                with open(json_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
 
-                if "Readings" in data.get("learning_resource_types", []):
-                    if "file" in data and data["file"] and ".pdf" in data["file"]:
-                        path = data["file"]
-                        file_name = path.split("/")[-1]
-                        readings.append(file_name)
+        self.manifest = manifest
+        self.logger.info("indexed %s resource pdfs", len(entries))
+        return self.manifest
 
-            self.readings_filenames = readings 
-            self.logger.info(
-                "found %s readings", len(self.readings_filenames)
-            )
+    def _manifest_entry(self, file_name: str) -> dict:
+        """Size, page count and hash of a static resource pdf"""
+        entry = {"file_name": file_name, "size": None, "page_count": None, "sha256": None}
+        path = self.corpus_static_resources / file_name
+        if not path.exists():
+            return entry
+
+        entry["size"] = path.stat().st_size
+        entry["sha256"] = file_sha256(path)
+        try:
+            with fitz.open(str(path)) as doc:
+                entry["page_count"] = doc.page_count
         except Exception as e:
-            self.logger.error("_get_readings failed", exc_info=e)
+            self.logger.warning("could not count pages of %s: %s", file_name, e)
+        return entry
+
+    def _manifest_filenames(self, resource_type: str) -> List[str]:
+        if self.manifest is None:
+            self._build_manifest()
+        return [entry["file_name"] for entry in self.manifest.get(resource_type, [])]
+
+    def _get_assignments(self):
+        """Get assignment file names from the resource manifest"""
+        self.problem_set_filenames = self._manifest_filenames("Assignments")
+        self.logger.info(
+            "found %s assignments", len(self.problem_set_filenames)
+        )
+
+    def _get_lectures(self):
+        """Get lecture file names from the resource manifest"""
+        self.lecture_filenames = self._manifest_filenames("Lecture Notes")
+        self.logger.info(
+            "found %s lecture notes", len(self.lecture_filenames)
+        )
+
+    def _get_readings(self):
+        """Get readings file names from the resource manifest"""
+        self.readings_filenames = self._manifest_filenames("Readings")
+        self.logger.info(
+            "found %s readings", len(self.readings_filenames)
+        )
 
     def extract_lectures_pdf(self):
         """Extract all lectures into one pdf"""
         if not self.lecture_filenames:
             self.logger.warning("no lecture filenames to process for extracting into a pdf")
             return
-
-        filename = "combined_lectures.pdf"
-        path = self.out_course_dir / filename 
-        combined_doc = fitz.open()
-        
-        try:
-            for lecture_filename in self.lecture_filenames:
-                lecture_path = self.corpus_static_resources / lecture_filename
-                
-                if not lecture_path.exists():
-                    self.logger.warning(f"Lecture file not found: {lecture_path}")
-                    continue
-                
-                try:
-                    lecture_doc = fitz.open(str(lecture_path))
-                    combined_doc.insert_pdf(lecture_doc)
-                    lecture_doc.close()
-                    self.logger.info(f"Added lecture {lecture_filename} to combined PDF")
-                    
-                except Exception as e:
-                    self.logger.error(f"Failed to process lecture {lecture_filename}: {e}")
-                    continue
-            
-            combined_doc.save(str(path))
-            combined_doc.close()
-            
-            self.logger.info(f"Combined lectures saved to: {path}")
-            
-        except Exception as e:
-            self.logger.error(f"Failed to create combined lectures PDF: {e}")
-            combined_doc.close()
-            raise
+        return self._export_pdfs(self._lecture_pdf_jobs())
 
     def extract_readings_pdf(self):
         """Extract all readings into one pdf"""
         if not self.readings_filenames:
             self.logger.warning("no readings filenames to process for extracting into a pdf")
             return
-
-        filename = "combined_readings.pdf"
-        path = self.out_course_dir / filename 
-        combined_doc = fitz.open()
-        
-        try:
-            for reading in self.readings_filenames:
-                lecture_path = self.corpus_static_resources / reading 
-                
-                if not lecture_path.exists():
-                    self.logger.warning(f"Reading file not found: {lecture_path}")
-                    continue
-                
-                try:
-                    lecture_doc = fitz.open(str(lecture_path))
-                    combined_doc.insert_pdf(lecture_doc)
-                    lecture_doc.close()
-                    self.logger.info(f"Added reading {reading} to combined PDF")
-                    
-                except Exception as e:
-                    self.logger.error(f"Failed to process reading {reading}: {e}")
-                    continue
-            
-            combined_doc.save(str(path))
-            combined_doc.close()
-            
-            self.logger.info(f"Combined readings saved to: {path}")
-            
-        except Exception as e:
-            self.logger.error(f"Failed to create combined readings PDF: {e}")
-            combined_doc.close()
-            raise
+        return self._export_pdfs(self._reading_pdf_jobs())
 
     def extract_problem_sets_pdf(self):
         """Extract all problem sets into combined PDFs"""
@@ -461,57 +989,73 @@ class CourseContext:
             self.logger.warning("no problem set batches to process for extracting into PDFs")
             return
 
-        combined_paths = []
-        for i, batch in enumerate(self.problem_set_batches):
-            hw_file, sol_file = batch
-            
-            batch_num = str(i + 1).zfill(2)
-            filename = f"problem_set_{batch_num}.pdf"
-            path = self.out_course_dir / filename
-            combined_doc = fitz.open()
-            
-            try:
-                # problem file
-                hw_path = self.corpus_static_resources / hw_file
-                if hw_path.exists():
-                    try:
-                        hw_doc = fitz.open(str(hw_path))
-                        combined_doc.insert_pdf(hw_doc)
-                        hw_doc.close()
-                        self.logger.info(f"Added problem file {hw_file} to batch {batch_num}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to process problem file {hw_file}: {e}")
-                else:
-                    self.logger.warning(f"Problem file not found: {hw_path}")
-                
-                # solution file 
-                sol_path = self.corpus_static_resources / sol_file
-                if sol_path.exists():
-                    try:
-                        sol_doc = fitz.open(str(sol_path))
-                        combined_doc.insert_pdf(sol_doc)
-                        sol_doc.close()
-                        self.logger.info(f"Added solution file {sol_file} to batch {batch_num}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to process solution file {sol_file}: {e}")
-                else:
-                    self.logger.warning(f"Solution file not found: {sol_path}")
-                
-                combined_doc.save(str(path))
-                combined_doc.close()
-                
-                combined_paths.append(str(path))
-                self.logger.info(f"Problem set batch {batch_num} saved to: {path}")
-                
-            except Exception as e:
-                self.logger.error(f"Failed to create problem set batch {batch_num} PDF: {e}")
-                combined_doc.close()
-                continue
-        
+        combined_paths = [str(path) for path in self._export_pdfs(self._problem_set_pdf_jobs())]
         self.logger.info(f"Created {len(combined_paths)} problem set PDFs")
         return combined_paths
 
-    def read_corpus_static_resource_file(self, file_name: str):
+    def _all_pdf_jobs(self) -> dict:
+        return {
+            **self._lecture_pdf_jobs(),
+            **self._problem_set_pdf_jobs(),
+            **self._reading_pdf_jobs(),
+        }
+
+    def _lecture_pdf_jobs(self) -> dict:
+        if not self.lecture_filenames:
+            return {}
+        return {"combined_lectures.pdf": self._static_paths(self.lecture_filenames)}
+
+    def _reading_pdf_jobs(self) -> dict:
+        if not self.readings_filenames:
+            return {}
+        return {"combined_readings.pdf": self._static_paths(self.readings_filenames)}
+
+    def _problem_set_pdf_jobs(self) -> dict:
+        return {
+            f"problem_set_{str(i + 1).zfill(2)}.pdf": self._static_paths(batch)
+            for i, batch in enumerate(self.problem_set_batches)
+        }
+
+    def _static_paths(self, filenames) -> List[Path]:
+        return [self.corpus_static_resources / filename for filename in filenames]
+
+    def _export_pdfs(
+        self,
+        jobs: dict,
+        prune: bool = False,
+        executor: Optional[Executor] = None,
+        documents: Optional[dict] = None,
+    ) -> List[Path]:
+        """Merge combined pdfs in parallel, outputs with unchanged inputs are skipped"""
+        hashes = {}
+        for inputs in jobs.values():
+            for path in inputs:
+                source_hash = self._source_hash(path.name)
+                if source_hash:
+                    hashes[path] = source_hash
+
+        return export_pdfs(
+            jobs,
+            self.out_course_dir,
+            hashes=hashes,
+            max_workers=self.max_workers,
+            executor=executor or self.executor,
+            prune=prune,
+            optimize=self.optimize_pdf,
+            linearize=self.linearize_pdf,
+            stats=self.export_stats,
+            use_mmap=self.mmap_pdfs,
+            metrics=self.metrics,
+            course=self.slug,
+            profile=self.profile,
+            documents=documents,
+        )
+
+    def read_corpus_static_resource_file(self, file_name: str) -> Optional[str]:
+        """Text of a static resource, None for a pdf that could not be extracted"""
+        if file_name in self.extracted_texts:
+            return self.extracted_texts[file_name]
+
         target = self.corpus_static_resources.joinpath(file_name)
         max_lines = 10000
 
@@ -525,7 +1069,7 @@ class CourseContext:
                 file_text = json.dumps(data, indent=2)
 
         elif target.suffix.lower() == ".pdf":
-            text = extract_pdf(str(target))
+            text = extract_pdf(str(target), tiered=self.tiered_extract)
             return text
 
         else:
@@ -553,7 +1097,7 @@ class CourseContext:
                 file_text = json.dumps(data, indent=2)
 
         elif target.suffix.lower() == ".pdf":
-            text = extract_pdf(str(target))
+            text = extract_pdf(str(target), tiered=self.tiered_extract)
             return text
 
         else:
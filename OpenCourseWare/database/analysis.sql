@@ -1,15 +1,19 @@
+-- course_stats holds one row per course with its resource counts and character
+-- totals, kept up to date as resources are saved. Backfill it once on a database
+-- scraped before it existed:
+--   CourseStats.refresh(session)
+
 -- rank courses by lecture length
 SELECT 
     c.title,
     c.course_number,
     c.year,
     c.url,
-    SUM(l.character_count) as total_lecture_length,
-    COUNT(l.id) as lecture_count
-FROM course c
-LEFT JOIN lecture l ON c.id = l.course_id
-GROUP BY c.title, c.course_number, c.year, c.url
-ORDER BY total_lecture_length DESC NULLS LAST
+    s.lecture_chars as total_lecture_length,
+    s.lecture_count
+FROM course_stats s
+JOIN course c ON c.id = s.course_id
+ORDER BY s.lecture_chars DESC
 LIMIT 20;
 
 -- rank courses by avg lecture length 
@@ -18,12 +22,11 @@ SELECT
     c.course_number,
     c.year,
     c.url,
-    ROUND(AVG(l.character_count)) as avg_lecture_length,
-    COUNT(l.id) as lecture_count
-FROM course c
-LEFT JOIN lecture l ON c.id = l.course_id
-GROUP BY c.title, c.course_number, c.year, c.url
-HAVING COUNT(l.id) > 0  -- Only include courses with lectures
+    ROUND(s.lecture_chars * 1.0 / s.lecture_count) as avg_lecture_length,
+    s.lecture_count
+FROM course_stats s
+JOIN course c ON c.id = s.course_id
+WHERE s.lecture_count > 0  -- Only include courses with lectures
 ORDER BY avg_lecture_length DESC
 LIMIT 20;
 
@@ -33,13 +36,12 @@ SELECT
     c.course_number,
     c.year,
     c.url,
-    COUNT(p.id) as problem_count,
-    SUM(p.character_count) as total_problem_length 
-FROM course c
-LEFT JOIN problem_set p ON c.id = p.course_id
-GROUP BY c.title, c.course_number, c.year, c.url
-HAVING COUNT(p.id) > 0  -- Only include courses with lectures
-ORDER BY total_problem_length DESC
+    s.problem_set_count as problem_count,
+    s.problem_set_chars as total_problem_length 
+FROM course_stats s
+JOIN course c ON c.id = s.course_id
+WHERE s.problem_set_count > 0  -- Only include courses with problem sets
+ORDER BY s.problem_set_chars DESC
 LIMIT 20;
 
 -- rank courses by avg problem set length
@@ -47,12 +49,11 @@ SELECT
     c.title,
     c.course_number,
     c.year,
-    COUNT(p.id) as problem_count,
-    ROUND(AVG(p.character_count)) as avg_problem_length 
-FROM course c
-LEFT JOIN problem_set p ON c.id = p.course_id
-GROUP BY c.title, c.course_number
-HAVING COUNT(p.id) > 0
+    s.problem_set_count as problem_count,
+    ROUND(s.problem_set_chars * 1.0 / s.problem_set_count) as avg_problem_length 
+FROM course_stats s
+JOIN course c ON c.id = s.course_id
+WHERE s.problem_set_count > 0
 ORDER BY avg_problem_length DESC
 LIMIT 20;
 
@@ -62,24 +63,8 @@ SELECT
     c.course_number,
     c.year,
     c.url,
-    (COALESCE(ps_stats.total_ps_chars, 0) + 
-     COALESCE(r_stats.total_reading_chars, 0) + 
-     COALESCE(l_stats.total_lecture_chars, 0)) as total_content_chars
-FROM course c
-LEFT JOIN (
-    SELECT course_id, SUM(character_count) as total_ps_chars, COUNT(*) as ps_count
-    FROM problem_set 
-    GROUP BY course_id
-) ps_stats ON c.id = ps_stats.course_id
-LEFT JOIN (
-    SELECT course_id, SUM(character_count) as total_reading_chars, COUNT(*) as reading_count
-    FROM reading 
-    GROUP BY course_id
-) r_stats ON c.id = r_stats.course_id
-LEFT JOIN (
-    SELECT course_id, SUM(character_count) as total_lecture_chars, COUNT(*) as lecture_count
-    FROM lecture 
-    GROUP BY course_id
-) l_stats ON c.id = l_stats.course_id
-ORDER BY total_content_chars DESC
+    s.total_chars as total_content_chars
+FROM course_stats s
+JOIN course c ON c.id = s.course_id
+ORDER BY s.total_chars DESC
 LIMIT 20;
@@ -0,0 +1,93 @@
+"""
+Full text indexes over extracted course text, used by search.py.
+
+On Postgres every searchable table gets a generated search_vector tsvector
+column with a GIN index. On SQLite every searchable table gets an FTS5 mirror,
+<table>_fts, kept in sync by triggers. Both are created by create_search_index,
+which runs after Base.metadata.create_all and is safe to run again on a database
+that already has them.
+"""
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger("fulltext")
+
+# table -> text columns indexed, in the order search.py reads them
+SEARCH_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "lecture": ("llm_text",),
+    "reading": ("llm_text",),
+    "problem_set": ("problem_text", "solution_text"),
+    "resource_page": ("text",),
+}
+
+# Postgres text search configuration, tsvectors are limited to 1MB so only the
+# first MAX_INDEXED_CHARS characters of a document are indexed
+TS_CONFIG = "english"
+MAX_INDEXED_CHARS = 500_000
+
+
+def create_search_index(connection):
+    """
+    Create the full text indexes of the connection's dialect, other dialects are skipped
+
+    Args:
+        connection (Connection): Connection inside the create_all transaction, or any other
+    """
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        _create_postgres_index(connection)
+    elif dialect == "sqlite":
+        _create_sqlite_index(connection)
+    else:
+        logger.warning("full text search is not supported on %s", dialect)
+
+
+def tsvector_expression(table: str) -> str:
+    """SQL of the tsvector a table's search_vector column is generated from"""
+    text = " || ' ' || ".join(SEARCH_COLUMNS[table])
+    return f"to_tsvector('{TS_CONFIG}', left({text}, {MAX_INDEXED_CHARS}))"
+
+
+def _create_postgres_index(connection):
+    for table in SEARCH_COLUMNS:
+        # adding a stored generated column computes it for the existing rows
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({tsvector_expression(table)}) STORED"
+        )
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING GIN (search_vector)"
+        )
+
+
+def _create_sqlite_index(connection):
+    for table, columns in SEARCH_COLUMNS.items():
+        fts = f"{table}_fts"
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).first()
+        names = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        # external content table, the text is read back from table itself for snippets
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{names}, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values}); END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        # upserts update in place, only rows whose text changed are reindexed
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values}); END"
+        )
+        if not exists:
+            # index rows saved before the mirror existed
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
@@ -0,0 +1,88 @@
+"""
+Brings a database created by an older version of the models up to date.
+
+create_all only creates missing tables, so columns, unique keys and indexes added
+to existing tables since (source_hash, the upsert keys of bulk_upsert, the
+character_count indexes course_stats is refreshed from) are added here. It runs
+after Base.metadata.create_all and does nothing on an up to date database.
+"""
+import logging
+
+from sqlalchemy import MetaData, UniqueConstraint, inspect
+
+logger = logging.getLogger("migrations")
+
+
+def upgrade_schema(connection, metadata: MetaData):
+    """
+    Add the missing nullable columns, unique keys and indexes of every table in metadata
+
+    Args:
+        connection (Connection): Connection inside the create_all transaction, or any other
+        metadata (MetaData): Models the database should match
+
+    Raises:
+        Exception: When a missing column can not be added, or a unique key can not be
+            added because existing rows break it
+    """
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        _add_columns(connection, inspector, table)
+        _add_unique_keys(connection, inspector, table)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _add_columns(connection, inspector, table):
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            raise Exception(
+                f"{table.name} has no {column.name} column and it can not be added to the "
+                "existing rows as it is not nullable"
+            )
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+        )
+        logger.info("added %s.%s", table.name, column.name)
+
+
+def _add_unique_keys(connection, inspector, table):
+    """Missing unique keys are added as unique indexes, ON CONFLICT accepts either"""
+    existing = {
+        tuple(constraint["column_names"])
+        for constraint in inspector.get_unique_constraints(table.name)
+    }
+    existing.update(
+        tuple(index["column_names"])
+        for index in inspector.get_indexes(table.name)
+        if index["unique"]
+    )
+
+    keys = {
+        tuple(column.name for column in constraint.columns)
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    }
+    keys.update((column.name,) for column in table.columns if column.unique)
+    for columns in sorted(keys - existing):
+        names = ", ".join(columns)
+        duplicated = connection.exec_driver_sql(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table.name} GROUP BY {names} "
+            "HAVING COUNT(*) > 1) d"
+        ).scalar()
+        if duplicated:
+            raise Exception(
+                f"can not add the unique key ({names}) to {table.name}, {duplicated} values "
+                "are duplicated. Delete the duplicate rows and run create_all again"
+            )
+        connection.exec_driver_sql(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table.name}_{'_'.join(columns)} "
+            f"ON {table.name} ({names})"
+        )
+        logger.info("added unique key (%s) to %s", names, table.name)
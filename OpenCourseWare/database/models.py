@@ -1,10 +1,98 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Text,
+    DateTime,
+    JSON,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    event,
+    func,
+    insert,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase, Session, relationship
 from datetime import datetime
+from typing import Dict, List, Optional
+
+from database.fulltext import create_search_index
+from database.migrations import upgrade_schema
+
+
+def dialect_insert(db: Session, table):
+    """INSERT construct of the session's dialect, needed for ON CONFLICT"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise ValueError(f"upserts are not supported on {dialect}")
 
 
 class Base(DeclarativeBase):
-    pass
+    @classmethod
+    def bulk_create(cls, db: Session, rows: List[dict], commit: bool = True) -> int:
+        """
+        Insert many rows with a single executemany, optionally leaving the commit to the caller
+        """
+        if not rows:
+            return 0
+
+        db.execute(insert(cls), rows)
+        if commit:
+            db.commit()
+        return len(rows)
+
+    @classmethod
+    def bulk_upsert(cls, db: Session, rows: List[dict], commit: bool = True) -> int:
+        """
+        Insert many rows, updating rows that already exist for the model's upsert_keys
+        """
+        if not rows:
+            return 0
+
+        # a single statement can not update the same row twice, last row wins
+        unique_rows = {tuple(row[key] for key in cls.upsert_keys): row for row in rows}
+        rows = list(unique_rows.values())
+
+        stmt = dialect_insert(db, cls)
+        set_ = {
+            key: stmt.excluded[key] for key in rows[0] if key not in cls.upsert_keys
+        }
+        if "updated_at" in cls.__table__.c:
+            set_["updated_at"] = datetime.utcnow()
+
+        db.execute(
+            stmt.on_conflict_do_update(index_elements=list(cls.upsert_keys), set_=set_),
+            rows,
+        )
+        if commit:
+            db.commit()
+        return len(rows)
+
+    @classmethod
+    def source_hashes(cls, db: Session, course_id: int) -> Dict[str, str]:
+        """
+        Map of remote url -> source pdf hash for a course's saved rows
+        """
+        url_column = getattr(cls, cls.upsert_keys[1])
+        rows = db.query(url_column, cls.source_hash).filter(cls.course_id == course_id)
+        return {url: source_hash for url, source_hash in rows}
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _upgrade_database(target, connection, **kw):
+    # columns, unique keys and indexes older databases lack, see database/migrations.py
+    upgrade_schema(connection, target)
+    # tsvector columns / FTS5 mirrors of the resource text, see database/fulltext.py
+    create_search_index(connection)
+    # course_stats is new to databases that already hold courses
+    db = Session(bind=connection)
+    if db.query(Course.id).first() and not db.query(CourseStats.course_id).first():
+        CourseStats.refresh(db, commit=False)
+        db.flush()
 
 
 class Course(Base):
@@ -68,9 +156,33 @@ class Course(Base):
         db.refresh(course)
         return course
 
+    @classmethod
+    def upsert(cls, db: Session, **fields) -> int:
+        """
+        Create or update a course keyed on course_number, returns the course id
+        """
+        stmt = dialect_insert(db, cls).values(**fields)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["course_number"],
+            set_={
+                key: stmt.excluded[key] for key in fields if key != "course_number"
+            },
+        ).returning(cls.id)
+
+        course_id = db.execute(stmt).scalar_one()
+        db.commit()
+        return course_id
+
 
 class ProblemSet(Base):
     __tablename__ = "problem_set"
+    __table_args__ = (
+        UniqueConstraint("course_id", "remote_problem_url"),
+        # CourseStats.refresh sums a course's rows from this index alone
+        Index("ix_problem_set_course_id_character_count", "course_id", "character_count"),
+        Index("ix_problem_set_character_count", "character_count"),
+    )
+    upsert_keys = ("course_id", "remote_problem_url")
 
     id = Column(Integer, primary_key=True)
     problem_text = Column(Text, nullable=False)
@@ -82,6 +194,7 @@ class ProblemSet(Base):
     course_id = Column(Integer, ForeignKey("course.id"), nullable=False)
     course = relationship("Course", back_populates="problem_sets")
     character_count = Column(Integer, nullable=False)
+    source_hash = Column(String(64))
 
     def __repr__(self):
         return f"<ProblemSet(id={self.id}, title='{self.title}')>"
@@ -116,6 +229,12 @@ class ProblemSet(Base):
 
 class Lecture(Base):
     __tablename__ = "lecture"
+    __table_args__ = (
+        UniqueConstraint("course_id", "remote_url"),
+        Index("ix_lecture_course_id_character_count", "course_id", "character_count"),
+        Index("ix_lecture_character_count", "character_count"),
+    )
+    upsert_keys = ("course_id", "remote_url")
 
     id = Column(Integer, primary_key=True)
     llm_text = Column(Text, nullable=False)
@@ -125,6 +244,7 @@ class Lecture(Base):
     course_id = Column(Integer, ForeignKey("course.id"), nullable=False)
     course = relationship("Course", back_populates="lectures")
     character_count = Column(Integer, nullable=False)
+    source_hash = Column(String(64))
 
     def __repr__(self):
         return f"<Lecture(id={self.id}, course_id='{self.course_id}')>"
@@ -155,6 +275,12 @@ class Lecture(Base):
 
 class Reading(Base):
     __tablename__ = "reading"
+    __table_args__ = (
+        UniqueConstraint("course_id", "remote_url"),
+        Index("ix_reading_course_id_character_count", "course_id", "character_count"),
+        Index("ix_reading_character_count", "character_count"),
+    )
+    upsert_keys = ("course_id", "remote_url")
 
     id = Column(Integer, primary_key=True)
     llm_text = Column(Text, nullable=False)
@@ -164,6 +290,7 @@ class Reading(Base):
     course_id = Column(Integer, ForeignKey("course.id"), nullable=False)
     course = relationship("Course", back_populates="readings")
     character_count = Column(Integer, nullable=False)
+    source_hash = Column(String(64))
 
     def __repr__(self):
         return f"<Reading(id={self.id}, course_id='{self.course_id}')>"
@@ -191,3 +318,129 @@ class Reading(Base):
         db.commit()
         db.refresh(reading)
         return reading 
+
+
+class ResourcePage(Base):
+    """
+    Markdown of a single pdf page of a lecture, reading or problem set, used by
+    page chunked extraction instead of the whole document text on the parent row.
+    """
+
+    __tablename__ = "resource_page"
+    __table_args__ = (UniqueConstraint("resource_type", "resource_id", "page_number"),)
+    upsert_keys = ("resource_type", "resource_id", "page_number")
+
+    # resource_type values, problem sets have a problem and a solution pdf
+    LECTURE = "lecture"
+    READING = "reading"
+    PROBLEM = "problem"
+    SOLUTION = "solution"
+
+    id = Column(Integer, primary_key=True)
+    resource_type = Column(String(20), nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    page_number = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    character_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ResourcePage(resource_type='{self.resource_type}', resource_id={self.resource_id}, page_number={self.page_number})>"
+
+    @classmethod
+    def delete_after(cls, db: Session, resource_type: str, resource_id: int, page_count: int):
+        """
+        Drop pages left over from a longer previous version of the document
+        """
+        db.query(cls).filter(
+            cls.resource_type == resource_type,
+            cls.resource_id == resource_id,
+            cls.page_number > page_count,
+        ).delete(synchronize_session=False)
+
+    @classmethod
+    def text_for(cls, db: Session, resource_type: str, resource_id: int) -> str:
+        """
+        Whole document markdown put back together from its pages
+        """
+        rows = (
+            db.query(cls.text)
+            .filter(cls.resource_type == resource_type, cls.resource_id == resource_id)
+            .order_by(cls.page_number)
+        )
+        return "".join(text for text, in rows)
+
+
+class CourseStats(Base):
+    """
+    Per course counts and character totals of problem sets, lectures and readings,
+    kept up to date by refresh whenever a course's resources are saved so the
+    analysis queries read one row per course instead of aggregating every resource.
+    """
+
+    __tablename__ = "course_stats"
+    __table_args__ = (
+        Index("ix_course_stats_total_chars", "total_chars"),
+        Index("ix_course_stats_lecture_chars", "lecture_chars"),
+        Index("ix_course_stats_problem_set_chars", "problem_set_chars"),
+    )
+    upsert_keys = ("course_id",)
+
+    course_id = Column(Integer, ForeignKey("course.id"), primary_key=True)
+    problem_set_count = Column(Integer, nullable=False, default=0)
+    problem_set_chars = Column(Integer, nullable=False, default=0)
+    lecture_count = Column(Integer, nullable=False, default=0)
+    lecture_chars = Column(Integer, nullable=False, default=0)
+    reading_count = Column(Integer, nullable=False, default=0)
+    reading_chars = Column(Integer, nullable=False, default=0)
+    total_chars = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CourseStats(course_id={self.course_id}, total_chars={self.total_chars})>"
+
+    @classmethod
+    def refresh(cls, db: Session, course_ids: Optional[List[int]] = None, commit: bool = True) -> int:
+        """
+        Recompute the stats of some courses from their resources, every course when
+        course_ids is None (to backfill an existing database)
+
+        Args:
+            db (Session): Session, the refresh joins its transaction when commit is False
+            course_ids (list): Course ids, None for all
+
+        Returns:
+            int: Number of courses refreshed
+        """
+        every_course = course_ids is None
+        if every_course:
+            course_ids = [course_id for course_id, in db.query(Course.id)]
+        if not course_ids:
+            return 0
+
+        rows = {
+            course_id: dict(
+                course_id=course_id,
+                problem_set_count=0,
+                problem_set_chars=0,
+                lecture_count=0,
+                lecture_chars=0,
+                reading_count=0,
+                reading_chars=0,
+            )
+            for course_id in course_ids
+        }
+        for model, prefix in ((ProblemSet, "problem_set"), (Lecture, "lecture"), (Reading, "reading")):
+            totals = db.query(
+                model.course_id, func.count(), func.coalesce(func.sum(model.character_count), 0)
+            )
+            if not every_course:
+                totals = totals.filter(model.course_id.in_(course_ids))
+            for course_id, count, chars in totals.group_by(model.course_id):
+                rows[course_id][f"{prefix}_count"] = count
+                rows[course_id][f"{prefix}_chars"] = chars
+        for row in rows.values():
+            row["total_chars"] = row["problem_set_chars"] + row["lecture_chars"] + row["reading_chars"]
+
+        return cls.bulk_upsert(db, list(rows.values()), commit=commit)
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from downloader import probe
+
+
+class DownloadCache:
+    """
+    On-disk blob cache for course zips.
+
+    Blobs are keyed by download url plus the upstream ETag / Content-Length, so a
+    changed zip upstream is a cache miss. Least recently used blobs, and partial
+    downloads left behind by interrupted runs, are evicted once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        max_bytes: int = 5 * 1024**3,
+        timeout: int = 30,
+    ):
+        self.cache_dir = (
+            Path(cache_dir) if cache_dir else Path.cwd().joinpath(".cache", "downloads")
+        )
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.logger = logging.getLogger("download_cache")
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def fetch(
+        self,
+        url: str,
+        dest: Path,
+        download: Callable[[str, Path, Tuple], None],
+        headers: Optional[dict] = None,
+    ) -> Path:
+        """
+        Place the contents of url at dest, reusing a cached blob when upstream is unchanged
+
+        Args:
+            url (str): Download url
+            dest (Path): Where the file should end up
+            download (callable): download(url, path, probed) writes the remote file to path
+                on a miss, probed is the downloader.probe result the cache key was made from
+            headers (dict): Request headers of the HEAD request
+
+        Returns:
+            Path: dest
+        """
+        probed = probe(url, timeout=self.timeout, headers=headers)
+        key = self._key(url, probed)
+        if key is None:
+            self.logger.info("no validators for %s, bypassing cache", url)
+            download(url, dest, probed)
+            return dest
+
+        blob = self._blob_path(key)
+        if blob.exists():
+            os.utime(blob)
+            self._place(blob, dest)
+            with self._lock:
+                self.hits += 1
+            self.logger.info("download cache hit for %s", url)
+            return dest
+
+        with self._key_lock(key):
+            if not blob.exists():
+                with self._lock:
+                    self.misses += 1
+
+                # stable download path so an interrupted download resumes on the next run
+                download(url, self._download_path(key), probed)
+                os.replace(self._download_path(key), blob)
+                self.logger.info("cached %s (%s bytes)", url, blob.stat().st_size)
+
+        self._place(blob, dest)
+        self._evict()
+        return dest
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _download_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.download"
+
+    def _key(self, url: str, probed: Tuple) -> Optional[str]:
+        """Cache key from url and upstream validators, None when upstream has none"""
+        size, etag, _ = probed
+        if not etag and size is None:
+            return None
+
+        return hashlib.sha256(
+            f"{url}\n{etag or ''}\n{'' if size is None else size}".encode("utf-8")
+        ).hexdigest()
+
+    def _blob_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.blob"
+
+    def _place(self, blob: Path, dest: Path):
+        """Hard link the blob to dest, copy when linking is not possible"""
+        dest.unlink(missing_ok=True)
+        try:
+            os.link(blob, dest)
+        except OSError:
+            shutil.copyfile(blob, dest)
+
+    def _evict(self):
+        """
+        Drop least recently used blobs until the cache fits in max_bytes. The
+        .download.part files of a key count as one entry, skipped while it downloads.
+        """
+        with self._lock:
+            entries = {}
+            for path in self.cache_dir.glob("*"):
+                if not (path.name.endswith(".blob") or ".download.part" in path.name):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.name.endswith(".blob"):
+                    entries[path.name] = (stat.st_mtime, stat.st_size, [path])
+                    continue
+                key = path.name.split(".", 1)[0]
+                mtime, size, paths = entries.get(key, (0.0, 0, []))
+                entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size, paths + [path])
+
+            total = sum(size for _, size, _ in entries.values())
+            for name, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+                if total <= self.max_bytes:
+                    break
+                key_lock = self._key_locks.get(name)
+                if key_lock is not None and not key_lock.acquire(blocking=False):
+                    # downloading right now
+                    continue
+                try:
+                    for path in paths:
+                        path.unlink(missing_ok=True)
+                finally:
+                    if key_lock is not None:
+                        key_lock.release()
+                total -= size
+                self.logger.info("evicted %s from download cache", name)
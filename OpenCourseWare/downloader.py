@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import requests
+
+from helpers import http_session
+
+logger = logging.getLogger("downloader")
+
+
+def part_paths(dest: Path):
+    """In-progress data file and its segment state file for dest"""
+    dest = Path(dest)
+    return (
+        dest.with_name(dest.name + ".part"),
+        dest.with_name(dest.name + ".part.json"),
+    )
+
+
+def download_file(
+    url: str,
+    dest: Path,
+    segments: int = 4,
+    min_segment_size: int = 16 * 1024 * 1024,
+    chunk_size: int = 1024 * 1024,
+    timeout: int = 30,
+    retries: int = 3,
+    headers: Optional[dict] = None,
+    probed: Optional[Tuple[Optional[int], Optional[str], bool]] = None,
+) -> Path:
+    """
+    Download url to dest with parallel HTTP Range requests.
+
+    Progress is kept in dest.part / dest.part.json so an interrupted download
+    resumes where each segment stopped. Servers without range support get a
+    single stream. The final size is checked against Content-Length. Rate
+    limited (429) and unavailable responses are retried after Retry-After.
+
+    Args:
+        url (str): Remote file
+        dest (Path): Local destination
+        segments (int): Parallel range requests for large files
+        min_segment_size (int): Files smaller than two segments of this size use one stream
+        chunk_size (int): Bytes read and written at a time
+        timeout (int): Per request timeout in seconds
+        retries (int): Attempts per segment, each attempt resumes from its progress
+        headers (dict): Extra request headers
+        probed (tuple): Result of an earlier probe of url, saves the HEAD request
+
+    Returns:
+        Path: dest
+    """
+    dest = Path(dest)
+    part, state_path = part_paths(dest)
+    with http_session(max(1, segments), retries=retries) as session:
+        return _download(
+            session, url, dest, part, state_path, segments, min_segment_size,
+            chunk_size, timeout, retries, headers, probed,
+        )
+
+
+def _download(
+    session, url, dest, part, state_path, segments, min_segment_size,
+    chunk_size, timeout, retries, headers, probed,
+) -> Path:
+    size, etag, accepts_ranges = probed or probe(url, timeout, headers, session)
+
+    if size is None:
+        # unknown length, nothing to split or resume against
+        _fetch_range(session, url, part, 0, None, {"done": 0}, False, None, chunk_size, timeout, headers)
+        os.replace(part, dest)
+        return dest
+
+    state = _load_state(state_path, url, size, etag) if accepts_ranges else None
+    if state is None or not part.exists():
+        count = segments if accepts_ranges and size >= 2 * min_segment_size else 1
+        state = {
+            "url": url,
+            "size": size,
+            "etag": etag,
+            "segments": _split(size, max(1, count)),
+        }
+        with open(part, "wb") as f:
+            f.truncate(size)
+    else:
+        logger.info("resuming %s at %s of %s bytes", url, _done_bytes(state), size)
+
+    lock = threading.Lock()
+
+    def save_state():
+        with lock:
+            tmp = state_path.with_name(state_path.name + ".tmp")
+            tmp.write_text(json.dumps(state))
+            os.replace(tmp, state_path)
+
+    def run_segment(segment: dict):
+        for attempt in range(1, retries + 1):
+            try:
+                _fetch_range(
+                    session, url, part, segment["start"], segment["end"], segment,
+                    accepts_ranges, save_state if accepts_ranges else None,
+                    chunk_size, timeout, headers,
+                )
+                return
+            except requests.RequestException as e:
+                if not accepts_ranges or attempt == retries:
+                    raise
+                logger.warning("segment %s of %s failed (%s), retrying", segment["start"], url, e)
+
+    pending = [s for s in state["segments"] if s["start"] + s["done"] < s["end"]]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+            list(pool.map(run_segment, pending))
+    finally:
+        if accepts_ranges:
+            save_state()
+
+    actual = part.stat().st_size
+    if _done_bytes(state) != size or actual != size:
+        raise Exception(f"Incomplete download of {url}: {_done_bytes(state)} of {size} bytes")
+
+    os.replace(part, dest)
+    state_path.unlink(missing_ok=True)
+    return dest
+
+
+def probe(
+    url: str,
+    timeout: int = 30,
+    headers: Optional[dict] = None,
+    session: Optional[requests.Session] = None,
+) -> Tuple[Optional[int], Optional[str], bool]:
+    """(size, etag, accepts_ranges) from a HEAD request, (None, None, False) when it fails"""
+    try:
+        response = (session or requests).head(
+            url, headers=headers, allow_redirects=True, timeout=timeout
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.warning("HEAD failed for %s: %s", url, e)
+        return None, None, False
+
+    length = response.headers.get("Content-Length")
+    size = int(length) if length and length.isdigit() else None
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return size, response.headers.get("ETag"), accepts_ranges
+
+
+def _split(size: int, count: int) -> List[dict]:
+    step = -(-size // count)
+    return [
+        {"start": start, "end": min(start + step, size), "done": 0}
+        for start in range(0, size, step)
+    ]
+
+
+def _done_bytes(state: dict) -> int:
+    return sum(segment["done"] for segment in state["segments"])
+
+
+def _load_state(state_path: Path, url: str, size: int, etag: Optional[str]) -> Optional[dict]:
+    if not state_path.exists():
+        return None
+    try:
+        state = json.loads(state_path.read_text())
+    except ValueError:
+        return None
+    if state.get("url") != url or state.get("size") != size or state.get("etag") != etag:
+        return None
+    return state
+
+
+def _fetch_range(session, url, part, start, end, segment, ranged, save_state, chunk_size, timeout, headers):
+    """
+    Stream bytes [start + done, end) of url into part at the same offset. Only
+    flushed bytes are counted in segment["done"], so saved progress never runs
+    ahead of the data on disk.
+    """
+    offset = start + segment["done"]
+    request_headers = dict(headers or {})
+    if ranged:
+        request_headers["Range"] = f"bytes={offset}-{end - 1}"
+
+    with session.get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        if ranged and response.status_code != 206:
+            raise requests.RequestException(f"range request ignored for {url}")
+
+        mode = "r+b" if end is not None else "wb"
+        written = 0
+        with open(part, mode, buffering=4 * chunk_size) as f:
+            f.seek(offset)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+                if written >= 16 * chunk_size:
+                    f.flush()
+                    segment["done"] += written
+                    written = 0
+                    if save_state:
+                        save_state()
+            f.flush()
+            segment["done"] += written
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+import pymupdf4llm
+
+
+class ExtractionCache:
+    """
+    SQLite backed cache of extracted pdf markdown.
+
+    Entries are keyed by the pdf content hash, the pymupdf4llm version and the
+    extraction options, and stored zlib compressed. Least recently used entries
+    are evicted once the stored (compressed) size passes max_bytes. The stored
+    size is kept as a running total by triggers, so a put does not sum the table.
+
+    Every thread using the cache gets one connection, kept open until close.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = 2 * 1024**3):
+        self.path = Path(path) if path else Path.cwd().joinpath(".cache", "extractions.sqlite")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self.logger = logging.getLogger("extract_cache")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS extraction (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS extraction_last_access ON extraction (last_access)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS extraction_total (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    size INTEGER NOT NULL
+                )
+                """
+            )
+            # caches written before the total existed are summed once
+            conn.execute(
+                "INSERT OR IGNORE INTO extraction_total (id, size) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM extraction"
+            )
+            for trigger in (
+                "extraction_insert AFTER INSERT ON extraction BEGIN "
+                "UPDATE extraction_total SET size = size + NEW.size; END",
+                "extraction_update AFTER UPDATE OF size ON extraction BEGIN "
+                "UPDATE extraction_total SET size = size + NEW.size - OLD.size; END",
+                "extraction_delete AFTER DELETE ON extraction BEGIN "
+                "UPDATE extraction_total SET size = size - OLD.size; END",
+            ):
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection, used as a context manager it commits or rolls back"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # only used by this thread, close may run in another one
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close the connections of every thread, the next use opens new ones"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def key(self, pdf_sha256: str, options: Optional[dict] = None) -> str:
+        """Cache key for a pdf content hash under the current extractor version and options"""
+        options_json = json.dumps(options or {}, sort_keys=True)
+        return hashlib.sha256(
+            f"{pdf_sha256}:{pymupdf4llm.__version__}:{options_json}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached markdown for key, None on a miss"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT data FROM extraction WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE extraction SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if not row:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key: str, text: str):
+        """Store markdown for key, evicting old entries when over max_bytes"""
+        data = zlib.compress(text.encode("utf-8"))
+        with self._connect() as conn:
+            # an upsert, the delete of INSERT OR REPLACE would not fire the total's trigger
+            conn.execute(
+                """
+                INSERT INTO extraction (key, data, size, last_access) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    data = excluded.data, size = excluded.size, last_access = excluded.last_access
+                """,
+                (key, data, len(data), time.time()),
+            )
+            self._evict(conn)
+
+    def size(self) -> int:
+        """Stored (compressed) bytes of every entry"""
+        with self._connect() as conn:
+            return self._total(conn)
+
+    def _total(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT size FROM extraction_total").fetchone()[0]
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = self._total(conn)
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        oldest = conn.execute("SELECT key, size FROM extraction ORDER BY last_access")
+        for key, size in oldest:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        oldest.close()
+
+        conn.executemany("DELETE FROM extraction WHERE key = ?", evicted)
+        self.logger.info("evicted %s entries from extraction cache", len(evicted))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,11 +1,421 @@
+import logging
+import mmap
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import fitz
 import pymupdf4llm
 
-def extract_pdf(pdf_path: str) -> str:
-    """Extract text from a PDF file using pymupdf4llm for optimal LLM understanding."""
+from extract_cache import ExtractionCache
+from helpers import file_sha256
+from profiling import CourseProfile
+
+logger = logging.getLogger(__name__)
+
+# extraction tiers, recorded per pdf
+TIER_FAST = "fast"   # every page read with fitz get_text
+TIER_LAYOUT = "layout"   # every page converted by pymupdf4llm
+TIER_MIXED = "mixed"
+TIER_CACHED = "cached"   # served from the extraction cache, tier of the original run unknown
+
+
+def extract_pdf(pdf_path: str, tiered: bool = False) -> Optional[str]:
+    """
+    Extract text from a PDF file using pymupdf4llm for optimal LLM understanding.
+
+    Returns:
+        str: Markdown, None when the PDF could not be extracted
+    """
+    if tiered:
+        return extract_pdf_tiered(pdf_path)[0]
     try:
         text = pymupdf4llm.to_markdown(pdf_path)
         return text
-    except Exception as e:
-        print(f"Error extracting PDF: {e}")
-        return ""
+    except Exception:
+        logger.exception("error extracting %s", pdf_path)
+        return None
+
+
+def probe_page(
+    page: fitz.Page,
+    max_drawings: int = 8,
+    heading_ratio: float = 1.2,
+    min_chars_per_block: int = 20,
+) -> str:
+    """
+    Cheap look at a page's structure to pick its extraction tier
+
+    Pages with images, more than a few vector drawings (tables, figures, boxes),
+    text in a larger font than the body (headings) or many short text blocks
+    (columns, sparse slide text) need pymupdf4llm's layout handling. Everything
+    else is plain running text that fitz reads directly.
+
+    Returns:
+        str: TIER_FAST or TIER_LAYOUT
+    """
+    if page.get_images():
+        return TIER_LAYOUT
+    if len(page.get_drawings()) > max_drawings:
+        return TIER_LAYOUT
+
+    blocks = [b for b in page.get_text("dict")["blocks"] if b["type"] == 0]
+    spans = [
+        span for block in blocks for line in block["lines"] for span in line["spans"]
+        if span["text"].strip()
+    ]
+    if not spans:
+        return TIER_FAST
+
+    sizes = sorted(span["size"] for span in spans)
+    body_size = sizes[len(sizes) // 2]
+    if sizes[-1] > body_size * heading_ratio:
+        return TIER_LAYOUT
+
+    chars = sum(len(span["text"]) for span in spans)
+    if len(blocks) > 1 and chars / len(blocks) < min_chars_per_block:
+        return TIER_LAYOUT
+    return TIER_FAST
+
+
+def extract_pdf_tiered(pdf_path: str) -> Tuple[Optional[str], str]:
+    """
+    Extract text from a PDF file, using fitz for simple pages and pymupdf4llm for the rest
+
+    Returns:
+        tuple: (markdown, tier) where tier is TIER_FAST, TIER_LAYOUT or TIER_MIXED,
+            markdown is None when the PDF could not be extracted
+    """
+    try:
+        with fitz.open(pdf_path) as doc:
+            return _extract_tiered(doc)
+    except Exception:
+        logger.exception("error extracting %s", pdf_path)
+        return None, TIER_LAYOUT
+
+
+def extract_document(pdf_path: str, tiered: bool = False) -> Tuple[Optional[str], str, Optional[bytes]]:
+    """
+    Read a PDF file once and extract its markdown from the bytes read
+
+    The bytes are handed back so the pdf can be merged into combined pdfs
+    without opening the file a second time.
+
+    Returns:
+        tuple: (markdown, tier, pdf bytes), markdown is None when the PDF could not be
+            extracted and the bytes are None when the file could not be read
+    """
+    data = None
+    try:
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            if tiered:
+                text, tier = _extract_tiered(doc)
+            else:
+                text, tier = pymupdf4llm.to_markdown(doc), TIER_LAYOUT
+        return text, tier, data
+    except Exception:
+        logger.exception("error extracting %s", pdf_path)
+        return None, TIER_LAYOUT, data
+
+
+def _extract_tiered(doc: fitz.Document) -> Tuple[str, str]:
+    tiers = [probe_page(page) for page in doc]
+    layout_pages = [i for i, tier in enumerate(tiers) if tier == TIER_LAYOUT]
+    layout_text = {}
+    if layout_pages:
+        chunks = pymupdf4llm.to_markdown(doc, pages=layout_pages, page_chunks=True)
+        layout_text = {
+            chunk["metadata"]["page_number"] - 1: chunk["text"] for chunk in chunks
+        }
+
+    texts = []
+    for i, tier in enumerate(tiers):
+        if tier == TIER_LAYOUT:
+            texts.append(layout_text.get(i, ""))
+        else:
+            page_text = doc[i].get_text(sort=True).strip()
+            texts.append(page_text + "\n\n" if page_text else "")
+
+    if not layout_pages:
+        tier = TIER_FAST
+    elif len(layout_pages) == len(tiers):
+        tier = TIER_LAYOUT
+    else:
+        tier = TIER_MIXED
+    return "".join(texts), tier
+
+
+@contextmanager
+def open_pdf(pdf_path: str, use_mmap: bool = False) -> Iterator[fitz.Document]:
+    """
+    Open a PDF file, optionally from a read-only memory map instead of file reads
+
+    Yields:
+        fitz.Document: closed again on exit
+    """
+    if not use_mmap:
+        with fitz.open(pdf_path) as doc:
+            yield doc
+        return
+
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            with fitz.open(stream=view, filetype="pdf") as doc:
+                yield doc
+        finally:
+            view.release()
+
+
+def extract_pdf_pages(pdf_path: str, pages: Sequence[int]) -> List[Tuple[int, str]]:
+    """
+    Extract markdown for some pages of a PDF file
+
+    Args:
+        pdf_path (str): Path of the PDF file
+        pages (list): 1-based page numbers
+
+    Returns:
+        list: (page number, markdown) for each page
+
+    Raises:
+        Exception: When the pages can not be extracted, so they are never saved as empty
+    """
+    chunks = pymupdf4llm.to_markdown(
+        pdf_path, pages=[page - 1 for page in pages], page_chunks=True
+    )
+    return [(chunk["metadata"]["page_number"], chunk["text"]) for chunk in chunks]
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages(
+    pdf_path: str,
+    pages: Optional[Sequence[int]] = None,
+    pages_per_task: int = 8,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    profile: Optional[CourseProfile] = None,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Stream the markdown of a PDF page by page, with page ranges spread across a process pool
+
+    Only a few ranges per worker are in flight at once, so a huge PDF never sits
+    in memory as one string.
+
+    Args:
+        pdf_path (str): Path of the PDF file
+        pages (list): 1-based page numbers to extract, defaults to every page. Pages past the end are skipped
+        pages_per_task (int): Pages handed to a worker at a time
+        max_workers (int): Pool size, defaults to the number of CPUs. 1 extracts in-process.
+            With an executor, the size of that pool, which bounds the ranges in flight
+        executor (Executor): Optional shared pool, takes precedence over max_workers
+        profile (CourseProfile): Optional profile the pool workers are sampled into
+
+    Yields:
+        tuple: (page number, markdown) in page order
+
+    Raises:
+        Exception: When a page range fails to extract
+    """
+    page_count = pdf_page_count(pdf_path)
+    if pages is None:
+        pages = range(1, page_count + 1)
+    pages = [page for page in pages if 1 <= page <= page_count]
+    ranges = [
+        pages[i:i + pages_per_task] for i in range(0, len(pages), pages_per_task)
+    ]
+    if not ranges:
+        return
+
+    if executor is None:
+        workers = min(max_workers or os.cpu_count() or 1, len(ranges))
+        if workers <= 1:
+            for page_range in ranges:
+                yield from extract_pdf_pages(pdf_path, page_range)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from _iter_ranges(pool, pdf_path, ranges, 2 * workers, profile)
+        return
+
+    window = 2 * (max_workers or os.cpu_count() or 1)
+    yield from _iter_ranges(executor, pdf_path, ranges, window, profile)
+
+
+def _iter_ranges(
+    executor: Executor,
+    pdf_path: str,
+    ranges: List[List[int]],
+    window: int,
+    profile: Optional[CourseProfile] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Keep at most window page ranges in flight, yielding results in order"""
+    extract = profile.wrap(extract_pdf_pages) if profile else extract_pdf_pages
+    remaining = iter(ranges)
+    in_flight = deque()
+    for page_range in remaining:
+        in_flight.append(executor.submit(extract, pdf_path, page_range))
+        if len(in_flight) >= window:
+            break
+
+    while in_flight:
+        result = in_flight.popleft().result()
+        yield from profile.unwrap(result) if profile else result
+        next_range = next(remaining, None)
+        if next_range is not None:
+            in_flight.append(executor.submit(extract, pdf_path, next_range))
+
+
+def extract_pdfs(
+    pdf_paths: List[str],
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    cache: Optional[ExtractionCache] = None,
+    hashes: Optional[List[Optional[str]]] = None,
+    tiered: bool = False,
+    tiers: Optional[List[str]] = None,
+    timings: Optional[List[Optional[Tuple[float, float]]]] = None,
+    profile: Optional[CourseProfile] = None,
+    documents: Optional[Dict[str, bytes]] = None,
+) -> List[Optional[str]]:
+    """
+    Extract text from many PDF files across a process pool
+
+    Args:
+        pdf_paths (list): Paths of the PDF files to extract
+        max_workers (int): Pool size, defaults to the number of CPUs. 1 extracts in-process
+        executor (Executor): Optional shared pool, takes precedence over max_workers
+        cache (ExtractionCache): Optional cache, hits skip the pdf parse entirely
+        hashes (list): Optional precomputed sha256 of each pdf, used for cache keys
+        tiered (bool): Read simple pages with fitz instead of pymupdf4llm, see extract_pdf_tiered
+        tiers (list): Optional list that gets the tier used for each path appended, in order
+        timings (list): Optional list that gets (time.time() at the start, seconds) of each
+            extraction appended, in order, None for cache hits
+        profile (CourseProfile): Optional profile the pool workers are sampled into
+        documents (dict): Optional dict that gets the bytes of every pdf extracted here, by
+            path, read once by the worker so they can be merged without opening the file
+            again. Cache hits are not read and not added
+
+    Returns:
+        list: Markdown for each path, in the same order as pdf_paths, None for pdfs that
+            could not be extracted
+    """
+    if not pdf_paths:
+        return []
+
+    keep = documents is not None
+    if cache is None:
+        texts, used, took, read = _extract_uncached(pdf_paths, max_workers, executor, tiered, profile, keep)
+        _add_documents(documents, pdf_paths, read)
+        if tiers is not None:
+            tiers.extend(used)
+        if timings is not None:
+            timings.extend(took)
+        return texts
+
+    hashes = hashes or [None] * len(pdf_paths)
+    keys = [
+        cache_key(cache, path, pdf_hash, tiered)
+        for path, pdf_hash in zip(pdf_paths, hashes)
+    ]
+    texts = [cache.get(key) for key in keys]
+    used = [TIER_CACHED if text is not None else None for text in texts]
+    took = [None] * len(texts)
+
+    misses = [i for i, text in enumerate(texts) if text is None]
+    missed = [pdf_paths[i] for i in misses]
+    extracted, extracted_tiers, extracted_took, read = _extract_uncached(
+        missed, max_workers, executor, tiered, profile, keep
+    )
+    _add_documents(documents, missed, read)
+    for i, text, tier, timing in zip(misses, extracted, extracted_tiers, extracted_took):
+        texts[i] = text
+        used[i] = tier
+        took[i] = timing
+        if text:
+            cache.put(keys[i], text)
+
+    if tiers is not None:
+        tiers.extend(used)
+    if timings is not None:
+        timings.extend(took)
+    return texts
+
+
+def cache_key(
+    cache: ExtractionCache, pdf_path: str, pdf_hash: Optional[str] = None, tiered: bool = False
+) -> str:
+    """Extraction cache key of a pdf, hashing the file when pdf_hash is not known"""
+    # the tiered extractor reads simple pages with fitz itself, so its output also
+    # depends on the MuPDF bindings
+    options = {"tiered": True, "fitz": fitz.VersionBind} if tiered else None
+    return cache.key(pdf_hash or file_sha256(pdf_path), options)
+
+
+def _extract_uncached(
+    pdf_paths: List[str],
+    max_workers: Optional[int],
+    executor: Optional[Executor],
+    tiered: bool = False,
+    profile: Optional[CourseProfile] = None,
+    keep_bytes: bool = False,
+) -> Tuple[List[Optional[str]], List[str], List[Tuple[float, float]], List[Optional[bytes]]]:
+    """(markdown, tier, (start, seconds), pdf bytes when keep_bytes) lists for pdf_paths"""
+    if not pdf_paths:
+        return [], [], [], []
+
+    workers = min(max_workers or os.cpu_count() or 1, len(pdf_paths))
+    if executor is None and workers <= 1:
+        # in-process work is sampled with the calling thread
+        results = [_extract_timed(path, tiered, keep_bytes) for path in pdf_paths]
+    else:
+        options = ([tiered] * len(pdf_paths), [keep_bytes] * len(pdf_paths))
+        extract = profile.wrap(_extract_timed) if profile else _extract_timed
+        if executor is not None:
+            results = list(executor.map(extract, pdf_paths, *options))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(extract, pdf_paths, *options))
+        if profile:
+            results = [profile.unwrap(result) for result in results]
+
+    return (
+        [text for text, _, _, _ in results],
+        [tier for _, tier, _, _ in results],
+        [timing for _, _, timing, _ in results],
+        [data for _, _, _, data in results],
+    )
+
+
+def _add_documents(documents: Optional[Dict[str, bytes]], pdf_paths: List[str], read: List[Optional[bytes]]):
+    if documents is None:
+        return
+    documents.update((path, data) for path, data in zip(pdf_paths, read) if data is not None)
+
+
+def _extract_timed(
+    pdf_path: str, tiered: bool, keep_bytes: bool = False
+) -> Tuple[Optional[str], str, Tuple[float, float], Optional[bytes]]:
+    """Extract in a worker, timed there so pool queueing is not counted"""
+    started = time.time()
+    start = time.perf_counter()
+    data = None
+    if keep_bytes:
+        text, tier, data = extract_document(pdf_path, tiered)
+    elif tiered:
+        text, tier = extract_pdf_tiered(pdf_path)
+    else:
+        text, tier = _extract_layout(pdf_path)
+    return text, tier, (started, time.perf_counter() - start), data
+
 
+def _extract_layout(pdf_path: str) -> Tuple[Optional[str], str]:
+    return extract_pdf(pdf_path), TIER_LAYOUT
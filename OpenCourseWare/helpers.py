@@ -1,3 +1,9 @@
+import hashlib
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 request_headers = {
     "accept": "application/json",
     "accept-language": "en-US,en;q=0.9",
@@ -24,46 +30,61 @@ download_headers = {
 }
 
 
-def create_request_payload():
+DEFAULT_FEATURE_TAGS = ("Lecture Notes", "Problem Sets with Solutions", "Readings")
+
+
+def _should_terms(field, values):
+    return {"bool": {"should": [{"term": {field: value}} for value in values]}}
+
+
+def create_request_payload(
+    department="Mechanical Engineering",
+    topics=None,
+    feature_tags=DEFAULT_FEATURE_TAGS,
+    offset=0,
+    size=200,
+):
+    """
+    Build an open.mit.edu search payload for OCW courses
+
+    Args:
+        department (str): Department name to filter by, None for every department
+        topics (list): Topics to filter by, defaults to the department name. [] for no topic filter
+        feature_tags (list): Course feature tags, a course needs at least one of them
+        offset (int): Index of the first hit ("from")
+        size (int): Number of hits in the page
+
+    Returns:
+        dict: Search request payload
+    """
+    if topics is None:
+        topics = [department] if department else []
+
+    # (facet, clause), facets are left out of their own aggregation filter
+    clauses = [
+        ("object_type", _should_terms("object_type.keyword", ["course"])),
+        ("offered_by", _should_terms("offered_by", ["OCW"])),
+    ]
+    if topics:
+        clauses.append(("topics", _should_terms("topics", topics)))
+    if department:
+        clauses.append(("department_name", _should_terms("department_name", [department])))
+    if feature_tags:
+        clauses.append(
+            ("course_feature_tags", _should_terms("course_feature_tags", feature_tags))
+        )
+
+    def agg_filter(exclude=None):
+        must = [clause for facet, clause in clauses if facet != exclude]
+        return {"bool": {"should": [{"bool": {"filter": {"bool": {"must": must}}}}]}}
+
     return {
-        "from": 0,
-        "size": 200,
+        "from": offset,
+        "size": size,
         "sort": [
             {"runs.best_start_date": {"order": "desc", "nested": {"path": "runs"}}}
         ],
-        "post_filter": {
-            "bool": {
-                "must": [
-                    {"bool": {"should": [{"term": {"object_type.keyword": "course"}}]}},
-                    {"bool": {"should": [{"term": {"offered_by": "OCW"}}]}},
-                    {
-                        "bool": {
-                            "should": [{"term": {"topics": "Mechanical Engineering"}}]
-                        }
-                    },
-                    {
-                        "bool": {
-                            "should": [
-                                {"term": {"department_name": "Mechanical Engineering"}}
-                            ]
-                        }
-                    },
-                    {
-                        "bool": {
-                            "should": [
-                                {"term": {"course_feature_tags": "Lecture Notes"}},
-                                {
-                                    "term": {
-                                        "course_feature_tags": "Problem Sets with Solutions"
-                                    }
-                                },
-                                {"term": {"course_feature_tags": "Readings"}},
-                            ]
-                        }
-                    },
-                ]
-            }
-        },
+        "post_filter": {"bool": {"must": [clause for _, clause in clauses]}},
         "query": {
             "bool": {
                 "should": [
@@ -79,149 +100,11 @@ def create_request_payload():
         },
         "aggs": {
             "agg_filter_topics": {
-                "filter": {
-                    "bool": {
-                        "should": [
-                            {
-                                "bool": {
-                                    "filter": {
-                                        "bool": {
-                                            "must": [
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "object_type.keyword": "course"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "offered_by": "OCW"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "department_name": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Lecture Notes"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Problem Sets with Solutions"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Readings"
-                                                                }
-                                                            },
-                                                        ]
-                                                    }
-                                                },
-                                            ]
-                                        }
-                                    }
-                                }
-                            }
-                        ]
-                    }
-                },
+                "filter": agg_filter("topics"),
                 "aggs": {"topics": {"terms": {"field": "topics", "size": 10000}}},
             },
             "agg_filter_department_name": {
-                "filter": {
-                    "bool": {
-                        "should": [
-                            {
-                                "bool": {
-                                    "filter": {
-                                        "bool": {
-                                            "must": [
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "object_type.keyword": "course"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "offered_by": "OCW"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "topics": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Lecture Notes"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Problem Sets with Solutions"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Readings"
-                                                                }
-                                                            },
-                                                        ]
-                                                    }
-                                                },
-                                            ]
-                                        }
-                                    }
-                                }
-                            }
-                        ]
-                    }
-                },
+                "filter": agg_filter("department_name"),
                 "aggs": {
                     "department_name": {
                         "terms": {"field": "department_name", "size": 10000}
@@ -229,87 +112,7 @@ def create_request_payload():
                 },
             },
             "agg_filter_level": {
-                "filter": {
-                    "bool": {
-                        "should": [
-                            {
-                                "bool": {
-                                    "filter": {
-                                        "bool": {
-                                            "must": [
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "object_type.keyword": "course"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "offered_by": "OCW"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "topics": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "department_name": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Lecture Notes"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Problem Sets with Solutions"
-                                                                }
-                                                            },
-                                                            {
-                                                                "term": {
-                                                                    "course_feature_tags": "Readings"
-                                                                }
-                                                            },
-                                                        ]
-                                                    }
-                                                },
-                                            ]
-                                        }
-                                    }
-                                }
-                            }
-                        ]
-                    }
-                },
+                "filter": agg_filter(),
                 "aggs": {
                     "level": {
                         "nested": {"path": "runs"},
@@ -323,66 +126,7 @@ def create_request_payload():
                 },
             },
             "agg_filter_course_feature_tags": {
-                "filter": {
-                    "bool": {
-                        "should": [
-                            {
-                                "bool": {
-                                    "filter": {
-                                        "bool": {
-                                            "must": [
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "object_type.keyword": "course"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "offered_by": "OCW"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "topics": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                                {
-                                                    "bool": {
-                                                        "should": [
-                                                            {
-                                                                "term": {
-                                                                    "department_name": "Mechanical Engineering"
-                                                                }
-                                                            }
-                                                        ]
-                                                    }
-                                                },
-                                            ]
-                                        }
-                                    }
-                                }
-                            }
-                        ]
-                    }
-                },
+                "filter": agg_filter("course_feature_tags"),
                 "aggs": {
                     "course_feature_tags": {
                         "terms": {"field": "course_feature_tags", "size": 10000}
@@ -391,3 +135,34 @@ def create_request_payload():
             },
         },
     }
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """sha256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def http_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """
+    requests session with a connection pool of pool_size that retries rate limited
+    (429) and unavailable (502, 503, 504) responses, honouring Retry-After
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=None,
+        backoff_factor=backoff_factor,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
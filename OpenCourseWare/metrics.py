@@ -0,0 +1,296 @@
+"""
+Per stage metrics of the pipeline: latency histograms, counters and gauges,
+exported in the Prometheus text format, plus OpenTelemetry spans with course and
+resource attributes when opentelemetry is installed.
+
+Metric labels are kept to bounded values (stage, tier, table) so the exported
+series stay few. Which course or resource was slow is carried on the spans and
+in the slowest samples kept per stage, see Metrics.summary.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger("metrics")
+
+# seconds, from a cached search hit up to a large course zip
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = "ocw_stage_seconds"
+STAGE_FAILURES = "ocw_stage_failures_total"
+
+# name -> (type, help) of every metric the pipeline records
+DESCRIPTIONS = {
+    STAGE_SECONDS: ("histogram", "Latency of one unit of work of a stage"),
+    STAGE_FAILURES: ("counter", "Units of work of a stage that raised"),
+    "ocw_course_stage_seconds": ("histogram", "Time a course spent in a pipeline stage"),
+    "ocw_course_stage_failures_total": ("counter", "Courses dropped by a pipeline stage"),
+    "ocw_courses_total": ("counter", "Courses finished by the pipeline, by status"),
+    "ocw_queue_depth": ("gauge", "Courses waiting in front of a pipeline stage"),
+    "ocw_stage_in_progress": ("gauge", "Courses being handled by a pipeline stage"),
+    "ocw_search_hits_total": ("counter", "Courses returned by the search api"),
+    "ocw_download_bytes_total": ("counter", "Course zip bytes downloaded or fetched by range"),
+    "ocw_pdfs_extracted_total": ("counter", "Pdfs converted to markdown, by extraction tier"),
+    "ocw_pdf_pages_total": ("counter", "Pages of the pdfs converted to markdown"),
+    "ocw_extracted_chars_total": ("counter", "Markdown characters extracted from pdfs"),
+    "ocw_db_rows_total": ("counter", "Rows upserted, by table"),
+    "ocw_db_chars_total": ("counter", "Text characters upserted"),
+    "ocw_merge_input_bytes_total": ("counter", "Bytes of the pdfs merged into combined pdfs"),
+    "ocw_merge_output_bytes_total": ("counter", "Bytes of the combined pdfs written"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)   # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    """
+    Thread safe registry of counters, gauges and histograms.
+
+    Stages are timed with the stage context manager, or recorded after the fact
+    with record when the work ran in another process.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, slowest: int = 5):
+        """
+        Args:
+            buckets (tuple): Upper bounds in seconds of the latency histograms
+            slowest (int): Slowest samples kept per stage, with their course and resource
+        """
+        self.buckets = buckets
+        self.keep_slowest = slowest
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.gauges: Dict[Tuple[str, tuple], float] = {}
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.slowest: Dict[Tuple[str, str], List[Tuple[float, str, str]]] = {}
+        self._lock = threading.Lock()
+        self.tracer = trace.get_tracer("opencourseware") if trace else None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add value to a counter"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge"""
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Add a sample to a histogram"""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(
+        self,
+        stage: str,
+        course: Optional[str] = None,
+        resource: Optional[str] = None,
+        name: str = STAGE_SECONDS,
+        **attributes,
+    ) -> Iterator[Optional[object]]:
+        """
+        Time a unit of work of a stage, inside a span when tracing is available
+
+        Args:
+            stage (str): Stage label, e.g. download or pdf_extract
+            course (str): Course slug, a span attribute and kept with the slowest samples
+            resource (str): Resource file name, same as course
+            name (str): Histogram to observe the seconds in, failures are counted in
+                the matching _failures_total counter
+            attributes: Further span attributes
+
+        Yields:
+            Span or None
+        """
+        span_attributes = _span_attributes(stage, course, resource, attributes)
+        span = None
+        if self.tracer:
+            span = self.tracer.start_as_current_span(f"ocw.{stage}", attributes=span_attributes)
+        start = time.perf_counter()
+        try:
+            if span is None:
+                yield None
+            else:
+                with span as current:
+                    yield current
+        except BaseException:
+            self.inc(_failures(name), stage=stage)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, stage=stage)
+            self._keep_slow(name, stage, seconds, course, resource)
+
+    def record(
+        self,
+        stage: str,
+        seconds: float,
+        started: Optional[float] = None,
+        course: Optional[str] = None,
+        resource: Optional[str] = None,
+        name: str = STAGE_SECONDS,
+        **attributes,
+    ):
+        """
+        Record a unit of work timed elsewhere, e.g. in a worker process
+
+        Args:
+            stage (str): Stage label
+            seconds (float): Duration
+            started (float): time.time() at the start, used to place the span
+            course (str): Course slug
+            resource (str): Resource file name
+            name (str): Histogram to observe the seconds in
+            attributes: Further span attributes
+        """
+        self.observe(name, seconds, stage=stage)
+        self._keep_slow(name, stage, seconds, course, resource)
+        if self.tracer and started is not None:
+            span = self.tracer.start_span(
+                f"ocw.{stage}",
+                start_time=int(started * 1e9),
+                attributes=_span_attributes(stage, course, resource, attributes),
+            )
+            span.end(end_time=int((started + seconds) * 1e9))
+
+    def _keep_slow(self, name: str, stage: str, seconds: float, course: Optional[str], resource: Optional[str]):
+        if not course and not resource:
+            return
+        with self._lock:
+            samples = self.slowest.setdefault((name, stage), [])
+            sample = (seconds, course or "", resource or "")
+            if len(samples) < self.keep_slowest:
+                heapq.heappush(samples, sample)
+            elif sample > samples[0]:
+                heapq.heapreplace(samples, sample)
+
+    def summary(self) -> dict:
+        """
+        Per histogram and stage: count, total, mean and max seconds and the slowest
+        samples, plus every counter and gauge. JSON serializable.
+        """
+        with self._lock:
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                stage = dict(labels).get("stage", "")
+                histograms.setdefault(name, {})[stage] = dict(
+                    count=histogram.count,
+                    seconds=round(histogram.sum, 4),
+                    mean=round(histogram.sum / histogram.count, 4) if histogram.count else 0,
+                    max=round(histogram.max, 4),
+                    slowest=[
+                        dict(seconds=round(seconds, 4), course=course, resource=resource)
+                        for seconds, course, resource in sorted(
+                            self.slowest.get((name, stage), []), reverse=True
+                        )
+                    ],
+                )
+            return dict(
+                histograms=histograms,
+                counters={_series(name, labels): value for (name, labels), value in sorted(self.counters.items())},
+                gauges={_series(name, labels): value for (name, labels), value in sorted(self.gauges.items())},
+            )
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            families: Dict[str, List[str]] = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                families.setdefault(name, []).append(f"{_series(name, labels)} {_number(value)}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                families.setdefault(name, []).append(f"{_series(name, labels)} {_number(value)}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                lines = families.setdefault(name, [])
+                cumulative = 0
+                bounds = [_number(bound) for bound in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{_series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{_series(name + '_sum', labels)} {_number(histogram.sum)}")
+                lines.append(f"{_series(name + '_count', labels)} {histogram.count}")
+
+        out = []
+        for name, lines in families.items():
+            kind, help_text = DESCRIPTIONS.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    def write(self, path: Path):
+        """Write render() to path atomically, e.g. for the node_exporter textfile collector"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.render())
+        os.replace(tmp, path)
+        logger.info("wrote metrics to %s", path)
+
+
+def _failures(name: str) -> str:
+    return name.removesuffix("_seconds") + "_failures_total"
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _series(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{name}{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _span_attributes(stage: str, course: Optional[str], resource: Optional[str], attributes: dict) -> dict:
+    values = {"ocw.stage": stage}
+    if course:
+        values["ocw.course"] = course
+    if resource:
+        values["ocw.resource"] = resource
+    for key, value in attributes.items():
+        if value is not None:
+            values[f"ocw.{key}"] = value if isinstance(value, (str, bool, int, float)) else str(value)
+    return values
+
+
+# shared by the pipeline, scraper and courses unless they are given their own
+registry = Metrics()
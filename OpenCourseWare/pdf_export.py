@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import fitz
+
+from extract_pdf import open_pdf
+from helpers import file_sha256
+from metrics import Metrics
+from profiling import CourseProfile
+
+logger = logging.getLogger("pdf_export")
+
+EXPORT_MANIFEST = "export_manifest.json"
+
+# save options of an optimized export: garbage=4 drops unused objects and merges
+# identical ones, so fonts and images repeated across the merged pdfs are stored once
+OPTIMIZED_SAVE = dict(
+    garbage=4,
+    deflate=True,
+    deflate_images=True,
+    deflate_fonts=True,
+    use_objstms=True,
+)
+
+
+def merge_pdfs(
+    input_paths: List[str],
+    output_path: str,
+    optimize: bool = False,
+    linearize: bool = False,
+    use_mmap: bool = False,
+    documents: Optional[List[Optional[bytes]]] = None,
+) -> dict:
+    """
+    Merge pdfs into one file, skipping inputs that are missing or unreadable
+
+    The merged pdf is written next to output_path first and moved into place,
+    so a failed merge never leaves a truncated output behind.
+
+    Args:
+        input_paths (list): Pdfs to merge, in page order
+        output_path (str): Combined pdf
+        optimize (bool): Deduplicate shared objects and compress streams, see OPTIMIZED_SAVE
+        linearize (bool): Also linearize for fast first page display when MuPDF supports it
+        use_mmap (bool): Open inputs from a memory map
+        documents (list): Optional bytes of each input, already read, merged from memory
+            instead of opening the file. None entries are opened from their path
+
+    Returns:
+        dict: merged (inputs merged, nothing is written when 0), input_bytes, output_bytes,
+            started (time.time() at the start) and seconds of the merge
+    """
+    merged = 0
+    input_bytes = 0
+    started = time.time()
+    start = time.perf_counter()
+    tmp_path = output_path + ".tmp"
+    with fitz.open() as combined_doc:
+        for input_path, data in zip(input_paths, documents or [None] * len(input_paths)):
+            if data is None and not os.path.exists(input_path):
+                logger.warning("pdf not found: %s", input_path)
+                continue
+            try:
+                with _open_input(input_path, data, use_mmap) as doc:
+                    combined_doc.insert_pdf(doc)
+                merged += 1
+                input_bytes += len(data) if data is not None else os.path.getsize(input_path)
+            except Exception as e:
+                logger.error("failed to add %s to %s: %s", input_path, output_path, e)
+
+        if not merged:
+            logger.warning("no pdfs to merge into %s", output_path)
+            return dict(merged=0, input_bytes=0, output_bytes=0, started=started, seconds=0.0)
+        _save(combined_doc, tmp_path, optimize, linearize)
+    os.replace(tmp_path, output_path)
+    return dict(
+        merged=merged,
+        input_bytes=input_bytes,
+        output_bytes=os.path.getsize(output_path),
+        started=started,
+        seconds=time.perf_counter() - start,
+    )
+
+
+@contextmanager
+def _open_input(input_path: str, data: Optional[bytes], use_mmap: bool) -> Iterator[fitz.Document]:
+    if data is None:
+        with open_pdf(input_path, use_mmap) as doc:
+            yield doc
+        return
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        yield doc
+
+
+def _save(doc: fitz.Document, path: str, optimize: bool, linearize: bool):
+    if not optimize:
+        doc.save(path)
+        return
+
+    if linearize:
+        try:
+            # object streams can not be combined with linearization
+            doc.save(path, **dict(OPTIMIZED_SAVE, use_objstms=False, linear=True))
+            return
+        except Exception as e:
+            # recent MuPDF releases dropped linearisation
+            logger.warning("saving %s without linearization: %s", path, e)
+    doc.save(path, **OPTIMIZED_SAVE)
+
+
+def export_pdfs(
+    jobs: Dict[str, List[Path]],
+    out_dir: Path,
+    hashes: Optional[Dict[Path, str]] = None,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    prune: bool = False,
+    optimize: bool = False,
+    linearize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    use_mmap: bool = False,
+    metrics: Optional[Metrics] = None,
+    course: Optional[str] = None,
+    profile: Optional[CourseProfile] = None,
+    documents: Optional[Dict[str, bytes]] = None,
+) -> List[Path]:
+    """
+    Write combined pdfs, skipping outputs whose inputs are unchanged since the last export
+
+    out_dir/export_manifest.json records the sha256 of every input of each output.
+    Outputs that are missing or whose inputs changed are merged in parallel.
+
+    Args:
+        jobs (dict): Output file name -> input pdf paths, in page order
+        out_dir (Path): Directory the outputs and manifest are written to
+        hashes (dict): Optional known sha256 of input paths, others are hashed here
+        max_workers (int): Pool size when no executor is given. 1 merges in-process
+        executor (Executor): Optional shared pool, takes precedence over max_workers
+        prune (bool): Remove outputs of the previous export that are not in jobs
+        optimize (bool): Size optimized save, see merge_pdfs
+        linearize (bool): Linearize optimized outputs when MuPDF supports it
+        stats (dict): Optional dict that input_bytes, output_bytes and bytes_saved of
+            the outputs written are added to
+        use_mmap (bool): Open inputs from a memory map
+        metrics (Metrics): Optional registry the pdf_merge timings and the merged bytes
+            are recorded in
+        course (str): Course slug the timings are recorded for
+        profile (CourseProfile): Optional profile the pool workers are sampled into
+        documents (dict): Optional bytes of input pdfs already read, by path, merged from
+            memory instead of opening those files again
+
+    Returns:
+        list: Paths of the outputs written or already up to date, in jobs order
+    """
+    out_dir = Path(out_dir)
+    hashes = hashes or {}
+    manifest_path = out_dir / EXPORT_MANIFEST
+    manifest = _load_manifest(manifest_path)
+
+    entries = {}
+    pending = {}
+    for name, inputs in jobs.items():
+        entries[name] = {
+            "inputs": [
+                [Path(path).name, hashes.get(Path(path)) or _hash(Path(path))]
+                for path in inputs
+            ],
+            "fitz": fitz.VersionBind,
+            "options": {"optimize": optimize, "linearize": optimize and linearize},
+        }
+        if manifest.get(name) == entries[name] and (out_dir / name).exists():
+            continue
+        pending[name] = [str(path) for path in inputs]
+
+    if prune:
+        for name in set(manifest) - set(jobs):
+            (out_dir / name).unlink(missing_ok=True)
+            logger.info("removed stale export %s", name)
+        manifest = {name: entry for name, entry in manifest.items() if name in jobs}
+
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        logger.info("%s of %s combined pdfs unchanged in %s", skipped, len(jobs), out_dir)
+
+    names = list(pending)
+    outputs = [str(out_dir / name) for name in names]
+    inputs = [pending[name] for name in names]
+    empty = set()
+    options = (
+        [optimize] * len(names),
+        [linearize] * len(names),
+        [use_mmap] * len(names),
+        [[documents.get(path) for path in paths] if documents else None for paths in inputs],
+    )
+    totals = dict(input_bytes=0, output_bytes=0)
+    try:
+        for name, result in zip(
+            names, _map(merge_pdfs, max_workers, executor, inputs, outputs, *options, profile=profile)
+        ):
+            if metrics is not None:
+                _record(metrics, course, str(out_dir / name), result)
+            if not result["merged"]:
+                empty.add(name)
+                manifest.pop(name, None)
+                continue
+            manifest[name] = entries[name]
+            totals["input_bytes"] += result["input_bytes"]
+            totals["output_bytes"] += result["output_bytes"]
+            logger.info(
+                "saved %s (%s pdfs, %s of %s input bytes)",
+                out_dir / name,
+                result["merged"],
+                result["output_bytes"],
+                result["input_bytes"],
+            )
+    finally:
+        _save_manifest(manifest_path, manifest)
+
+    totals["bytes_saved"] = totals["input_bytes"] - totals["output_bytes"]
+    if names:
+        logger.info("combined pdfs in %s saved %s bytes", out_dir, totals["bytes_saved"])
+    if stats is not None:
+        for key, value in totals.items():
+            stats[key] = stats.get(key, 0) + value
+
+    return [out_dir / name for name in jobs if name not in empty]
+
+
+def _record(metrics: Metrics, course: Optional[str], output_path: str, result: dict):
+    if not result["merged"]:
+        return
+    metrics.record(
+        "pdf_merge", result["seconds"], result["started"], course=course,
+        resource=Path(output_path).name, inputs=result["merged"],
+    )
+    metrics.inc("ocw_merge_input_bytes_total", result["input_bytes"])
+    metrics.inc("ocw_merge_output_bytes_total", result["output_bytes"])
+
+
+def _map(
+    func,
+    max_workers: Optional[int],
+    executor: Optional[Executor],
+    *iterables,
+    profile: Optional[CourseProfile] = None,
+):
+    if not iterables[0]:
+        return []
+    workers = min(max_workers or os.cpu_count() or 1, len(iterables[0]))
+    if executor is None and workers <= 1:
+        # in-process work is sampled with the calling thread
+        return map(func, *iterables)
+
+    remote = profile.wrap(func) if profile else func
+    if executor is not None:
+        results = executor.map(remote, *iterables)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(remote, *iterables))
+    return map(profile.unwrap, results) if profile else results
+
+
+def _hash(path: Path) -> Optional[str]:
+    return file_sha256(path) if path.exists() else None
+
+
+def _load_manifest(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except ValueError:
+        logger.warning("ignoring unreadable export manifest %s", path)
+        return {}
+
+
+def _save_manifest(path: Path, manifest: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp, path)
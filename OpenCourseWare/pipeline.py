@@ -1,25 +1,118 @@
 import asyncio
-from typing import Dict, Any
+import multiprocessing
+import shutil
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import logging
 from course_context import CourseContext
 from scraper import Scraper
+from download_cache import DownloadCache
+from extract_cache import ExtractionCache
+from metrics import Metrics, registry
+from profiling import DEFAULT_INTERVAL, start_tracing, stop_tracing
+from stages import StagePipeline
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("pipeline")
 
 
 class OpenCourseWarePipeline:
-    def __init__(self):
-        self.scraper = Scraper()
+    def __init__(
+        self,
+        department: Optional[str] = "Mechanical Engineering",
+        size: Optional[int] = 100,
+        max_concurrent_courses: int = 1,
+        max_workers: Optional[int] = None,
+        download_cache: Optional[DownloadCache] = None,
+        selective_extract: bool = False,
+        extraction_cache: Optional[ExtractionCache] = None,
+        stage_workers: Optional[Dict[str, int]] = None,
+        queue_size: int = 2,
+        export_pdf: bool = False,
+        remote_zip: bool = False,
+        page_chunks: bool = False,
+        tiered_extract: bool = False,
+        optimize_pdf: bool = False,
+        mmap_pdfs: bool = False,
+        scraper: Optional[Scraper] = None,
+        requests_per_second: float = 5.0,
+        max_per_host: int = 4,
+        corpus_dir: Optional[Path] = None,
+        out_dir: Optional[Path] = None,
+        metrics: Optional[Metrics] = None,
+        metrics_path: Optional[Path] = None,
+        profile: bool = False,
+        profile_interval: float = DEFAULT_INTERVAL,
+        profile_allocations: bool = False,
+    ):
+        """
+        Args:
+            department (str): Department to crawl, None for all of OCW
+            size (int): Maximum number of courses, None for every match
+            max_concurrent_courses (int): Default worker count of every stage
+            max_workers (int): Size of the process pool shared by all courses for pdf extraction
+            download_cache (DownloadCache): Optional cache reused for course zips across runs
+            selective_extract (bool): Only unzip resource data.json files and the pdfs we read
+            extraction_cache (ExtractionCache): Optional cache of pdf markdown shared across courses and runs
+            stage_workers (dict): Worker count per stage name (download, unpack, extract, persist)
+            queue_size (int): Courses waiting in front of each stage
+            export_pdf (bool): Also write the combined pdfs for every course, in the extract stage
+            remote_zip (bool): Read course zips over HTTP Range instead of downloading them
+            page_chunks (bool): Save resources page by page in resource_page, extracted in the persist stage
+            tiered_extract (bool): Read simple pdf pages with fitz and only lay out the rest with pymupdf4llm
+            optimize_pdf (bool): Deduplicate and compress the combined pdfs of export_pdf
+            mmap_pdfs (bool): Open pdfs from a memory map when merging them
+            scraper (Scraper): Scraper to discover courses with, e.g. pointed at another host
+            requests_per_second (float): Download link lookups per second per host
+            max_per_host (int): Download link lookups in flight per host
+            corpus_dir (Path): Parent of the per course corpus folders, defaults to ./corpus
+            out_dir (Path): Where combined pdfs are written, defaults to ./out
+            metrics (Metrics): Registry of the per stage timings and counters, defaults to
+                the shared metrics.registry
+            metrics_path (Path): Write the metrics here in the Prometheus text format when
+                the run ends, e.g. a node_exporter textfile collector .prom file
+            profile (bool): Write a sampled cpu profile and a memory report of every course
+                to out/<slug>/profile
+            profile_interval (float): Seconds between samples
+            profile_allocations (bool): Also trace allocations with tracemalloc while
+                profiling, costs about a third more time in extraction
+        """
+        self.metrics = metrics or registry
+        self.metrics_path = Path(metrics_path) if metrics_path else None
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self.profile_allocations = profile_allocations
+        self.scraper = scraper or Scraper(metrics=self.metrics)
+        self.requests_per_second = requests_per_second
+        self.max_per_host = max_per_host
         self.processed_courses = []
         self.failed_courses = []
+        self.department = department
+        self.size = size
+        self.max_concurrent_courses = max(1, max_concurrent_courses)
+        self.max_workers = max_workers
+        self.download_cache = download_cache
+        self.selective_extract = selective_extract
+        self.extraction_cache = extraction_cache
+        self.stage_workers = stage_workers or {}
+        self.queue_size = queue_size
+        self.export_pdf = export_pdf
+        self.remote_zip = remote_zip
+        self.page_chunks = page_chunks
+        self.tiered_extract = tiered_extract
+        self.optimize_pdf = optimize_pdf
+        self.mmap_pdfs = mmap_pdfs
+        self.corpus_dir = Path(corpus_dir) if corpus_dir else Path.cwd().joinpath("corpus")
+        self.out_dir = Path(out_dir) if out_dir else Path.cwd().joinpath("out")
         self.pipeline_stats = {
             "start_time": None,
             "end_time": None,
             "total_courses": 0,
             "successful": 0,
             "failed": 0,
+            "export": {},
         }
 
     def run(self) -> Dict[str, Any]:
@@ -29,32 +122,137 @@ class OpenCourseWarePipeline:
     async def _async_run_pipeline(self) -> Dict[str, Any]:
         """Async implementation of the pipeline"""
         self.pipeline_stats["start_time"] = datetime.now().isoformat()
+        # traced for the whole run, so courses in flight do not start and stop it
+        trace_allocations = self.profile and self.profile_allocations
+        if trace_allocations:
+            start_tracing()
 
         try:
-            self.scraper.scrape()
+            # stages run in threads, forkserver keeps the pool from forking a threaded process
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            ) as executor:
+                stages = StagePipeline(
+                    self._stages(),
+                    queue_size=self.queue_size,
+                    on_error=self._course_failed,
+                    on_done=self._course_done,
+                    metrics=self.metrics,
+                    describe=lambda course: course.slug,
+                )
+                try:
+                    await stages.run(self._discover(executor))
+                finally:
+                    self.pipeline_stats["stages"] = stages.stats
+
             if not self.scraper.urls:
                 raise Exception("No scraper URLs found")
 
-            self.pipeline_stats["total_courses"] = len(self.scraper.urls)
-            for payload in self.scraper.urls:
-                try:
-                    url, download_url = payload
-                    course = CourseContext(
-                        url=url, download_url=download_url
-                    )
-                    course.extracl_all_to_db()
-
-                    self.pipeline_stats["successful"] += 1
-                except Exception as e:
-                    self.failed_courses.append(payload[0])
-                    self.pipeline_stats["failed"] += 1
-                    logger.error(e)
-                    continue
-
         except Exception as e:
             raise
 
         finally:
+            if trace_allocations:
+                stop_tracing()
             self.pipeline_stats["end_time"] = datetime.now().isoformat()
+            if self.extraction_cache:
+                self.pipeline_stats["extraction_cache"] = self.extraction_cache.stats()
+                self.extraction_cache.close()
+            self.pipeline_stats["metrics"] = self.metrics.summary()
+            self._log_slowest()
+            if self.metrics_path:
+                self.metrics.write(self.metrics_path)
 
         return self.pipeline_stats
+
+    def _stages(self) -> List[Tuple[str, Callable, int]]:
+        """(name, handler, workers) for every stage after discovery"""
+        # with export_pdf the extract stage also merges, on the same pool as the extraction
+        stages = [
+            ("download", CourseContext.download),
+            ("unpack", CourseContext.unpack),
+            (
+                "extract",
+                CourseContext.extract_with_pdfs if self.export_pdf else CourseContext.extract,
+            ),
+            ("persist", CourseContext.extract_resources),
+        ]
+
+        return [
+            (name, handler, self.stage_workers.get(name, self.max_concurrent_courses))
+            for name, handler in stages
+        ]
+
+    async def _discover(self, executor: Executor):
+        """Discover stage: yields courses as soon as their download link resolves"""
+        async for url, download_url in self.scraper.stream_download_links(
+            department=self.department,
+            size=self.size,
+            requests_per_second=self.requests_per_second,
+            max_per_host=self.max_per_host,
+        ):
+            self.pipeline_stats["total_courses"] += 1
+            yield self._course_context(url, download_url, executor)
+
+    def _course_context(self, url: str, download_url: str, executor: Executor) -> CourseContext:
+        """Course with its own corpus directory"""
+        slug = url.rstrip("/").split("/")[-1]
+        return CourseContext(
+            url=url,
+            download_url=download_url,
+            max_workers=self.max_workers,
+            executor=executor,
+            corpus_path=self.corpus_dir.joinpath(slug),
+            out_dir=self.out_dir,
+            download_cache=self.download_cache,
+            selective_extract=self.selective_extract,
+            extraction_cache=self.extraction_cache,
+            remote_zip=self.remote_zip,
+            page_chunks=self.page_chunks,
+            tiered_extract=self.tiered_extract,
+            optimize_pdf=self.optimize_pdf,
+            mmap_pdfs=self.mmap_pdfs,
+            metrics=self.metrics,
+            profile=self.profile,
+            profile_interval=self.profile_interval,
+            profile_allocations=self.profile_allocations,
+        )
+
+    def _course_done(self, course: CourseContext):
+        self.processed_courses.append(course.url)
+        self.pipeline_stats["successful"] += 1
+        self.metrics.inc("ocw_courses_total", status="ok")
+        for key, value in course.export_stats.items():
+            export = self.pipeline_stats["export"]
+            export[key] = export.get(key, 0) + value
+        self._cleanup(course)
+
+    def _course_failed(self, course: CourseContext, stage: str, error: Exception):
+        self.failed_courses.append(course.url)
+        self.pipeline_stats["failed"] += 1
+        self.metrics.inc("ocw_courses_total", status="failed")
+        logger.error("%s failed in %s: %s", course.url, stage, error)
+        self._cleanup(course)
+
+    def _log_slowest(self):
+        """Log where the time went: total seconds per stage and the slowest course of each"""
+        for name, stages in self.pipeline_stats["metrics"]["histograms"].items():
+            for stage, summary in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+                slowest = ""
+                if summary["slowest"]:
+                    sample = summary["slowest"][0]
+                    slowest = " ".join(filter(None, (sample["course"], sample["resource"])))
+                logger.info(
+                    "%s %s: %s in %.2fs, max %.2fs %s",
+                    name,
+                    stage,
+                    summary["count"],
+                    summary["seconds"],
+                    summary["max"],
+                    slowest,
+                )
+
+    def _cleanup(self, course: CourseContext):
+        course.session.close()
+        shutil.rmtree(course.corpus_path, ignore_errors=True)
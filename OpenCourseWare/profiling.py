@@ -0,0 +1,343 @@
+"""
+Low overhead per course profiling: a sampling CPU profiler that writes collapsed
+stacks (flamegraph.pl, speedscope, inferno) and a memory report with the peak
+resident memory of every stage and, optionally, tracemalloc's peak and largest
+allocations.
+
+A daemon thread samples the stacks of the threads a course is being worked on,
+and the process's resident memory, every interval seconds. Work sent to a
+process pool is sampled in the worker through wrap / unwrap and merged into the
+course profile. tracemalloc hooks every allocation and slows allocation heavy
+extraction down by about a third, so it is off unless allocations are asked for.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial, wraps
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Tuple
+
+logger = logging.getLogger("profiling")
+
+DEFAULT_INTERVAL = 0.02
+MAX_DEPTH = 96
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+class Track:
+    """Samples of one tracked thread"""
+
+    def __init__(self, stacks: Counter):
+        self.stacks = stacks
+        self.rss_peak = _rss()
+
+
+class Sampler:
+    """Samples the stacks of tracked threads and the process's resident memory from a daemon thread"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.tracked: Dict[int, Track] = {}   # thread id -> its samples
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def track(self, stacks: Counter) -> Iterator[Track]:
+        """Sample the current thread into stacks until the block exits, nested calls share the outer Track"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            outer = self.tracked.get(thread_id)
+            if outer is None:
+                track = self.tracked[thread_id] = Track(stacks)
+                self._start()
+                self._wake.set()
+        if outer is not None:
+            yield outer
+            return
+        try:
+            yield track
+        finally:
+            with self._lock:
+                del self.tracked[thread_id]
+            track.rss_peak = max(track.rss_peak, _rss())
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                tracked = dict(self.tracked)
+                if not tracked:
+                    self._wake.clear()
+                    continue
+            rss = _rss()
+            frames = sys._current_frames()
+            for thread_id, track in tracked.items():
+                track.rss_peak = max(track.rss_peak, rss)
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    track.stacks[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+_samplers: Dict[Tuple[int, float], Sampler] = {}
+_tracing = {"users": 0, "started": False}
+_tracing_lock = threading.Lock()
+
+
+def sampler(interval: float = DEFAULT_INTERVAL) -> Sampler:
+    """Sampler shared by every course of this process"""
+    key = (os.getpid(), interval)
+    if key not in _samplers:
+        # setdefault keeps the first of two racing threads' samplers, neither is started yet
+        _samplers.setdefault(key, Sampler(interval))
+    return _samplers[key]
+
+
+def start_tracing():
+    """Start tracemalloc unless it is running already, pair every call with stop_tracing"""
+    with _tracing_lock:
+        if not _tracing["users"] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing["started"] = True
+        _tracing["users"] += 1
+
+
+def stop_tracing():
+    """Stop tracemalloc once its last user is done, if start_tracing started it"""
+    with _tracing_lock:
+        _tracing["users"] -= 1
+        if not _tracing["users"] and _tracing["started"]:
+            tracemalloc.stop()
+            _tracing["started"] = False
+
+
+def sample_call(func: Callable, interval: float, allocations: bool, *args):
+    """
+    Run func(*args) while sampling it, for process pool workers
+
+    Returns:
+        tuple: (result, collapsed stack counts, peak resident bytes, traced peak bytes or 0)
+    """
+    stacks = Counter()
+    if allocations:
+        start_tracing()
+        tracemalloc.reset_peak()
+    try:
+        with sampler(interval).track(stacks) as track:
+            result = func(*args)
+        traced_peak = tracemalloc.get_traced_memory()[1] if allocations else 0
+    finally:
+        if allocations:
+            stop_tracing()
+    return result, dict(stacks), track.rss_peak, traced_peak
+
+
+class CourseProfile:
+    """
+    CPU samples and memory use of one course, across stages and pool workers
+
+    Reports are written to path as cpu.collapsed (one "frame;frame;frame count"
+    line per stack, root first) and memory.txt. Stacks are sampled on the wall
+    clock, so time a stage spends waiting on the pool or the network shows up too.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = DEFAULT_INTERVAL,
+        allocations: bool = False,
+        top: int = 25,
+    ):
+        """
+        Args:
+            path (Path): Directory the reports are written to
+            interval (float): Seconds between samples
+            allocations (bool): Also trace allocations with tracemalloc, for the traced
+                peak and the largest allocation sites
+            top (int): Allocation sites listed in memory.txt
+        """
+        self.path = Path(path)
+        self.interval = interval
+        self.allocations = allocations
+        self.top = top
+        self.stacks = Counter()
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_rss: Dict[str, int] = {}   # stage -> peak resident bytes of the process
+        self.stage_traced: Dict[str, int] = {}   # stage -> largest traced memory growth
+        self.worker_rss = 0
+        self.worker_traced = 0
+        self.top_allocations = None   # (stage, tracemalloc statistics)
+        self._depth = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def section(self, stage: str) -> Iterator[None]:
+        """
+        Profile a stage run in the current thread, writing the reports when the
+        outermost section ends.
+
+        Resident memory and tracemalloc peaks are process wide, with courses in
+        flight concurrently the peak of a stage includes their memory too.
+        """
+        depth = getattr(self._depth, "value", 0)
+        self._depth.value = depth + 1
+        if depth:
+            try:
+                yield
+            finally:
+                self._depth.value = depth
+            return
+
+        if self.allocations:
+            start_tracing()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            with sampler(self.interval).track(self.stacks) as track:
+                yield
+        finally:
+            self._depth.value = depth
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+                self.stage_rss[stage] = max(self.stage_rss.get(stage, 0), track.rss_peak)
+            if self.allocations:
+                self._record_allocations(stage, baseline)
+                stop_tracing()
+            self.write()
+
+    def _record_allocations(self, stage: str, baseline: int):
+        growth = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        with self._lock:
+            largest = max(self.stage_traced.values(), default=-1)
+            self.stage_traced[stage] = max(self.stage_traced.get(stage, 0), growth)
+        if growth < largest:
+            return
+        # what is still alive at the end of the most memory hungry stage so far
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        with self._lock:
+            self.top_allocations = (stage, snapshot.statistics("lineno")[:self.top])
+
+    def wrap(self, func: Callable) -> Callable:
+        """Picklable func for a process pool that samples itself, pass its results to unwrap"""
+        return partial(sample_call, func, self.interval, self.allocations)
+
+    def unwrap(self, result: tuple):
+        """Merge the samples of a wrapped call, returns the call's own result"""
+        value, stacks, rss_peak, traced_peak = result
+        with self._lock:
+            self.stacks.update(stacks)
+            self.worker_rss = max(self.worker_rss, rss_peak)
+            self.worker_traced = max(self.worker_traced, traced_peak)
+        return value
+
+    def write(self):
+        """Write cpu.collapsed and memory.txt"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+            stage_seconds = dict(self.stage_seconds)
+            stage_rss = dict(self.stage_rss)
+            stage_traced = dict(self.stage_traced)
+            worker_rss = self.worker_rss
+            worker_traced = self.worker_traced
+            top_allocations = self.top_allocations
+
+        _write(self.path / "cpu.collapsed", "".join(f"{stack} {count}\n" for stack, count in stacks))
+
+        lines = [f"samples: {sum(count for _, count in stacks)} every {self.interval}s"]
+        lines.append("stage seconds:")
+        lines.extend(f"  {stage:12} {seconds:10.3f}s" for stage, seconds in stage_seconds.items())
+        lines.append("peak resident memory by stage (main process):")
+        lines.extend(f"  {stage:12} {_mib(peak)}" for stage, peak in stage_rss.items())
+        lines.append(f"peak resident memory of a pool worker: {_mib(worker_rss)}")
+        if self.allocations:
+            lines.append("peak traced memory growth by stage (main process):")
+            lines.extend(f"  {stage:12} {_mib(peak)}" for stage, peak in stage_traced.items())
+            lines.append(f"peak traced memory of a pool worker call: {_mib(worker_traced)}")
+        if top_allocations:
+            stage, statistics = top_allocations
+            lines.append(f"largest live allocations at the end of {stage}:")
+            for stat in statistics:
+                frame = stat.traceback[0]
+                lines.append(f"  {_mib(stat.size)} in {stat.count:6} blocks  {frame.filename}:{frame.lineno}")
+        _write(self.path / "memory.txt", "\n".join(lines) + "\n")
+        logger.debug("wrote profile to %s", self.path)
+
+
+def profiled(stage: str):
+    """Run a method inside a section of self.profile, a CourseProfile or None"""
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profile is None:
+                return method(self, *args, **kwargs)
+            with self.profile.section(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+_frame_names: Dict[object, str] = {}   # code object -> module:qualname, "" for this module
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        name = _frame_names.get(code)
+        if name is None:
+            name = _frame_names[code] = _frame_name(code)
+        if name:
+            names.append(name)
+        frame = frame.f_back
+    # collapsed stacks are root first, ; separates frames
+    return ";".join(reversed(names))
+
+
+def _frame_name(code) -> str:
+    if code.co_filename == __file__:
+        return ""
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_qualname}".replace(" ", "_").replace(";", "_")
+
+
+def _rss() -> int:
+    """Resident bytes of this process, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _mib(size: int) -> str:
+    return f"{size / 1024 ** 2:9.2f} MiB"
+
+
+def _write(path: Path, text: str):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """Async token bucket refilled at rate tokens per second, up to capacity"""
+
+    def __init__(self, rate: Optional[float], capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._thread_lock = threading.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it, no-op when rate is unset"""
+        if not self.rate or self.rate <= 0:
+            return
+
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now, safe to call from threads"""
+        if not self.rate or self.rate <= 0:
+            return True
+
+        with self._thread_lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class RateLimiter:
+    """
+    Per host request limiting: a token bucket of requests_per_second and a cap on
+    requests in flight to the same host.
+    """
+
+    def __init__(self, requests_per_second: Optional[float] = 5.0, max_per_host: int = 4):
+        self.requests_per_second = requests_per_second
+        self.max_per_host = max(1, max_per_host)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @asynccontextmanager
+    async def limit(self, url: str):
+        """Hold a concurrency slot and a rate token for url's host while the request runs"""
+        host = urlparse(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+            self._buckets[host] = TokenBucket(self.requests_per_second)
+
+        async with self._semaphores[host]:
+            await self._buckets[host].acquire()
+            yield
@@ -0,0 +1,135 @@
+import io
+import logging
+import os
+import zipfile
+from typing import Optional, Tuple
+
+import requests
+
+# fixed part of a zip local file header, followed by the file name and extra field
+LOCAL_HEADER_SIZE = 30
+# the local extra field is not always the one in the central directory (zip64
+# sizes, timestamps, unicode paths), bytes of headroom for the difference
+LOCAL_EXTRA_SLACK = 1024
+
+
+def member_span(member: zipfile.ZipInfo) -> Tuple[int, int]:
+    """
+    [start, end) of a member's local header and compressed data in the archive, to
+    prefetch before extracting it. The end is an estimate, as the local extra field
+    length is only known once the header is read
+    """
+    start = member.header_offset
+    header = LOCAL_HEADER_SIZE + len(member.filename.encode("utf-8")) + len(member.extra)
+    return start, start + header + LOCAL_EXTRA_SLACK + member.compress_size
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over a remote url backed by HTTP Range requests.
+
+    Handing it to zipfile.ZipFile reads the central directory from the end of the
+    archive and then only the members that are extracted, instead of downloading
+    the whole zip. Reads are served from a single readahead buffer so small
+    sequential reads (zip headers, neighbouring data.json members) share a request.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        block_size: int = 256 * 1024,
+        max_prefetch: int = 64 * 1024 * 1024,
+        timeout: int = 30,
+        headers: Optional[dict] = None,
+    ):
+        self.url = url
+        self.block_size = block_size
+        self.max_prefetch = max_prefetch
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.bytes_fetched = 0
+        self.requests_made = 0
+        self._position = 0
+        self._buffer_start = 0
+        self._buffer = b""
+        self._session = requests.Session()
+        self.logger = logging.getLogger("remote_zip")
+
+        response = self._session.head(
+            url, headers=self.headers, allow_redirects=True, timeout=timeout
+        )
+        response.raise_for_status()
+        if response.headers.get("Accept-Ranges", "").lower() != "bytes":
+            raise Exception(f"Server does not support range requests: {url}")
+        self.size = int(response.headers["Content-Length"])
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            self._position = offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        elif whence == os.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        self._position = max(0, self._position)
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._position
+        size = min(size, self.size - self._position)
+        if size <= 0:
+            return b""
+
+        end = self._position + size
+        buffer_end = self._buffer_start + len(self._buffer)
+        if not (self._buffer_start <= self._position and end <= buffer_end):
+            self._fill(self._position, max(end, self._position + self.block_size))
+
+        offset = self._position - self._buffer_start
+        data = self._buffer[offset:offset + size]
+        self._position += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def prefetch(self, start: int, end: int):
+        """Fetch [start, end) in one request ahead of reading it, e.g. a whole zip member"""
+        end = min(end, self.size, start + self.max_prefetch)
+        buffer_end = self._buffer_start + len(self._buffer)
+        if self._buffer_start <= start and end <= buffer_end:
+            return
+        self._fill(start, end)
+
+    def _fill(self, start: int, end: int):
+        end = min(end, self.size)
+        response = self._session.get(
+            self.url,
+            headers={**self.headers, "Range": f"bytes={start}-{end - 1}"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise Exception(f"Range request ignored for {self.url}")
+
+        self._buffer_start = start
+        self._buffer = response.content
+        self.bytes_fetched += len(self._buffer)
+        self.requests_made += 1
+
+    def close(self):
+        self._session.close()
+        super().close()
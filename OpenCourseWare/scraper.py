@@ -1,47 +1,135 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import json
 from bs4 import BeautifulSoup
 import re
 import time
-from helpers import request_headers, create_request_payload, download_headers
+from helpers import (
+    DEFAULT_FEATURE_TAGS,
+    request_headers,
+    create_request_payload,
+    download_headers,
+    http_session,
+)
+from rate_limiter import RateLimiter
+from metrics import registry
 import logging
 
+
+class BlockingFetcher:
+    """
+    Runs the blocking requests calls of the download link lookups on a thread pool
+    of its own, sized to the rate limiter's per host cap so every request the
+    limiter lets through gets a thread instead of queueing for asyncio's default
+    pool. requests sessions are not thread safe, every thread gets its own.
+    """
+
+    def __init__(self, pool_size, session_factory):
+        """
+        Args:
+            pool_size (int): Threads, at least the requests in flight the limiter allows
+            session_factory (callable): Builds the requests session of a thread
+        """
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="scraper")
+        self._session_factory = session_factory
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        """func(*args, **kwargs) on the pool, in a copy of the context like asyncio.to_thread"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def request(self, func, *args, **kwargs):
+        """func(session, *args, **kwargs) on the pool, with the session of the thread it runs on"""
+        return await self.run(self._with_session, func, *args, **kwargs)
+
+    def _with_session(self, func, *args, **kwargs):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._session_factory()
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return func(session, *args, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for session in self._sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class Scraper:
-    def __init__(self):
-        self.host = "https://ocw.mit.edu/"
-        self.api_url = "https://open.mit.edu/api/v0/search/"
+    def __init__(
+        self,
+        host="https://ocw.mit.edu/",
+        api_url="https://open.mit.edu/api/v0/search/",
+        retries=3,
+        metrics=None,
+    ):
+        """
+        Args:
+            host (str): OCW site the course pages and zips are served from
+            api_url (str): Course search api
+            retries (int): Retries of rate limited (429) and unavailable responses
+            metrics (Metrics): Registry the search and page fetch timings are recorded in
+        """
+        self.host = host if host.endswith("/") else host + "/"
+        self.api_url = api_url
+        self.retries = retries
+        self.metrics = metrics or registry
         self.urls = [] # (course_url, download_url)[]
         self.headers = request_headers
         self.download_headers = download_headers
         self.download_pages_scraped = 0
+        self.download_links_derived = 0
+        self.derived_download_urls = {} # course_url -> candidate zip urls from the search hit
         self.logger = logging.getLogger("scraper")
 
     def scrape(
         self,
         department="Mechanical Engineering",
         size=100,
-        delay=1,
+        requests_per_second=5.0,
+        max_per_host=4,
+        topics=None,
+        feature_tags=DEFAULT_FEATURE_TAGS,
     ):
         """
         Run the complete process: fetch courses and scrape download links
 
         Args:
-            department (str): Department name to filter by
-            size (int): Number of courses to fetch
-            delay (int): Delay between scraping requests in seconds
+            department (str): Department name to filter by, None for every department
+            size (int): Number of courses to fetch, None for every match
+            requests_per_second (float): Download page request rate per host
+            max_per_host (int): Download page requests in flight per host
+            topics (list): Topics to filter by, defaults to the department name
+            feature_tags (list): Course feature tags to filter by
 
         Returns:
             dict: Summary including timing information
         """
         start_time = time.time()
-        results = self._fetch_courses_with_problem_sets(
-            department=department, size=size
+        course_urls = list(
+            self.iter_course_urls(
+                department=department,
+                size=size,
+                topics=topics,
+                feature_tags=feature_tags,
+            )
         )
-
-        if not results:
-            raise Exception("Fetching courses failed.")
-
-        course_urls = self._extract_course_urls(results)
         if not course_urls:
             end_time = time.time()
             duration = end_time - start_time
@@ -55,36 +143,173 @@ class Scraper:
             }
 
         self._scrape_download_links(
-            course_urls=course_urls, delay=delay
+            course_urls=course_urls,
+            requests_per_second=requests_per_second,
+            max_per_host=max_per_host,
         )
 
         end_time = time.time()
         duration = end_time - start_time
         self.logger.info("scraping complete - took %s secs", duration)
 
+    async def stream_download_links(
+        self,
+        department="Mechanical Engineering",
+        size=100,
+        requests_per_second=5.0,
+        max_per_host=4,
+        topics=None,
+        feature_tags=DEFAULT_FEATURE_TAGS,
+        page_size=100,
+    ):
+        """
+        Yield (course_url, download_url) as download links resolve, while later
+        search pages are still being fetched. Courses whose link can not be
+        resolved are logged and skipped.
+
+        Args: same as scrape, plus
+            page_size (int): Number of courses per search request
+        """
+        limiter = RateLimiter(requests_per_second, max_per_host)
+        results = asyncio.Queue(maxsize=max_per_host * 2)
+        in_flight = asyncio.Semaphore(max_per_host * 2)
+        done = object()
+
+        async def resolve(fetcher, course_url):
+            try:
+                try:
+                    zip_download_url = await self._fetch_download_link(
+                        fetcher, limiter, course_url
+                    )
+                except Exception as e:
+                    self.logger.error(
+                        "failed to resolve download link for %s: %s", course_url, e
+                    )
+                    zip_download_url = None
+                await results.put((course_url, zip_download_url))
+            finally:
+                in_flight.release()
+
+        async def discover(fetcher):
+            tasks = []
+            course_urls = self.iter_course_urls(
+                department=department,
+                size=size,
+                topics=topics,
+                feature_tags=feature_tags,
+                page_size=page_size,
+            )
+            try:
+                while True:
+                    course_url = await asyncio.to_thread(next, course_urls, None)
+                    if course_url is None:
+                        break
+                    await in_flight.acquire()
+                    tasks.append(asyncio.create_task(resolve(fetcher, course_url)))
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(done)
+
+        with self._fetcher(limiter) as fetcher:
+            producer = asyncio.create_task(discover(fetcher))
+            try:
+                while (item := await results.get()) is not done:
+                    course_url, zip_download_url = item
+                    if zip_download_url:
+                        self.urls.append((course_url, zip_download_url))
+                        yield course_url, zip_download_url
+            finally:
+                producer.cancel()
+
+            # surfaces search failures from the producer
+            await asyncio.gather(producer, return_exceptions=False)
+
+    def iter_course_urls(
+        self,
+        department="Mechanical Engineering",
+        size=None,
+        topics=None,
+        feature_tags=DEFAULT_FEATURE_TAGS,
+        page_size=100,
+    ):
+        """
+        Page through the search api and yield course urls as each page arrives
+
+        Args:
+            department (str): Department name to filter by, None for every department
+            size (int): Maximum number of courses, None for every match
+            topics (list): Topics to filter by, defaults to the department name
+            feature_tags (list): Course feature tags to filter by
+            page_size (int): Number of courses per search request
+        """
+        offset = 0
+        while size is None or offset < size:
+            page = page_size if size is None else min(page_size, size - offset)
+            results = self._fetch_courses_with_problem_sets(
+                department=department,
+                size=page,
+                offset=offset,
+                topics=topics,
+                feature_tags=feature_tags,
+            )
+            if not results:
+                if offset == 0:
+                    raise Exception("Fetching courses failed.")
+                break
+
+            hits = results.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+
+            yield from self._extract_course_urls(results)
+
+            offset += len(hits)
+            total = results["hits"].get("total")
+            if isinstance(total, dict):
+                total = total.get("value")
+            if len(hits) < page or (total is not None and offset >= total):
+                break
+
     def _fetch_courses_with_problem_sets(
-        self, department="Mechanical Engineering", size=50
+        self,
+        department="Mechanical Engineering",
+        size=50,
+        offset=0,
+        topics=None,
+        feature_tags=DEFAULT_FEATURE_TAGS,
     ):
         """
-        Fetch courses with problem sets from MIT OCW and return URLs
+        Fetch a page of courses from MIT OCW search
 
         Args:
             department (str): Department name to filter by
             size (int): Number of courses to fetch
-            output_file (str): Optional output file path for JSON results
+            offset (int): Index of the first course
+            topics (list): Topics to filter by, defaults to the department name
+            feature_tags (list): Course feature tags to filter by
 
         Returns:
-            list: List of course URLs
+            dict: Search response, [] when the request failed
         """
-        payload = create_request_payload()
+        payload = create_request_payload(
+            department=department,
+            topics=topics,
+            feature_tags=feature_tags,
+            offset=offset,
+            size=size,
+        )
 
         try:
-            response = requests.post(
-                self.api_url, headers=self.headers, data=json.dumps(payload)
-            )
+            with self.metrics.stage("search", offset=offset), self._http_session(1) as session:
+                response = session.post(
+                    self.api_url, headers=self.headers, data=json.dumps(payload)
+                )
 
             if response.status_code == 200:
                 data = response.json()
+                self.metrics.inc(
+                    "ocw_search_hits_total", len(data.get("hits", {}).get("hits", []))
+                )
                 return data
             else:
                 raise Exception(f"Request failed: {response.status_code}")
@@ -107,46 +332,158 @@ class Scraper:
                     if slug:
                         full_url = f"{self.host}{slug}"
                         urls.append(full_url)
+                        self.derived_download_urls[full_url] = (
+                            self._derive_zip_download_links(source, run, full_url)
+                        )
         self.logger.info("found %s course urls to scrape", len(urls))
         return urls
 
-    def _scrape_download_links(self, course_urls=None, delay=1):
+    def _derive_zip_download_links(self, source, run, course_url):
+        """
+        Candidate zip urls built from search hit fields, OCW zips are named
+        <course number>-<term>-<year>.zip, e.g. 2.61-spring-2017.zip
+
+        Args:
+            source (dict): Search hit _source
+            run (dict): Course run from the hit
+            course_url (str): Course home url
+
+        Returns:
+            list: Candidate zip urls, most likely first
+        """
+        slug = run.get("slug", "").rstrip("/")
+        term = run.get("semester") or run.get("term")
+        year = run.get("year")
+        term_match = re.search(r"-(spring|summer|fall|winter|january-iap)-(\d{4})$", slug)
+        if term_match:
+            term = term or term_match.group(1)
+            year = year or term_match.group(2)
+        if not term or not year:
+            return []
+
+        course_numbers = []
+        for number in (
+            run.get("course_number"),
+            source.get("coursenum"),
+            source.get("course_number"),
+        ):
+            if isinstance(number, str) and number:
+                course_numbers.append(number)
+
+        # slug prefix, e.g. courses/2-61-internal-... or courses/22-314j-...
+        number_match = re.match(r"(?:courses/)?(\d+)-(\d+[a-z]*)-", slug)
+        if number_match:
+            course_numbers.append(f"{number_match.group(1)}.{number_match.group(2)}")
+
+        candidates = []
+        for number in course_numbers:
+            name = f"{number}-{str(term).lower().replace(' ', '-')}-{year}.zip"
+            candidate = f"{course_url.rstrip('/')}/{name}"
+            if candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def _scrape_download_links(
+        self, course_urls=None, requests_per_second=5.0, max_per_host=4
+    ):
         """
         Scrape download links from course pages
 
         Args:
             course_urls (list): List of course URLs to scrape. If None, uses self.course_urls
-            delay (int): Delay between requests in seconds
+            requests_per_second (float): Request rate per host
+            max_per_host (int): Requests in flight per host
         Returns:
             list of urls
         """
         if not course_urls:
             return []
 
-        download_zip_urls = []
-        for i, course_url in enumerate(course_urls, 1):
-            download_page = f"{course_url}/download"
-            response = requests.get(
-                download_page, headers=self.download_headers, timeout=10
+        return asyncio.run(
+            self._async_scrape_download_links(
+                course_urls, requests_per_second, max_per_host
             )
+        )
 
-            if response.status_code == 200:
-                self.download_pages_scraped += 1
-                soup = BeautifulSoup(response.content, "html.parser")
-                zip_download_url = self._extract_zip_download_link(soup, course_url)
+    async def _async_scrape_download_links(
+        self, course_urls, requests_per_second, max_per_host
+    ):
+        """
+        Fetch download pages concurrently behind a per host rate limiter, courses
+        whose link can not be resolved are logged and skipped
+        """
+        limiter = RateLimiter(requests_per_second, max_per_host)
+        with self._fetcher(limiter) as fetcher:
+            results = await asyncio.gather(
+                *(
+                    self._fetch_download_link(fetcher, limiter, course_url)
+                    for course_url in course_urls
+                ),
+                return_exceptions=True,
+            )
 
-                if zip_download_url:
-                    download_zip_urls.append(zip_download_url)
-                    self.urls.append((course_url, zip_download_url))
-            else:
-                raise Exception(
-                    f"Bad response when looking up download page: {download_page}"
+        download_zip_urls = []
+        for course_url, zip_download_url in zip(course_urls, results):
+            if isinstance(zip_download_url, Exception):
+                self.logger.error(
+                    "failed to resolve download link for %s: %s", course_url, zip_download_url
                 )
+                continue
+            if zip_download_url:
+                download_zip_urls.append(zip_download_url)
+                self.urls.append((course_url, zip_download_url))
+
+        self.logger.info(
+            "found %s download urls, %s derived from search hits",
+            len(download_zip_urls),
+            self.download_links_derived,
+        )
+        return download_zip_urls
+
+    async def _fetch_download_link(self, fetcher, limiter, course_url):
+        """Resolve a course zip link, from the search hit when it checks out, else the download page"""
+        slug = course_url.rstrip("/").split("/")[-1]
+        for candidate in self.derived_download_urls.pop(course_url, []):
+            async with limiter.limit(candidate):
+                with self.metrics.stage("zip_check", course=slug):
+                    exists = await fetcher.request(self._zip_exists, candidate)
+            if exists:
+                self.download_links_derived += 1
+                return candidate
+
+        download_page = f"{course_url}/download"
+        async with limiter.limit(download_page):
+            with self.metrics.stage("page_fetch", course=slug):
+                response = await fetcher.request(
+                    requests.Session.get, download_page, headers=self.download_headers, timeout=10
+                )
+
+        if response.status_code != 200:
+            raise Exception(
+                f"Bad response when looking up download page: {download_page}"
+            )
+
+        self.download_pages_scraped += 1
+        soup = await fetcher.run(BeautifulSoup, response.content, "html.parser")
+        return self._extract_zip_download_link(soup, course_url)
+
+    def _zip_exists(self, session, url):
+        """Cheap HEAD check that a derived zip url is served"""
+        try:
+            response = session.head(
+                url, headers=self.download_headers, allow_redirects=True, timeout=10
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code == 200
+
+    def _http_session(self, pool_size):
+        """requests session with a connection pool sized for concurrent requests, retrying 429s"""
+        return http_session(pool_size, retries=self.retries)
 
-            if delay > 0 and i < len(course_urls):
-                time.sleep(delay)
-        self.logger.info("found %s download urls", len(download_zip_urls))
-        return download_zip_urls 
+    def _fetcher(self, limiter):
+        """Thread pool of the download link lookups, one thread per request limiter lets through to a host"""
+        return BlockingFetcher(limiter.max_per_host, lambda: self._http_session(1))
 
     def _extract_zip_download_link(self, soup, base_url):
         """
@@ -169,7 +506,7 @@ class Scraper:
                     if href.startswith("http"):
                         return href
                     elif href.startswith("/"):
-                        return f"https://ocw.mit.edu{href}"
+                        return f"{self.host.rstrip('/')}{href}"
                     else:
                         return f"{base_url}/{href}"
 
@@ -185,7 +522,7 @@ class Scraper:
                     if href.startswith("http"):
                         return href
                     elif href.startswith("/"):
-                        return f"https://ocw.mit.edu{href}"
+                        return f"{self.host.rstrip('/')}{href}"
                     else:
                         return f"{base_url}/{href}"
 
@@ -195,7 +532,7 @@ class Scraper:
             if href.startswith("http"):
                 return href
             elif href.startswith("/"):
-                return f"https://ocw.mit.edu{href}"
+                return f"{self.host.rstrip('/')}{href}"
             else:
                 return f"{base_url}/{href}"
 
@@ -0,0 +1,348 @@
+"""
+Ranked full text search over the extracted text of lectures, readings and problem
+sets, including the pages saved by page chunked extraction.
+
+Runs on the indexes of database/fulltext.py: tsvector columns with GIN indexes
+ranked by ts_rank_cd on Postgres, FTS5 mirrors ranked by bm25 on SQLite. Queries
+use web search syntax on both: words are and-ed, "quoted phrases" match in
+order, or between words matches either and -word excludes a word.
+
+Scores of different indexes are not comparable (bm25 statistics are per FTS5
+table), so the rank of a hit is its score relative to the best hit from the
+same index and kind, between 0 and 1.
+
+    from database.session import Session
+    from search import search
+
+    for hit in search(Session(), "navier-stokes", level="Graduate", year=[2015, 2016]):
+        print(hit.rank, hit.course_number, hit.url, hit.page_number, hit.snippet)
+"""
+import logging
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from database.fulltext import SEARCH_COLUMNS, TS_CONFIG
+
+logger = logging.getLogger("search")
+
+KINDS = ("lecture", "reading", "problem_set")
+
+# resource_page types holding the pages of each kind
+PAGE_TYPES = {
+    "lecture": ("lecture",),
+    "reading": ("reading",),
+    "problem_set": ("problem", "solution"),
+}
+URL_COLUMNS = {"lecture": "remote_url", "reading": "remote_url", "problem_set": "remote_problem_url"}
+
+HIGHLIGHT = ("**", "**")
+SNIPPET_WORDS = 24
+# Postgres highlights a window of the document around the first query word,
+# ts_headline parses all the text it is given
+SNIPPET_WINDOW = 2000
+
+
+class SearchHit:
+    """A lecture, reading or problem set, or one page of it, matching a query"""
+
+    def __init__(
+        self,
+        kind: str,
+        resource_id: int,
+        url: str,
+        rank: float,
+        course_id: int,
+        course_title: str,
+        course_number: str,
+        course_url: str,
+        year: str,
+        page_number: Optional[int] = None,
+        page_id: Optional[int] = None,
+    ):
+        self.kind = kind
+        self.resource_id = resource_id
+        self.url = url
+        self.rank = rank
+        self.course_id = course_id
+        self.course_title = course_title
+        self.course_number = course_number
+        self.course_url = course_url
+        self.year = year
+        self.page_number = page_number
+        self.page_id = page_id
+        self.snippet = ""
+
+    def __repr__(self):
+        page = f", page_number={self.page_number}" if self.page_number else ""
+        return f"<SearchHit(kind='{self.kind}', resource_id={self.resource_id}{page}, rank={self.rank:.4f})>"
+
+
+def search(
+    db: Session,
+    query: str,
+    kinds: Optional[Iterable[str]] = None,
+    level: Optional[Union[str, Iterable[str]]] = None,
+    year: Optional[Union[str, int, Iterable[Union[str, int]]]] = None,
+    topics: Optional[Iterable[str]] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[SearchHit]:
+    """
+    Search the extracted course text, best match first
+
+    Args:
+        db (Session): Session of a database with the full text indexes
+        query (str): Web search style query
+        kinds (list): Any of lecture, reading and problem_set, all by default
+        level (str | list): Course level(s), e.g. Undergraduate or Graduate
+        year (str | int | list): Course year(s)
+        topics (list): Courses with any of these topics, at any depth, e.g. Fluid Mechanics
+        limit (int): Hits returned
+        offset (int): Hits skipped, for paging
+
+    Returns:
+        list: SearchHit with snippets, rank is relative to the best hit of the same kind
+            from the same index, 1 for the best
+    """
+    kinds = tuple(kinds or KINDS)
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise Exception(f"unknown search kinds: {', '.join(sorted(unknown))}")
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        backend = _Postgres(query)
+    elif dialect == "sqlite":
+        backend = _Sqlite(query)
+    else:
+        raise ValueError(f"full text search is not supported on {dialect}")
+    if not backend.match:
+        return []
+
+    start = time.perf_counter()
+    conditions, params = _course_filters(backend, level, year, topics)
+    where = " AND ".join(conditions) or "1 = 1"
+    branches = []
+    for kind in kinds:
+        branches.append(_normalized(backend.document_branch(kind), where))
+        branches.append(_normalized(backend.page_branch(kind), where))
+    statement = text(
+        f"{backend.prefix}"
+        "SELECT h.kind, h.resource_id, h.url, h.rank, c.id, c.title, c.course_number, c.url, c.year, "
+        "h.page_number, h.page_id "
+        f"FROM ({' UNION ALL '.join(branches)}) h JOIN course c ON c.id = h.course_id "
+        "ORDER BY h.rank DESC, h.kind, h.resource_id, h.page_number "
+        "LIMIT :limit OFFSET :offset"
+    )
+    for name in params:
+        statement = statement.bindparams(bindparam(name, expanding=True))
+    rows = db.execute(statement, dict(params, query=backend.match, limit=limit, offset=offset))
+    hits = [SearchHit(*row) for row in rows]
+
+    _add_snippets(db, backend, hits)
+    logger.debug(
+        "%s hits for %r in %.1fms", len(hits), query, (time.perf_counter() - start) * 1000
+    )
+    return hits
+
+
+class _Postgres:
+    """tsvector columns ranked by ts_rank_cd, snippets from ts_headline"""
+
+    prefix = f"WITH q AS (SELECT websearch_to_tsquery('{TS_CONFIG}', :query) AS query) "
+
+    def __init__(self, query: str):
+        self.match = query.strip()
+        words = _positive_words(query)
+        self.needle = words[0].lower() if words else ""
+
+    def document_branch(self, kind: str) -> str:
+        return (
+            f"SELECT '{kind}' AS kind, t.id AS resource_id, t.course_id, t.{URL_COLUMNS[kind]} AS url, "
+            "CAST(NULL AS INTEGER) AS page_number, CAST(NULL AS INTEGER) AS page_id, "
+            "ts_rank_cd(t.search_vector, q.query) AS rank "
+            f"FROM {kind} t CROSS JOIN q WHERE t.search_vector @@ q.query"
+        )
+
+    def page_branch(self, kind: str) -> str:
+        return (
+            f"SELECT '{kind}' AS kind, t.id AS resource_id, t.course_id, t.{URL_COLUMNS[kind]} AS url, "
+            "p.page_number, p.id AS page_id, "
+            "ts_rank_cd(p.search_vector, q.query) AS rank "
+            f"FROM resource_page p JOIN {kind} t ON t.id = p.resource_id CROSS JOIN q "
+            f"WHERE p.resource_type IN ({_quoted(PAGE_TYPES[kind])}) AND p.search_vector @@ q.query"
+        )
+
+    def snippets(self, db: Session, table: str, ids: List[int]) -> Dict[int, str]:
+        document = " || ' ' || ".join(SEARCH_COLUMNS[table])
+        start = f"greatest(1, strpos(lower({document}), :needle) - {SNIPPET_WINDOW // 4})"
+        statement = text(
+            f"SELECT id, ts_headline('{TS_CONFIG}', substr({document}, {start}, {SNIPPET_WINDOW}), "
+            f"websearch_to_tsquery('{TS_CONFIG}', :query), :options) "
+            f"FROM {table} WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        options = (
+            f"StartSel={HIGHLIGHT[0]}, StopSel={HIGHLIGHT[1]}, "
+            f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}"
+        )
+        rows = db.execute(statement, dict(query=self.match, needle=self.needle, options=options, ids=ids))
+        return dict(rows.all())
+
+    def json_has_any(self, column: str, param: str) -> str:
+        """Condition that a JSON column holds any of the strings of expanding param, at any depth"""
+        return (
+            f"EXISTS (SELECT 1 FROM jsonb_path_query(CAST({column} AS jsonb), 'strict $.**') AS j(value) "
+            f"WHERE jsonb_typeof(j.value) = 'string' AND j.value #>> '{{}}' IN :{param})"
+        )
+
+
+class _Sqlite:
+    """FTS5 mirrors ranked by bm25, snippets from snippet()"""
+
+    prefix = ""
+
+    def __init__(self, query: str):
+        self.match = _fts5_query(query)
+
+    def document_branch(self, kind: str) -> str:
+        fts = f"{kind}_fts"
+        return (
+            f"SELECT '{kind}' AS kind, t.id AS resource_id, t.course_id, t.{URL_COLUMNS[kind]} AS url, "
+            "CAST(NULL AS INTEGER) AS page_number, CAST(NULL AS INTEGER) AS page_id, "
+            f"-bm25({fts}) AS rank "
+            f"FROM {fts} JOIN {kind} t ON t.id = {fts}.rowid WHERE {fts} MATCH :query"
+        )
+
+    def page_branch(self, kind: str) -> str:
+        return (
+            f"SELECT '{kind}' AS kind, t.id AS resource_id, t.course_id, t.{URL_COLUMNS[kind]} AS url, "
+            "p.page_number, p.id AS page_id, "
+            "-bm25(resource_page_fts) AS rank "
+            "FROM resource_page_fts JOIN resource_page p ON p.id = resource_page_fts.rowid "
+            f"JOIN {kind} t ON t.id = p.resource_id "
+            f"WHERE resource_page_fts MATCH :query AND p.resource_type IN ({_quoted(PAGE_TYPES[kind])})"
+        )
+
+    def snippets(self, db: Session, table: str, ids: List[int]) -> Dict[int, str]:
+        fts = f"{table}_fts"
+        statement = text(
+            f"SELECT rowid, snippet({fts}, -1, '{HIGHLIGHT[0]}', '{HIGHLIGHT[1]}', '…', {SNIPPET_WORDS}) "
+            f"FROM {fts} WHERE {fts} MATCH :query AND rowid IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        return dict(db.execute(statement, dict(query=self.match, ids=ids)).all())
+
+    def json_has_any(self, column: str, param: str) -> str:
+        """Condition that a JSON column holds any of the strings of expanding param, at any depth"""
+        return f"EXISTS (SELECT 1 FROM json_tree({column}) j WHERE j.type = 'text' AND j.atom IN :{param})"
+
+
+def _add_snippets(db: Session, backend, hits: List[SearchHit]):
+    """Highlight the query in the text of each hit, one query per table"""
+    by_table: Dict[str, List[SearchHit]] = {}
+    for hit in hits:
+        table = "resource_page" if hit.page_id else hit.kind
+        by_table.setdefault(table, []).append(hit)
+    for table, table_hits in by_table.items():
+        snippets = backend.snippets(db, table, [_source_id(hit) for hit in table_hits])
+        for hit in table_hits:
+            hit.snippet = snippets.get(_source_id(hit)) or ""
+
+
+def _source_id(hit: SearchHit) -> int:
+    return hit.page_id or hit.resource_id
+
+
+def _normalized(branch: str, where: str) -> str:
+    """Hits of a branch on courses matching where, ranked relative to the best of them"""
+    best = "MAX(b.rank) OVER ()"
+    return (
+        "SELECT b.kind, b.resource_id, b.course_id, b.url, b.page_number, b.page_id, "
+        f"CASE WHEN {best} > 0 THEN b.rank / {best} ELSE 1.0 END AS rank "
+        f"FROM ({branch}) b JOIN course c ON c.id = b.course_id WHERE {where}"
+    )
+
+
+def _course_filters(backend, level, year, topics) -> Tuple[List[str], dict]:
+    """
+    WHERE conditions on the course of a hit with their expanding parameters. level
+    and topics are JSON and match whole values at any depth, e.g. "Fluid Mechanics"
+    matches topics [["Engineering", "Fluid Mechanics"]] but "Fluid" does not.
+    """
+    conditions = []
+    params = {}
+    if level is not None:
+        params["levels"] = _as_list(level)
+        conditions.append(backend.json_has_any("c.level", "levels"))
+    if topics is not None:
+        params["topics"] = _as_list(topics)
+        conditions.append(backend.json_has_any("c.topics", "topics"))
+    if year is not None:
+        years = [year] if isinstance(year, (str, int)) else list(year)
+        params["years"] = [str(value) for value in years]
+        conditions.append("c.year IN :years")
+    return conditions, params
+
+
+def _as_list(values) -> list:
+    return [values] if isinstance(values, str) else list(values)
+
+
+def _quoted(values: Tuple[str, ...]) -> str:
+    return ", ".join(f"'{value}'" for value in values)
+
+
+_TERM = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+
+def _terms(query: str) -> List[Tuple[str, bool]]:
+    """(term, excluded) pairs of a web search style query, or is kept as a term"""
+    terms = []
+    for negated, phrase, word in _TERM.findall(query):
+        if word:
+            negated = "-" if word.startswith("-") and len(word) > 1 else ""
+            phrase = word[1:] if negated else word
+        if re.search(r"\w", phrase):
+            terms.append((phrase, bool(negated)))
+    return terms
+
+
+def _positive_words(query: str) -> List[str]:
+    return [
+        word
+        for term, excluded in _terms(query)
+        if not excluded and term.lower() != "or"
+        for word in re.findall(r"\w+", term)
+    ]
+
+
+def _fts5_query(query: str) -> str:
+    """
+    FTS5 MATCH expression of a web search style query. Every term is quoted, so
+    punctuation such as the hyphen in navier-stokes is left to the tokenizer.
+    """
+    included = []
+    excluded = []
+    for term, negated in _terms(query):
+        if negated:
+            excluded.append(_fts5_string(term))
+        elif term.lower() == "or":
+            if included and included[-1] != "OR":
+                included.append("OR")
+        else:
+            included.append(_fts5_string(term))
+    while included and included[-1] == "OR":
+        included.pop()
+    if not included:
+        return ""
+    match = " ".join(included)
+    if excluded:
+        match = f"({match}) NOT ({' OR '.join(excluded)})"
+    return match
+
+
+def _fts5_string(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
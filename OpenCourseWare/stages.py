@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from metrics import Metrics
+
+
+class StagePipeline:
+    """
+    Runs items through named stages connected by bounded queues.
+
+    Each stage has its own worker count and a blocking handler that is run in a
+    thread of the pipeline's own pool, sized to the sum of the worker counts, so
+    network, cpu and db bound stages overlap. A full queue blocks the
+    stage feeding it, which keeps fast stages from running ahead of slow ones.
+    """
+
+    def __init__(
+        self,
+        stages: List[Tuple[str, Callable[[Any], None], int]],
+        queue_size: int = 2,
+        on_error: Optional[Callable[[Any, str, Exception], None]] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        metrics: Optional[Metrics] = None,
+        describe: Callable[[Any], str] = str,
+    ):
+        """
+        Args:
+            stages (list): (name, handler, workers) in order, handler(item) runs in a thread
+            queue_size (int): Items waiting in front of each stage
+            on_error (callable): on_error(item, stage name, exception), the item is dropped
+            on_done (callable): on_done(item) once an item made it through every stage
+            metrics (Metrics): Optional registry for the time each item spends in a stage
+                (ocw_course_stage_seconds), queue depths and items in progress
+            describe (callable): Name of an item on its spans and slowest samples
+        """
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.on_error = on_error
+        self.on_done = on_done
+        self.metrics = metrics
+        self.describe = describe
+        self.logger = logging.getLogger("stages")
+        self.in_progress: Dict[str, int] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats: Dict[str, Dict[str, float]] = {
+            name: {"processed": 0, "failed": 0, "seconds": 0.0}
+            for name, _, _ in stages
+        }
+
+    async def run(self, source: AsyncIterator[Any]):
+        """Feed items from source through every stage until source is exhausted"""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        done = object()
+        # the default executor of asyncio.to_thread has min(32, cpus + 4) threads,
+        # fewer than the stage workers of a large run
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(max(1, workers) for _, _, workers in self.stages),
+            thread_name_prefix="stage",
+        )
+
+        async def worker(index: int):
+            name, handler, _ = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            while (item := await inbox.get()) is not done:
+                self._gauges(name, inbox, 1)
+                start = time.perf_counter()
+                try:
+                    await self._handle(name, handler, item)
+                except Exception as e:
+                    self.stats[name]["failed"] += 1
+                    self.logger.error("stage %s failed: %s", name, e)
+                    if self.on_error:
+                        self.on_error(item, name, e)
+                    continue
+                finally:
+                    self.stats[name]["seconds"] += time.perf_counter() - start
+                    self._gauges(name, inbox, -1)
+
+                self.stats[name]["processed"] += 1
+                if outbox is not None:
+                    await outbox.put(item)
+                    self._gauges(self.stages[index + 1][0], outbox, 0)
+                elif self.on_done:
+                    self.on_done(item)
+
+        async def run_stage(index: int):
+            workers = max(1, self.stages[index][2])
+            await asyncio.gather(*(worker(index) for _ in range(workers)))
+            if index + 1 < len(queues):
+                for _ in range(max(1, self.stages[index + 1][2])):
+                    await queues[index + 1].put(done)
+
+        runners = [asyncio.create_task(run_stage(i)) for i in range(len(self.stages))]
+        try:
+            async for item in source:
+                await queues[0].put(item)
+                self._gauges(self.stages[0][0], queues[0], 0)
+        finally:
+            for _ in range(max(1, self.stages[0][2])):
+                await queues[0].put(done)
+            try:
+                await asyncio.gather(*runners)
+            finally:
+                self._executor.shutdown()
+            if self.metrics is not None:
+                for name, _, _ in self.stages:
+                    self.metrics.set("ocw_queue_depth", 0, stage=name)
+
+    async def _handle(self, name: str, handler: Callable[[Any], None], item: Any):
+        if self.metrics is None:
+            await self._in_thread(handler, item)
+            return
+        with self.metrics.stage(name, course=self.describe(item), name="ocw_course_stage_seconds"):
+            await self._in_thread(handler, item)
+
+    async def _in_thread(self, handler: Callable[[Any], None], item: Any):
+        # run in a copy of the context like asyncio.to_thread, so spans of the
+        # handler nest under the stage span
+        context = contextvars.copy_context()
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, handler, item)
+        )
+
+    def _gauges(self, name: str, queue: asyncio.Queue, started: int):
+        """Publish the queue depth of a stage, and its items in progress when one started (1) or ended (-1)"""
+        self.in_progress[name] = self.in_progress.get(name, 0) + started
+        if self.metrics is None:
+            return
+        self.metrics.set("ocw_queue_depth", queue.qsize(), stage=name)
+        self.metrics.set("ocw_stage_in_progress", self.in_progress[name], stage=name)
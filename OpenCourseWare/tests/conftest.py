@@ -0,0 +1,114 @@
+import os
+import shutil
+from concurrent.futures import Executor, Future
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks.fixtures import make_course_zip
+from benchmarks.standin_server import StandInOCW
+from database.models import Base
+
+# database.session builds its engine from the environment on import, tests pass their own session
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+@pytest.fixture(scope="session")
+def course_zip(tmp_path_factory):
+    """Small synthetic course zip, see benchmarks/fixtures.py"""
+    path = tmp_path_factory.mktemp("fixtures") / "course.zip"
+    return make_course_zip(path, lectures=3, problem_sets=1, readings=1, pages=2)
+
+
+@pytest.fixture(scope="session")
+def standin(course_zip):
+    """Stand-in OCW serving the course zip with Range support"""
+    server = StandInOCW(courses=1, template_zip=course_zip["path"]).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def zip_url(standin):
+    standin.reset_stats()
+    return f"{standin.base_url}{standin.slug(0)}/{standin.course_number(0)}-fall-2024.zip"
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Session of an empty SQLite database with every table and the full text index"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.sqlite'}")
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def course(db, course_zip, tmp_path):
+    """Unpacked CourseContext of the course zip, working in-process unless max_workers is set"""
+    from course_context import CourseContext
+
+    def make(**options):
+        options.setdefault("max_workers", 1)
+        context = CourseContext(
+            download_url="",
+            url="https://ocw.mit.edu/courses/2-999-synthetic",
+            db_session=db,
+            corpus_path=tmp_path / "corpus",
+            out_dir=tmp_path / "out",
+            **options,
+        )
+        context._clear_corpus()
+        shutil.copy(course_zip["path"], context._zip_path)
+        context.unpack()
+        return context
+
+    return make
+
+
+@pytest.fixture
+def pdf_paths(course):
+    """Paths of the unpacked course's lecture pdfs"""
+    context = course()
+    return [str(context.corpus_static_resources / filename) for filename in context.lecture_filenames]
+
+
+@pytest.fixture
+def reversed_executor():
+    """Executor whose calls finish in the reverse of the order they were submitted in"""
+    return ReversedExecutor()
+
+
+class ReversedExecutor(Executor):
+    """Runs the calls submitted in-process, the last one first, once a result is asked for"""
+
+    def __init__(self):
+        self.pending = []
+        self.finished = []   # first argument of each call, in the order they finished
+
+    def submit(self, fn, *args, **kwargs):
+        future = _LazyFuture(self)
+        self.pending.append((future, fn, args, kwargs))
+        return future
+
+    def run(self):
+        while self.pending:
+            future, fn, args, kwargs = self.pending.pop()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            self.finished.append(args[0])
+
+
+class _LazyFuture(Future):
+    def __init__(self, executor: ReversedExecutor):
+        super().__init__()
+        self.executor = executor
+
+    def result(self, timeout=None):
+        self.executor.run()
+        return super().result(timeout)
@@ -0,0 +1,150 @@
+import builtins
+from collections import Counter
+from pathlib import Path
+
+import fitz
+import pymupdf
+import pytest
+
+from database.models import Lecture, ProblemSet, Reading
+from extract_pdf import extract_pdf
+from helpers import file_sha256
+
+
+def _count_opens(monkeypatch, directory: Path) -> Counter:
+    """Count the opens of each file in directory, by fitz or as a plain file"""
+    opens = Counter()
+    document_init, file_open = pymupdf.Document.__init__, builtins.open
+
+    def record(path):
+        if isinstance(path, (str, Path)) and Path(path).parent == directory:
+            opens[Path(path).name] += 1
+
+    def counting_document_init(self, *args, **kwargs):
+        record(args[0] if args else kwargs.get("filename"))
+        document_init(self, *args, **kwargs)
+
+    def counting_open(file, *args, **kwargs):
+        record(file)
+        return file_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(pymupdf.Document, "__init__", counting_document_init)
+    monkeypatch.setattr(builtins, "open", counting_open)
+    return opens
+
+
+def test_extract_with_pdfs_opens_each_pdf_once(course, monkeypatch):
+    context = course()
+    context.save_course()
+    context.skip_unchanged_resources()
+    opens = _count_opens(monkeypatch, context.corpus_static_resources)
+
+    context.extract_texts_and_pdfs()
+
+    pdfs = [*context.lecture_filenames, *context.readings_filenames]
+    pdfs += [filename for batch in context.problem_set_batches for filename in batch]
+    assert opens == Counter({filename: 1 for filename in pdfs})
+    assert all(context.extracted_texts[filename] for filename in pdfs)
+    monkeypatch.undo()
+    with fitz.open(context.out_course_dir / "combined_lectures.pdf") as doc:
+        assert doc.page_count == 2 * len(context.lecture_filenames)
+    assert (context.out_course_dir / "problem_set_01.pdf").exists()
+    assert (context.out_course_dir / "combined_readings.pdf").exists()
+
+
+def test_rows_keep_their_order_whatever_order_extraction_finishes_in(course, db, reversed_executor):
+    context = course(executor=reversed_executor)
+    context.extract()
+    context.extract_resources()
+
+    assert reversed_executor.finished[0].endswith(context.readings_filenames[-1])
+    lectures = db.query(Lecture).order_by(Lecture.id).all()
+    assert [lecture.remote_url for lecture in lectures] == [
+        context.get_remote_path(filename) for filename in context.lecture_filenames
+    ]
+    for lecture, filename in zip(lectures, context.lecture_filenames):
+        assert lecture.llm_text == extract_pdf(str(context.corpus_static_resources / filename))
+
+
+def test_resources_are_saved_in_one_transaction(course, db, monkeypatch):
+    context = course()
+    context.extract()
+
+    def fail(*args, **kwargs):
+        raise Exception("reading insert failed")
+
+    monkeypatch.setattr(Reading, "bulk_upsert", fail)
+    with pytest.raises(Exception, match="reading insert failed"):
+        context.extract_resources()
+    assert (db.query(ProblemSet).count(), db.query(Lecture).count()) == (0, 0)
+
+    monkeypatch.undo()
+    context.extract_resources()
+    assert (db.query(ProblemSet).count(), db.query(Lecture).count(), db.query(Reading).count()) == (1, 3, 1)
+
+
+def test_resource_manifest_is_built_in_one_pass_and_reused(course, monkeypatch):
+    context = course()
+    manifest_path = context.corpus_path / "manifest.json"
+    manifest_path.unlink()
+    context.manifest = None
+    reads = Counter()
+    file_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        if str(file).endswith("data.json"):
+            reads[str(file)] += 1
+        return file_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+    context.contextualize()
+    monkeypatch.undo()
+
+    resource_reads = {path: count for path, count in reads.items() if "/resources/" in path}
+    assert resource_reads and set(resource_reads.values()) == {1}
+    lectures = context.lecture_filenames
+    assert sorted(lectures) == ["lec01.pdf", "lec02.pdf", "lec03.pdf"]
+    assert context.problem_set_batches == [("hw01.pdf", "hw01_sol.pdf")]
+    assert context.readings_filenames == ["reading01.pdf"]
+    lecture = next(entry for entry in context.manifest["Lecture Notes"] if entry["file_name"] == "lec01.pdf")
+    path = context.corpus_static_resources / "lec01.pdf"
+    assert lecture == dict(
+        file_name="lec01.pdf", size=path.stat().st_size, page_count=2, sha256=file_sha256(path)
+    )
+
+    # a second pass reads the manifest written next to the corpus
+    monkeypatch.setattr("course_context.glob.glob", lambda *args, **kwargs: [])
+    context.manifest = None
+    context.contextualize()
+    assert context.lecture_filenames == lectures
+
+
+def test_unchanged_resources_are_not_extracted_again(course, db, monkeypatch):
+    first = course()
+    first.extract()
+    first.extract_resources()
+
+    # the next run of the course, with one lecture changed
+    context = course()
+    static = context.corpus_static_resources
+    (static / "lec01.pdf").write_bytes((static / "lec02.pdf").read_bytes())
+    (context.corpus_path / "manifest.json").unlink()
+    context.manifest = None
+    context.contextualize()
+    extracted = []
+    monkeypatch.setattr(
+        "course_context.extract_pdfs",
+        lambda paths, **kwargs: extracted.extend(Path(path).name for path in paths) or ["text"] * len(paths),
+    )
+    context.extract()
+    context.extract_resources()
+
+    assert extracted == ["lec01.pdf"]
+    assert context.unchanged_resources == {
+        ("lectures", "lec02.pdf"), ("lectures", "lec03.pdf"), ("readings", "reading01.pdf"),
+        ("problem_sets", ("hw01.pdf", "hw01_sol.pdf")),
+    }
+    lecture = db.query(Lecture).filter(Lecture.remote_url == context.get_remote_path("lec01.pdf")).one()
+    db.refresh(lecture)
+    assert (lecture.llm_text, lecture.source_hash) == ("text", file_sha256(static / "lec01.pdf"))
+    assert db.query(Lecture).count() == 3
@@ -0,0 +1,30 @@
+from download_cache import DownloadCache
+from downloader import download_file
+
+
+def test_cache_reuses_the_probe(standin, zip_url, tmp_path):
+    cache = DownloadCache(tmp_path / "cache")
+    probes = []
+
+    def download(url, path, probed):
+        probes.append(probed)
+        download_file(url, path, probed=probed)
+
+    cache.fetch(zip_url, tmp_path / "first.zip", download)
+    cache.fetch(zip_url, tmp_path / "second.zip", download)
+
+    assert (tmp_path / "second.zip").read_bytes() == standin.course_zip(0)
+    assert len(probes) == 1 and probes[0][0] == len(standin.course_zip(0))
+    assert standin.stats["requests_zip"] == 3
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_evicts_orphaned_partial_downloads(standin, zip_url, tmp_path):
+    cache = DownloadCache(tmp_path / "cache", max_bytes=len(standin.course_zip(0)))
+    orphan = tmp_path / "cache" / "0123.download.part"
+    orphan.write_bytes(b"\0" * 1024)
+    orphan.with_name(orphan.name + ".json").write_text("{}")
+
+    cache.fetch(zip_url, tmp_path / "course.zip", lambda url, path, probed: download_file(url, path))
+
+    assert [path.suffix for path in (tmp_path / "cache").iterdir()] == [".blob"]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from downloader import download_file, part_paths, probe
+
+
+def test_download_in_segments(standin, zip_url, tmp_path):
+    dest = tmp_path / "course.zip"
+    download_file(zip_url, dest, segments=4, min_segment_size=1024, chunk_size=1024)
+
+    assert dest.read_bytes() == standin.course_zip(0)
+    assert standin.stats["status_206"] == 4
+    assert not any(path.exists() for path in part_paths(dest))
+
+
+def test_resume_fetches_only_the_missing_bytes(standin, zip_url, tmp_path):
+    content = standin.course_zip(0)
+    size, etag, accepts_ranges = probe(zip_url)
+    assert (size, accepts_ranges) == (len(content), True)
+
+    # an interrupted download: the first half is on disk, the second half never arrived
+    dest = tmp_path / "course.zip"
+    part, state_path = part_paths(dest)
+    half = size // 2
+    part.write_bytes(content[:half] + b"\0" * (size - half))
+    state_path.write_text(json.dumps({
+        "url": zip_url,
+        "size": size,
+        "etag": etag,
+        "segments": [
+            {"start": 0, "end": half, "done": half},
+            {"start": half, "end": size, "done": 0},
+        ],
+    }))
+    standin.reset_stats()
+
+    download_file(zip_url, dest, segments=2, min_segment_size=1024, chunk_size=1024)
+
+    assert dest.read_bytes() == content
+    assert standin.stats["status_206"] == 1
+    assert standin.stats["bytes_sent"] == size - half
+    assert not state_path.exists()
+
+
+def test_changed_upstream_restarts(standin, zip_url, tmp_path):
+    content = standin.course_zip(0)
+    dest = tmp_path / "course.zip"
+    part, state_path = part_paths(dest)
+    part.write_bytes(b"\0" * len(content))
+    state_path.write_text(json.dumps({
+        "url": zip_url,
+        "size": len(content),
+        "etag": '"an older version"',
+        "segments": [{"start": 0, "end": len(content), "done": len(content)}],
+    }))
+
+    download_file(zip_url, dest, segments=1)
+
+    assert dest.read_bytes() == content
+
+
+def test_incomplete_download_fails(zip_url, tmp_path, monkeypatch):
+    monkeypatch.setattr("downloader._done_bytes", lambda state: 0)
+    with pytest.raises(Exception, match="Incomplete download"):
+        download_file(zip_url, tmp_path / "course.zip", segments=1)
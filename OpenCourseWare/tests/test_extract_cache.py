@@ -0,0 +1,94 @@
+import sqlite3
+
+import fitz
+import pytest
+
+from extract_cache import ExtractionCache
+from extract_pdf import TIER_CACHED, cache_key, extract_pdfs
+
+
+def test_total_size_is_kept_on_put_replace_and_evict(tmp_path):
+    cache = ExtractionCache(tmp_path / "cache.sqlite", max_bytes=10**6)
+    cache.put("a", "statics " * 100)
+    cache.put("b", "dynamics " * 100)
+    cache.put("a", "statics and beams " * 100)
+
+    conn = sqlite3.connect(tmp_path / "cache.sqlite")
+    stored = conn.execute("SELECT SUM(size) FROM extraction").fetchone()[0]
+    assert cache.size() == stored
+
+    cache.max_bytes = stored - 1
+    cache.put("c", "fluids")
+    assert cache.size() == conn.execute("SELECT SUM(size) FROM extraction").fetchone()[0]
+    conn.close()
+    cache.close()
+
+
+def test_existing_caches_get_their_total(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE extraction (key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO extraction VALUES ('a', x'00', 123, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = ExtractionCache(path)
+    assert cache.size() == 123
+    cache.close()
+
+
+def test_tiered_keys_depend_on_the_fitz_version(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path / "cache.sqlite")
+    tiered = cache_key(cache, "lec01.pdf", "abc", tiered=True)
+    assert tiered != cache_key(cache, "lec01.pdf", "abc")
+
+    monkeypatch.setattr(fitz, "VersionBind", "0.0.1")
+    assert cache_key(cache, "lec01.pdf", "abc", tiered=True) != tiered
+    cache.close()
+
+
+def test_hits_and_misses(tmp_path):
+    cache = ExtractionCache(tmp_path / "cache.sqlite")
+    key = cache.key("abc")
+    assert cache.get(key) is None
+    cache.put(key, "# Lecture 1\n\nNewton's laws")
+
+    assert cache.get(key) == "# Lecture 1\n\nNewton's laws"
+    assert cache.get(cache.key("abc", {"tiered": True})) is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("extract_cache.time.time", lambda: now[0])
+    cache = ExtractionCache(tmp_path / "cache.sqlite")
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.put(key, key * 1000)
+    now[0] += 1
+    cache.get("a")
+
+    cache.max_bytes = cache.size()
+    now[0] += 1
+    cache.put("d", "d" * 1000)
+
+    assert [key for key in "abcd" if cache.get(key) is not None] == ["a", "c", "d"]
+    assert cache.size() <= cache.max_bytes
+    cache.close()
+
+
+def test_hits_skip_the_pdf_parse(pdf_paths, tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path / "cache.sqlite")
+    texts = extract_pdfs(pdf_paths, max_workers=1, cache=cache)
+
+    def parse(*args, **kwargs):
+        raise AssertionError("pdf parsed on a cache hit")
+
+    monkeypatch.setattr("extract_pdf.pymupdf4llm.to_markdown", parse)
+    tiers = []
+    assert extract_pdfs(pdf_paths, max_workers=1, cache=cache, tiers=tiers) == texts
+    assert tiers == [TIER_CACHED] * len(pdf_paths)
+    cache.close()
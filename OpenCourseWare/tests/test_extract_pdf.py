@@ -0,0 +1,105 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+import pytest
+
+import extract_pdf
+from benchmarks.fixtures import make_pdf
+from extract_pdf import (
+    TIER_FAST,
+    TIER_LAYOUT,
+    TIER_MIXED,
+    extract_pdf as extract_one,
+    extract_pdf_tiered,
+    extract_pdfs,
+    probe_page,
+)
+
+
+def test_pool_results_are_in_input_order(pdf_paths, reversed_executor):
+    expected = [extract_one(path) for path in pdf_paths]
+    assert len(set(expected)) == len(pdf_paths)
+
+    assert extract_pdfs(pdf_paths, max_workers=2) == expected
+
+    assert extract_pdfs(pdf_paths, executor=reversed_executor) == expected
+    assert reversed_executor.finished == pdf_paths[::-1]
+
+
+@pytest.mark.parametrize("max_workers, pool_size", [(2, 2), (8, 3), (None, 3)])
+def test_pool_size_is_configurable(pdf_paths, monkeypatch, max_workers, pool_size):
+    sizes = []
+
+    class RecordingPool(ProcessPoolExecutor):
+        def __init__(self, max_workers=None, **kwargs):
+            sizes.append(max_workers)
+            super().__init__(max_workers=max_workers, **kwargs)
+
+    monkeypatch.setattr(extract_pdf, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(extract_pdf.os, "cpu_count", lambda: 4)
+    extract_pdfs(pdf_paths, max_workers=max_workers)
+    assert sizes == [pool_size]
+
+
+def test_one_worker_extracts_in_process(pdf_paths, monkeypatch):
+    monkeypatch.setattr(extract_pdf, "ProcessPoolExecutor", None)
+    assert all(extract_pdfs(pdf_paths, max_workers=1))
+
+
+def _pdf(tmp_path, complexity, pages=2):
+    path = tmp_path / f"{complexity}.pdf"
+    path.write_bytes(make_pdf(pages, complexity))
+    return str(path)
+
+
+def _page(draw):
+    doc = fitz.open()
+    page = doc.new_page()
+    draw(page)
+    return doc, page
+
+
+def test_probe_page():
+    doc, page = _page(lambda page: page.insert_textbox(
+        fitz.Rect(72, 72, 540, 760), "beam stress strain force moment " * 80, fontsize=10
+    ))
+    assert probe_page(page) == TIER_FAST
+
+    doc, page = _page(lambda page: None)
+    assert probe_page(page) == TIER_FAST
+
+    def heading(page):
+        page.insert_text((72, 72), "Section 1", fontsize=18)
+        page.insert_textbox(fitz.Rect(72, 96, 540, 760), "beam stress strain " * 80, fontsize=10)
+    assert probe_page(_page(heading)[1]) == TIER_LAYOUT
+
+    def table(page):
+        page.insert_textbox(fitz.Rect(72, 72, 540, 400), "beam stress strain " * 40, fontsize=10)
+        for row in range(4):
+            page.draw_rect(fitz.Rect(72, 440 + row * 20, 182, 460 + row * 20))
+    assert probe_page(_page(table)[1], max_drawings=8) == TIER_FAST
+    assert probe_page(_page(table)[1], max_drawings=3) == TIER_LAYOUT
+
+
+def test_tiered_extraction_picks_a_tier_per_pdf(tmp_path):
+    plain = _pdf(tmp_path, "plain")
+    text, tier = extract_pdf_tiered(plain)
+    assert tier == TIER_FAST
+    with fitz.open(plain) as doc:
+        assert text == "".join(page.get_text(sort=True).strip() + "\n\n" for page in doc)
+
+    assert extract_pdf_tiered(_pdf(tmp_path, "layout"))[1] == TIER_LAYOUT
+
+    text, tier = extract_pdf_tiered(_pdf(tmp_path, "mixed", pages=2))
+    assert tier == TIER_MIXED
+    # the second page went through pymupdf4llm, which marks up its heading
+    assert "# Section 2" in text
+
+
+def test_tiered_extraction_of_an_unreadable_pdf(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.7 not really")
+    assert extract_pdf_tiered(str(path)) == (None, TIER_LAYOUT)
+    tiers = []
+    assert extract_pdfs([str(path)], max_workers=1, tiered=True, tiers=tiers) == [None]
+    assert tiers == [TIER_LAYOUT]
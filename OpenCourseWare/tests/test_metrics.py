@@ -0,0 +1,54 @@
+import pytest
+
+from metrics import STAGE_FAILURES, STAGE_SECONDS, Metrics
+
+
+def test_prometheus_text_format(tmp_path):
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.inc("ocw_pdfs_extracted_total", tier="fast")
+    metrics.inc("ocw_pdfs_extracted_total", 2, tier="layout")
+    metrics.inc("ocw_db_rows_total", 3, table='lecture "notes"\n')
+    metrics.set("ocw_queue_depth", 4, stage="extract")
+    for seconds in (0.05, 0.5, 2):
+        metrics.observe(STAGE_SECONDS, seconds, stage="download")
+
+    assert metrics.render() == "\n".join([
+        "# HELP ocw_db_rows_total Rows upserted, by table",
+        "# TYPE ocw_db_rows_total counter",
+        'ocw_db_rows_total{table="lecture \\"notes\\"\\n"} 3',
+        "# HELP ocw_pdfs_extracted_total Pdfs converted to markdown, by extraction tier",
+        "# TYPE ocw_pdfs_extracted_total counter",
+        'ocw_pdfs_extracted_total{tier="fast"} 1',
+        'ocw_pdfs_extracted_total{tier="layout"} 2',
+        "# HELP ocw_queue_depth Courses waiting in front of a pipeline stage",
+        "# TYPE ocw_queue_depth gauge",
+        'ocw_queue_depth{stage="extract"} 4',
+        "# HELP ocw_stage_seconds Latency of one unit of work of a stage",
+        "# TYPE ocw_stage_seconds histogram",
+        'ocw_stage_seconds_bucket{stage="download",le="0.1"} 1',
+        'ocw_stage_seconds_bucket{stage="download",le="1"} 2',
+        'ocw_stage_seconds_bucket{stage="download",le="+Inf"} 3',
+        'ocw_stage_seconds_sum{stage="download"} 2.55',
+        'ocw_stage_seconds_count{stage="download"} 3',
+    ]) + "\n"
+
+    path = tmp_path / "metrics" / "ocw.prom"
+    metrics.write(path)
+    assert path.read_text() == metrics.render()
+
+
+def test_stages_count_failures_and_keep_the_slowest():
+    metrics = Metrics(slowest=2)
+    for seconds, resource in ((3, "lec01.pdf"), (1, "lec02.pdf"), (5, "lec03.pdf")):
+        metrics.record("pdf_extract", seconds, course="2-001", resource=resource)
+    with pytest.raises(Exception):
+        with metrics.stage("download", course="2-001"):
+            raise Exception("connection reset")
+
+    summary = metrics.summary()
+    extract = summary["histograms"][STAGE_SECONDS]["pdf_extract"]
+    assert (extract["count"], extract["seconds"], extract["max"]) == (3, 9, 5)
+    assert [sample["resource"] for sample in extract["slowest"]] == ["lec03.pdf", "lec01.pdf"]
+    assert summary["histograms"][STAGE_SECONDS]["download"]["count"] == 1
+    assert summary["counters"] == {f'{STAGE_FAILURES}{{stage="download"}}': 1}
+    assert f'{STAGE_FAILURES}{{stage="download"}} 1' in metrics.render()
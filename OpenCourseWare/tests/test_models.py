@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+
+import pytest
+
+from database.models import Course, CourseStats, Lecture, ProblemSet, ResourcePage, dialect_insert
+
+
+def _course(db, course_number="2.001", **fields):
+    fields = dict(
+        dict(
+            title="Mechanics", url="https://ocw.mit.edu/courses/2-001", download_url="",
+            description="", year="2024", term="Fall", level="Undergraduate",
+            topics=[["Engineering", "Mechanical Engineering"]],
+        ),
+        **fields,
+    )
+    course_id = Course.upsert(db, course_number=course_number, **fields)
+    db.commit()
+    return course_id
+
+
+def _lecture(course_id, url, text, source_hash="a"):
+    return dict(
+        course_id=course_id, remote_url=url, llm_text=text,
+        character_count=len(text), source_hash=source_hash,
+    )
+
+
+def test_bulk_create_leaves_the_commit_to_the_caller(db):
+    course_id = _course(db)
+    rows = [_lecture(course_id, f"lec{i:02}.pdf", "statics") for i in range(3)]
+
+    assert Lecture.bulk_create(db, rows, commit=False) == 3
+    db.rollback()
+    assert db.query(Lecture).count() == 0
+
+    Lecture.bulk_create(db, rows)
+    db.rollback()
+    assert [lecture.remote_url for lecture in db.query(Lecture).order_by(Lecture.id)] == [
+        "lec00.pdf", "lec01.pdf", "lec02.pdf"
+    ]
+
+
+def test_course_upsert_keeps_the_id(db):
+    course_id = _course(db)
+    assert _course(db, title="Mechanics II") == course_id
+    assert db.query(Course).count() == 1
+    assert db.get(Course, course_id).title == "Mechanics II"
+
+
+def test_dialect_insert_rejects_unsupported_dialects():
+    bind = SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+    with pytest.raises(ValueError, match="mysql"):
+        dialect_insert(SimpleNamespace(get_bind=lambda: bind), Course.__table__)
+
+
+def test_bulk_upsert_is_idempotent(db):
+    course_id = _course(db)
+    rows = [_lecture(course_id, "lec01.pdf", "statics"), _lecture(course_id, "lec02.pdf", "dynamics")]
+
+    assert Lecture.bulk_upsert(db, rows) == 2
+    ids = {lecture.remote_url: lecture.id for lecture in db.query(Lecture)}
+    assert Lecture.bulk_upsert(db, rows) == 2
+
+    assert {lecture.remote_url: lecture.id for lecture in db.query(Lecture)} == ids
+    assert Lecture.source_hashes(db, course_id) == {"lec01.pdf": "a", "lec02.pdf": "a"}
+
+
+def test_bulk_upsert_updates_changed_rows(db):
+    course_id = _course(db)
+    Lecture.bulk_upsert(db, [_lecture(course_id, "lec01.pdf", "statics")])
+    Lecture.bulk_upsert(db, [_lecture(course_id, "lec01.pdf", "statics and beams", source_hash="b")])
+
+    lecture = db.query(Lecture).one()
+    db.refresh(lecture)
+    assert (lecture.llm_text, lecture.character_count, lecture.source_hash) == ("statics and beams", 17, "b")
+
+
+def test_bulk_upsert_last_duplicate_wins(db):
+    course_id = _course(db)
+    rows = [_lecture(course_id, "lec01.pdf", "first"), _lecture(course_id, "lec01.pdf", "second")]
+
+    assert Lecture.bulk_upsert(db, rows) == 1
+    assert db.query(Lecture.llm_text).scalar() == "second"
+
+
+def test_bulk_upsert_keys_are_per_course(db):
+    first, second = _course(db, "2.001"), _course(db, "2.002")
+    ProblemSet.bulk_upsert(db, [
+        dict(
+            course_id=course_id, problem_text="p", solution_text="s",
+            remote_problem_url="hw01.pdf", remote_solution_url="hw01_sol.pdf", character_count=2,
+        )
+        for course_id in (first, second)
+    ])
+    assert db.query(ProblemSet).count() == 2
+
+
+def test_resource_pages_are_upserted_and_read_in_page_order(db):
+    course_id = _course(db)
+    Lecture.bulk_upsert(db, [_lecture(course_id, "lec01.pdf", "", source_hash=None)])
+    lecture_id = db.query(Lecture.id).scalar()
+    pages = [
+        dict(resource_type=ResourcePage.LECTURE, resource_id=lecture_id, page_number=number,
+             text=text, character_count=len(text))
+        for number, text in ((2, "two"), (1, "one"))
+    ]
+    ResourcePage.bulk_upsert(db, pages)
+    ResourcePage.bulk_upsert(db, pages)
+
+    assert db.query(ResourcePage).count() == 2
+    assert ResourcePage.text_for(db, ResourcePage.LECTURE, lecture_id) == "onetwo"
+
+
+def test_course_stats_refresh(db):
+    first, second = _course(db, "2.001"), _course(db, "2.002")
+    Lecture.bulk_upsert(db, [
+        _lecture(first, "lec01.pdf", "statics"), _lecture(first, "lec02.pdf", "beams"),
+        _lecture(second, "lec01.pdf", "fluids"),
+    ])
+    ProblemSet.bulk_upsert(db, [
+        dict(
+            course_id=first, problem_text="p", solution_text="s",
+            remote_problem_url="hw01.pdf", remote_solution_url="hw01_sol.pdf", character_count=2,
+        )
+    ])
+
+    assert CourseStats.refresh(db, [first]) == 1
+    stats = db.get(CourseStats, first)
+    assert (stats.lecture_count, stats.lecture_chars, stats.problem_set_count, stats.total_chars) == (2, 12, 1, 14)
+    assert db.get(CourseStats, second) is None
+
+    Lecture.bulk_upsert(db, [_lecture(first, "lec02.pdf", "beams and frames")])
+    assert CourseStats.refresh(db) == 2
+    db.expire_all()
+    assert db.get(CourseStats, first).lecture_chars == 23
+    assert db.get(CourseStats, second).total_chars == 6
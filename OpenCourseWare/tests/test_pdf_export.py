@@ -0,0 +1,89 @@
+import json
+import shutil
+
+import fitz
+import pytest
+
+import pdf_export
+from pdf_export import EXPORT_MANIFEST, export_pdfs
+
+
+@pytest.fixture
+def inputs(course, tmp_path):
+    context = course()
+    directory = tmp_path / "inputs"
+    shutil.copytree(context.corpus_static_resources, directory)
+    return directory
+
+
+@pytest.fixture
+def merges(monkeypatch):
+    """Output file names merged, in order"""
+    merged = []
+    merge_pdfs = pdf_export.merge_pdfs
+
+    def counting(input_paths, output_path, *args, **kwargs):
+        merged.append(output_path.split("/")[-1])
+        return merge_pdfs(input_paths, output_path, *args, **kwargs)
+
+    monkeypatch.setattr(pdf_export, "merge_pdfs", counting)
+    return merged
+
+
+def _jobs(inputs):
+    return {
+        "combined_lectures.pdf": [inputs / f"lec0{i}.pdf" for i in (1, 2, 3)],
+        "problem_set_01.pdf": [inputs / "hw01.pdf", inputs / "hw01_sol.pdf"],
+    }
+
+
+def test_unchanged_outputs_are_skipped(inputs, merges, tmp_path):
+    out = tmp_path / "export"
+    out.mkdir()
+    written = export_pdfs(_jobs(inputs), out, max_workers=1)
+
+    assert written == [out / "combined_lectures.pdf", out / "problem_set_01.pdf"]
+    assert merges == ["combined_lectures.pdf", "problem_set_01.pdf"]
+    with fitz.open(out / "combined_lectures.pdf") as doc:
+        assert doc.page_count == 6
+    manifest = json.loads((out / EXPORT_MANIFEST).read_text())
+    assert [name for name, _ in manifest["problem_set_01.pdf"]["inputs"]] == ["hw01.pdf", "hw01_sol.pdf"]
+
+    merges.clear()
+    assert export_pdfs(_jobs(inputs), out, max_workers=1) == written
+    assert merges == []
+
+    # a changed input, or other save options, merge again
+    (inputs / "hw01_sol.pdf").write_bytes((inputs / "lec01.pdf").read_bytes())
+    export_pdfs(_jobs(inputs), out, max_workers=1)
+    assert merges == ["problem_set_01.pdf"]
+
+    merges.clear()
+    export_pdfs(_jobs(inputs), out, max_workers=1, optimize=True)
+    assert merges == ["combined_lectures.pdf", "problem_set_01.pdf"]
+
+
+def test_missing_outputs_are_merged_again(inputs, merges, tmp_path):
+    export_pdfs(_jobs(inputs), tmp_path, max_workers=1)
+    (tmp_path / "combined_lectures.pdf").unlink()
+    merges.clear()
+
+    export_pdfs(_jobs(inputs), tmp_path, max_workers=1)
+    assert merges == ["combined_lectures.pdf"]
+
+
+def test_prune_removes_stale_outputs(inputs, tmp_path):
+    export_pdfs(_jobs(inputs), tmp_path, max_workers=1)
+    jobs = _jobs(inputs)
+    del jobs["problem_set_01.pdf"]
+
+    export_pdfs(jobs, tmp_path, max_workers=1, prune=True)
+
+    assert not (tmp_path / "problem_set_01.pdf").exists()
+    assert list(json.loads((tmp_path / EXPORT_MANIFEST).read_text())) == ["combined_lectures.pdf"]
+
+
+def test_outputs_merge_in_parallel(inputs, tmp_path):
+    written = export_pdfs(_jobs(inputs), tmp_path, max_workers=2)
+    with fitz.open(written[1]) as doc:
+        assert doc.page_count == 4
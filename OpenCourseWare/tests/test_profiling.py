@@ -0,0 +1,69 @@
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import CourseProfile, profiled, sampler
+
+
+def _spin(seconds=0.2):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return seconds
+
+
+def test_sampler_collects_collapsed_stacks_of_the_tracked_thread():
+    stacks = Counter()
+    with sampler(0.005).track(stacks):
+        _spin()
+
+    assert sum(stacks.values()) > 5
+    stack, _ = stacks.most_common(1)[0]
+    frames = stack.split(";")
+    # root first, the profiler's own frames left out
+    assert frames[-1] == "test_profiling:_spin"
+    assert "test_profiling:test_sampler_collects_collapsed_stacks_of_the_tracked_thread" in frames[:-1]
+    assert not any(frame.startswith("profiling:") for frame in frames)
+
+
+class Course:
+    def __init__(self, profile):
+        self.profile = profile
+
+    @profiled("extract")
+    def extract(self):
+        _spin(0.1)
+        self.save()
+
+    @profiled("persist")
+    def save(self):
+        _spin(0.1)
+
+
+def test_profiled_stages_write_reports(tmp_path):
+    profile = CourseProfile(tmp_path / "profile", interval=0.005, allocations=True)
+    Course(profile).extract()
+
+    # the nested stage is part of the outer one
+    assert list(profile.stage_seconds) == ["extract"]
+    assert profile.stage_seconds["extract"] >= 0.2
+    collapsed = (tmp_path / "profile" / "cpu.collapsed").read_text()
+    assert "test_profiling:Course.extract;test_profiling:Course.save;test_profiling:_spin" in collapsed
+    memory = (tmp_path / "profile" / "memory.txt").read_text()
+    assert "peak resident memory by stage" in memory
+    assert "largest live allocations at the end of extract" in memory
+
+
+def test_profiled_without_a_profile(tmp_path):
+    Course(None).extract()
+    assert not any(tmp_path.iterdir())
+
+
+def test_pool_work_is_merged_into_the_course(tmp_path):
+    profile = CourseProfile(tmp_path, interval=0.005)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        results = list(pool.map(profile.wrap(_spin), [0.1, 0.1]))
+
+    assert [profile.unwrap(result) for result in results] == [0.1, 0.1]
+    assert any(stack.endswith("test_profiling:_spin") for stack in profile.stacks)
+    assert profile.worker_rss > 0
@@ -0,0 +1,78 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from helpers import download_headers
+from remote_zip import HTTPRangeFile, member_span
+
+
+@pytest.fixture
+def remote(zip_url):
+    remote = HTTPRangeFile(zip_url, block_size=4096, headers=download_headers)
+    yield remote
+    remote.close()
+
+
+def test_reads_match_the_archive(standin, remote):
+    content = standin.course_zip(0)
+    assert remote.size == len(content)
+
+    assert remote.read(10) == content[:10]
+    assert remote.read(10) == content[10:20]
+    remote.seek(-22, os.SEEK_END)
+    assert remote.read() == content[-22:]
+    remote.seek(1000)
+    remote.seek(500, os.SEEK_CUR)
+    assert remote.tell() == 1500
+    assert remote.read(100) == content[1500:1600]
+    assert remote.read(0) == b""
+    remote.seek(len(content))
+    assert remote.read(10) == b""
+
+
+def test_small_reads_share_a_request(remote):
+    remote.read(10)
+    remote.read(100)
+    remote.read(1000)
+    assert remote.requests_made == 1
+    assert remote.bytes_fetched == 4096
+
+
+def test_readinto(standin, remote):
+    buffer = bytearray(64)
+    remote.seek(100)
+    assert remote.readinto(buffer) == 64
+    assert bytes(buffer) == standin.course_zip(0)[100:164]
+
+
+def test_zipfile_members(standin, remote):
+    local = zipfile.ZipFile(io.BytesIO(standin.course_zip(0)))
+    with zipfile.ZipFile(remote) as zip_ref:
+        assert zip_ref.namelist() == local.namelist()
+        member = zip_ref.getinfo("static_resources/lec01.pdf")
+        remote.prefetch(*member_span(member))
+        requests_made = remote.requests_made
+        assert zip_ref.read(member) == local.read("static_resources/lec01.pdf")
+        # the prefetched span covers the local header and the data
+        assert remote.requests_made == requests_made
+
+
+def test_server_without_ranges(zip_url, monkeypatch):
+    monkeypatch.setattr(
+        "requests.Session.head",
+        lambda self, url, **kwargs: _Response({"Content-Length": "10"}),
+    )
+    with pytest.raises(Exception, match="does not support range requests"):
+        HTTPRangeFile(zip_url)
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+
+import pytest
+
+import rate_limiter
+from benchmarks.standin_server import StandInOCW
+from rate_limiter import RateLimiter, TokenBucket
+from scraper import BlockingFetcher, Scraper
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+    clock.now += 0.05
+    assert not bucket.try_acquire()
+    clock.now += 0.05
+    assert bucket.try_acquire()
+
+    # tokens never pile up past capacity
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_token_bucket_without_rate_never_waits():
+    bucket = TokenBucket(rate=None)
+    assert all(bucket.try_acquire() for _ in range(100))
+    asyncio.run(bucket.acquire())
+
+
+def test_rate_limiter_caps_requests_in_flight_per_host():
+    limiter = RateLimiter(requests_per_second=None, max_per_host=2)
+    in_flight = {}
+    peak = {}
+
+    async def request(url):
+        host = url.split("/")[2]
+        async with limiter.limit(url):
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+
+    async def crawl():
+        await asyncio.gather(*(
+            request(f"https://{host}/courses/{i}") for host in ("a.test", "b.test") for i in range(6)
+        ))
+
+    asyncio.run(crawl())
+    assert peak == {"a.test": 2, "b.test": 2}
+
+
+def test_rate_limiter_spaces_requests_to_a_host():
+    limiter = RateLimiter(requests_per_second=20, max_per_host=8)
+
+    async def crawl():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(24):
+            async with limiter.limit("https://a.test/"):
+                pass
+        return loop.time() - started
+
+    # a burst of one second's worth of tokens, the other 4 arrive 50ms apart
+    assert asyncio.run(crawl()) >= 0.19
+
+
+def test_download_links_use_a_session_per_thread_and_skip_failures(standin, monkeypatch):
+    monkeypatch.setattr(standin, "latency", 0.02)
+    scraper = Scraper(host=standin.base_url, api_url=standin.api_url)
+    course_url = f"{standin.base_url}{standin.slug(0)}"
+    missing = f"{standin.base_url}courses/missing"
+
+    sessions = {}
+    running = []
+    peak = []
+    lock = threading.Lock()
+    with_session = BlockingFetcher._with_session
+
+    def tracking(self, func, *args, **kwargs):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        try:
+            result = with_session(self, func, *args, **kwargs)
+            sessions.setdefault(threading.get_ident(), set()).add(id(self._local.session))
+            return result
+        finally:
+            with lock:
+                running.pop()
+
+    monkeypatch.setattr(BlockingFetcher, "_with_session", tracking)
+    links = scraper._scrape_download_links(
+        [course_url] * 6 + [missing], requests_per_second=None, max_per_host=2
+    )
+
+    zip_url = f"{standin.base_url}{standin.slug(0)}/{standin.course_number(0)}-fall-2024.zip"
+    assert links == [zip_url] * 6
+    assert max(peak) == 2
+    assert len(sessions) <= 2 and all(len(ids) == 1 for ids in sessions.values())
+
+
+def test_zip_links_are_derived_from_search_hits():
+    scraper = Scraper()
+    course_url = "https://ocw.mit.edu/courses/2-61-internal-combustion-engines-spring-2017"
+
+    source = {"coursenum": "2.61"}
+    run = {"slug": "courses/2-61-internal-combustion-engines-spring-2017", "semester": "Spring", "year": 2017}
+    assert scraper._derive_zip_download_links(source, run, course_url) == [f"{course_url}/2.61-spring-2017.zip"]
+
+    # term, year and course number from the slug alone
+    run = {"slug": "courses/22-314j-structural-mechanics-fall-2006"}
+    assert scraper._derive_zip_download_links({}, run, course_url) == [f"{course_url}/22.314j-fall-2006.zip"]
+
+    assert scraper._derive_zip_download_links(source, {"slug": "courses/2-61-engines"}, course_url) == []
+
+
+def test_zip_exists(standin):
+    scraper = Scraper(host=standin.base_url, retries=0)
+    zip_url = f"{standin.base_url}{standin.slug(0)}/{standin.course_number(0)}-fall-2024.zip"
+    session = scraper._http_session(1)
+
+    assert scraper._zip_exists(session, zip_url)
+    assert not scraper._zip_exists(session, zip_url.replace("-fall-", "-spring-"))
+    assert not scraper._zip_exists(session, "http://127.0.0.1:1/course.zip")
+    session.close()
+
+
+def test_derived_links_skip_the_download_page(standin):
+    scraper = Scraper(host=standin.base_url, api_url=standin.api_url)
+    course_urls = list(scraper.iter_course_urls(size=1))
+    standin.reset_stats()
+
+    links = scraper._scrape_download_links(course_urls)
+
+    assert links == [f"{standin.base_url}{standin.slug(0)}/{standin.course_number(0)}-fall-2024.zip"]
+    assert (scraper.download_links_derived, scraper.download_pages_scraped) == (1, 0)
+    assert standin.stats["requests_download_page"] == 0
+
+
+@pytest.fixture(scope="module")
+def catalog(course_zip):
+    """Stand-in OCW with 7 courses, to page through"""
+    server = StandInOCW(courses=7, template_zip=course_zip["path"]).start()
+    yield server
+    server.stop()
+
+
+def test_course_urls_are_paged(catalog):
+    scraper = Scraper(host=catalog.base_url, api_url=catalog.api_url)
+    catalog.reset_stats()
+
+    urls = list(scraper.iter_course_urls(department=None, size=None, page_size=3))
+    assert urls == [f"{catalog.base_url}{catalog.slug(i)}" for i in range(7)]
+    assert catalog.stats["requests_search"] == 3
+
+    catalog.reset_stats()
+    assert len(list(scraper.iter_course_urls(size=5, page_size=3))) == 5
+    assert catalog.stats["requests_search"] == 2
+
+
+def test_course_urls_stream_lazily(catalog):
+    scraper = Scraper(host=catalog.base_url, api_url=catalog.api_url)
+    catalog.reset_stats()
+
+    urls = scraper.iter_course_urls(size=None, page_size=3)
+    assert [next(urls) for _ in range(3)] == [f"{catalog.base_url}{catalog.slug(i)}" for i in range(3)]
+    assert catalog.stats["requests_search"] == 1
+
+
+def test_failed_first_search_page_raises(catalog):
+    scraper = Scraper(host=catalog.base_url, api_url=catalog.base_url + "api/missing/")
+    with pytest.raises(Exception, match="Fetching courses failed"):
+        list(scraper.iter_course_urls(size=None))
+
+
+def test_download_links_stream_across_search_pages(catalog):
+    scraper = Scraper(host=catalog.base_url, api_url=catalog.api_url)
+
+    async def collect():
+        return [
+            link async for link in scraper.stream_download_links(
+                department=None, size=None, page_size=3, requests_per_second=None, max_per_host=2,
+            )
+        ]
+
+    links = asyncio.run(collect())
+    course_urls = [f"{catalog.base_url}{catalog.slug(i)}" for i in range(7)]
+    assert sorted(links) == sorted(
+        (url, f"{url}/{catalog.course_number(i)}-fall-2024.zip") for i, url in enumerate(course_urls)
+    )
+    assert scraper.urls == links
@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from database.models import Course, Lecture, ProblemSet, Reading, ResourcePage
+from search import _fts5_query, search
+
+
+@pytest.fixture
+def corpus(db):
+    """Two courses with a lecture each, a reading, a problem set and a paged lecture"""
+    fluids = Course.upsert(
+        db, course_number="2.25", title="Advanced Fluid Mechanics", url="https://ocw.mit.edu/courses/2-25",
+        download_url="", description="", year="2015", term="Fall", level="Graduate",
+        topics=[["Engineering", "Fluid Mechanics"]],
+    )
+    lab = Course.upsert(
+        db, course_number="2.26", title="Fluids Lab", url="https://ocw.mit.edu/courses/2-26",
+        download_url="", description="", year="2016", term="Spring", level="Undergraduate",
+        topics=[["Engineering", "Fluid Mechanics Lab"]],
+    )
+    db.commit()
+    texts = {
+        (fluids, "lec01.pdf"): "The Navier-Stokes equations describe viscous flow in the boundary layer.",
+        (lab, "lec01.pdf"): "Measuring turbulent boundary layer profiles with a pitot tube.",
+        (lab, "paged.pdf"): "",
+    }
+    Lecture.bulk_upsert(db, [
+        dict(course_id=course_id, remote_url=url, llm_text=text, character_count=len(text))
+        for (course_id, url), text in texts.items()
+    ])
+    Reading.bulk_upsert(db, [
+        dict(course_id=fluids, remote_url="reading01.pdf", llm_text="Laplace transforms of flow.", character_count=27),
+    ])
+    ProblemSet.bulk_upsert(db, [
+        dict(
+            course_id=fluids, problem_text="Derive the Navier-Stokes equations.", solution_text="Start from momentum.",
+            remote_problem_url="hw01.pdf", remote_solution_url="hw01_sol.pdf", character_count=55,
+        ),
+    ])
+    paged = db.query(Lecture.id).filter(Lecture.remote_url == "paged.pdf").scalar()
+    ResourcePage.bulk_upsert(db, [
+        dict(resource_type=ResourcePage.LECTURE, resource_id=paged, page_number=number, text=text, character_count=len(text))
+        for number, text in ((1, "Fourier series."), (2, "Fourier transforms of the Navier-Stokes terms."))
+    ])
+    return db
+
+
+def _found(hits):
+    return [(hit.kind, hit.course_number, hit.url, hit.page_number) for hit in hits]
+
+
+def test_finds_documents_and_pages(corpus):
+    hits = search(corpus, "navier-stokes")
+
+    assert sorted(_found(hits), key=str) == sorted([
+        ("lecture", "2.25", "lec01.pdf", None),
+        ("lecture", "2.26", "paged.pdf", 2),
+        ("problem_set", "2.25", "hw01.pdf", None),
+    ], key=str)
+    assert all(0 < hit.rank <= 1 for hit in hits)
+    lecture = next(hit for hit in hits if hit.page_number == 2)
+    assert "**Navier-Stokes**" in lecture.snippet
+
+
+def test_ranks_are_relative_to_each_index(corpus):
+    # best hit of each kind, documents and pages apart, ranks 1
+    hits = search(corpus, "flow")
+    assert {(hit.kind, hit.page_number): hit.rank for hit in hits} == {
+        ("lecture", None): 1.0,
+        ("reading", None): 1.0,
+    }
+
+
+def test_query_syntax(corpus):
+    assert _found(search(corpus, '"boundary layer" -turbulent')) == [("lecture", "2.25", "lec01.pdf", None)]
+    assert {hit.kind for hit in search(corpus, "laplace or fourier")} == {"reading", "lecture"}
+    assert search(corpus, "-navier") == []
+    assert search(corpus, "   ") == []
+
+
+def test_kinds(corpus):
+    assert {hit.kind for hit in search(corpus, "navier", kinds=["problem_set"])} == {"problem_set"}
+    with pytest.raises(Exception, match="unknown search kinds"):
+        search(corpus, "navier", kinds=["video"])
+
+
+def test_course_filters_match_whole_values(corpus):
+    assert {hit.course_number for hit in search(corpus, "boundary", level="Graduate")} == {"2.25"}
+    assert {hit.course_number for hit in search(corpus, "boundary", topics=["Fluid Mechanics"])} == {"2.25"}
+    assert {hit.course_number for hit in search(corpus, "boundary", topics=["Fluid Mechanics Lab"])} == {"2.26"}
+    assert search(corpus, "boundary", topics=["Fluid"]) == []
+    assert search(corpus, "boundary", level="Grad") == []
+    assert {hit.course_number for hit in search(corpus, "boundary", level=["Graduate", "Undergraduate"])} == {"2.25", "2.26"}
+    assert {hit.course_number for hit in search(corpus, "boundary", topics=["Engineering"])} == {"2.25", "2.26"}
+    assert {hit.course_number for hit in search(corpus, "boundary", year=2016)} == {"2.26"}
+    assert {hit.course_number for hit in search(corpus, "boundary", year=["2015", 2016])} == {"2.25", "2.26"}
+
+
+def test_course_filters_run_in_sql(corpus):
+    statements = []
+
+    def executed(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = corpus.get_bind()
+    event.listen(engine, "before_cursor_execute", executed)
+    try:
+        search(corpus, "boundary", level="Graduate", topics=["Fluid Mechanics"])
+    finally:
+        event.remove(engine, "before_cursor_execute", executed)
+    assert "json_tree(c.level)" in statements[0] and "json_tree(c.topics)" in statements[0]
+    assert not [statement for statement in statements[1:] if "FROM course" in statement]
+
+
+def test_paging(corpus):
+    hits = search(corpus, "navier-stokes")
+    assert _found(search(corpus, "navier-stokes", limit=2)) == _found(hits[:2])
+    assert _found(search(corpus, "navier-stokes", limit=2, offset=2)) == _found(hits[2:])
+
+
+def test_fts5_query():
+    assert _fts5_query("navier-stokes") == '"navier-stokes"'
+    assert _fts5_query('"boundary layer" -turbulent') == '("boundary layer") NOT ("turbulent")'
+    assert _fts5_query("laplace or fourier or") == '"laplace" OR "fourier"'
+    assert _fts5_query('say "hi') == '"say" """hi"'
+
+
+def test_unsupported_dialect():
+    bind = SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+    with pytest.raises(ValueError, match="mysql"):
+        search(SimpleNamespace(get_bind=lambda: bind), "boundary")
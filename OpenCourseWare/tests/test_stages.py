@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+
+from stages import StagePipeline
+
+
+async def _items(items):
+    for item in items:
+        yield item
+
+
+def _run(pipeline, items):
+    asyncio.run(pipeline.run(_items(items)))
+
+
+def test_items_go_through_every_stage_in_order():
+    seen = []
+    done = []
+
+    def stage(name):
+        return lambda item: seen.append((name, item))
+
+    pipeline = StagePipeline(
+        [("download", stage("download"), 1), ("extract", stage("extract"), 1), ("persist", stage("persist"), 1)],
+        on_done=done.append,
+    )
+    _run(pipeline, range(5))
+
+    assert done == list(range(5))
+    for item in range(5):
+        assert [name for name, seen_item in seen if seen_item == item] == ["download", "extract", "persist"]
+    assert {name: stats["processed"] for name, stats in pipeline.stats.items()} == {
+        "download": 5, "extract": 5, "persist": 5,
+    }
+
+
+def test_a_failed_item_is_dropped_and_the_rest_continue():
+    errors = []
+    done = []
+    persisted = []
+
+    def extract(item):
+        if item == 2:
+            raise Exception("bad pdf")
+
+    pipeline = StagePipeline(
+        [("download", lambda item: None, 2), ("extract", extract, 2), ("persist", persisted.append, 1)],
+        on_error=lambda item, name, e: errors.append((item, name, str(e))),
+        on_done=done.append,
+    )
+    _run(pipeline, range(5))
+
+    assert errors == [(2, "extract", "bad pdf")]
+    assert sorted(done) == sorted(persisted) == [0, 1, 3, 4]
+    assert (pipeline.stats["extract"]["processed"], pipeline.stats["extract"]["failed"]) == (4, 1)
+    assert pipeline.stats["persist"]["failed"] == 0
+
+
+def test_stage_workers_run_concurrently_and_full_queues_hold_back():
+    running = []
+    peak = []
+    lock = threading.Lock()
+    fed = []
+
+    def download(item):
+        with lock:
+            running.append(item)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(item)
+
+    async def source():
+        for item in range(12):
+            fed.append(item)
+            yield item
+
+    persisted = []
+
+    def persist(item):
+        # the slow last stage: only a few items fit in the queues in front of it
+        time.sleep(0.02)
+        persisted.append(len(fed))
+
+    pipeline = StagePipeline([("download", download, 3), ("persist", persist, 1)], queue_size=1)
+    asyncio.run(pipeline.run(source()))
+
+    assert max(peak) == 3
+    assert len(persisted) == 12
+    # the source is read ahead by the download workers and the two queues, not exhausted
+    assert persisted[0] <= 8
+    assert persisted[-1] == 12